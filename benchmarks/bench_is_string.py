@@ -0,0 +1,104 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare property value classification against the original byte loop implementation.
+
+Usage: python benchmarks/bench_is_string.py [file.dtb ...]
+
+Without arguments a synthetic DTB shaped like a SoC description is used.
+"""
+
+import os
+import sys
+import argparse
+from string import printable
+from struct import unpack_from
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fdt
+from fdt import DTB_BEGIN_NODE, DTB_PROP, DTB_END
+from generator import soc_tree
+
+
+def is_string_reference(data):
+    """ Original implementation of fdt.misc.is_string """
+    if not len(data):
+        return None
+    if data[-1] != 0:
+        return None
+    pos = 0
+    while pos < len(data):
+        posi = pos
+        while pos < len(data) and \
+              data[pos] != 0 and \
+              data[pos] in printable.encode() and \
+              data[pos] not in (ord('\r'), ord('\n')):
+            pos += 1
+        if data[pos] != 0 or pos == posi:
+            return None
+        pos += 1
+    return True
+
+
+def property_values(data):
+    """Get all raw property values of DTB structure block"""
+    header = fdt.Header.parse(data)
+    values = []
+    offset = header.off_dt_struct
+    while True:
+        tag = unpack_from(">I", data, offset)[0]
+        offset += 4
+        if tag == DTB_BEGIN_NODE:
+            offset = (data.index(b'\0', offset) + 4) & ~3
+        elif tag == DTB_PROP:
+            prop_size = unpack_from(">I", data, offset)[0]
+            prop_start = offset + 8
+            if header.version < 16 and prop_size >= 8:
+                prop_start = ((prop_start + 7) & ~0x7)
+            values.append(data[prop_start: prop_start + prop_size])
+            offset = (prop_start + prop_size + 3) & ~0x3
+        elif tag == DTB_END:
+            break
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help='DTB files (default: synthetic blob)')
+    parser.add_argument('-n', '--number', type=int, default=5, help='repetitions (default: 5)')
+    args = parser.parse_args()
+
+    blobs = []
+    for file in args.files:
+        with open(file, 'rb') as f:
+            blobs.append((file, f.read()))
+    if not blobs:
+        blobs.append(('synthetic', soc_tree().to_dtb()))
+
+    for name, data in blobs:
+        values = property_values(data)
+        for value in values:
+            assert bool(fdt.misc.is_string(value)) == bool(is_string_reference(value)), value
+        old = timeit(lambda: [is_string_reference(value) for value in values], number=args.number)
+        new = timeit(lambda: [fdt.misc.is_string(value) for value in values], number=args.number)
+        print("{}: {} props, {} bytes".format(name, len(values), len(data)))
+        print("  is_string:  reference {:.4f} s, current {:.4f} s, speed-up {:.1f}x".format(old, new, old / new))
+        parse = timeit(lambda: fdt.parse_dtb(data), number=args.number)
+        print("  parse_dtb:  {:.4f} s".format(parse))
+
+
+if __name__ == '__main__':
+    main()
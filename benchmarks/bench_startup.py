@@ -0,0 +1,110 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup benchmark of fdt package and pydtc tool.
+
+Usage: python benchmarks/bench_startup.py [--repeat N] [--save FILE] [--compare FILE]
+
+Reported is the best wall time of fresh interpreter processes (bare interpreter, import of fdt, pydtc todts
+of small DTB and pydtc --help) and the slowest imports of fdt package by -X importtime.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, ROOT_DIR)
+
+from generator import soc_tree
+
+
+def run_time(args, repeat):
+    """Get best wall time of process run"""
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def import_times(module, count=10):
+    """Get the slowest imports as list of (self time [us], cumulative time [us], module name)"""
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], env=env,
+                            check=True, stderr=subprocess.PIPE, universal_newlines=True)
+    items = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[0].split(':')[-1].strip().isdigit():
+            continue
+        items.append((int(fields[0].split(':')[-1]), int(fields[1]), fields[2].rstrip()))
+    return sorted(items, key=lambda item: item[1], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='process runs, the best is taken (default: 10)')
+    parser.add_argument('--save', help='save results into JSON file')
+    parser.add_argument('--compare', help='compare results with JSON file saved before')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='max allowed slow-down ratio against baseline (default: 1.25)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dtb_path = os.path.join(tmp_dir, 'small.dtb')
+        with open(dtb_path, 'wb') as f:
+            f.write(soc_tree(20).to_dtb())
+        dts_path = os.path.join(tmp_dir, 'small.dts')
+        commands = {
+            'python': [sys.executable, '-c', 'pass'],
+            'import_fdt': [sys.executable, '-c', 'import fdt'],
+            'pydtc_todts': [sys.executable, '-m', 'fdt.tool', 'todts', dts_path, dtb_path],
+            'pydtc_help': [sys.executable, '-m', 'fdt.tool', '--help'],
+        }
+        results = {}
+        print("{:<16} {:>10}".format('benchmark', 'time [ms]'))
+        for name, command in commands.items():
+            results[name] = run_time(command, args.repeat)
+            print("{:<16} {:>10.2f}".format(name, results[name] * 1000))
+
+    print("\n{:>10} {:>10}  {}".format('self [us]', 'cum. [us]', 'slowest imports of fdt'))
+    for self_time, cum_time, module in import_times('fdt'):
+        print("{:>10} {:>10} {}".format(self_time, cum_time, module))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = ["{}: {:.2f}x".format(name, value / baseline[name]) for name, value in results.items()
+                       if baseline.get(name) and value / baseline[name] > args.threshold]
+        for line in regressions:
+            print("REGRESSION: " + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
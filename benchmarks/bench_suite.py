@@ -0,0 +1,151 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark suite of parse/serialize/merge/diff paths.
+
+Usage: python benchmarks/bench_suite.py [--depth N] [--fanout N] [--props N] [--prop-size N] [--save FILE]
+                                        [--compare FILE] [file.dtb ...]
+
+Every operation runs on a random tree of given shape, on a SoC-shaped tree and on given DTB files. Reported
+are the best time of repeated runs, throughput relative to the DTB size and peak of traced memory allocations.
+With --compare the results are checked against saved baseline and the exit code is non-zero on regression.
+"""
+
+import os
+import sys
+import json
+import pickle
+import argparse
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fdt
+from generator import random_tree, soc_tree, modified_tree, fragments
+
+
+def operations(fdt_obj):
+    """Get benchmarked operations as name -> (setup, run) map, setup result is passed into run"""
+    blob = fdt_obj.to_dtb()
+    text = fdt_obj.to_dts()
+    other = modified_tree(fdt_obj)
+    other_blob = other.to_dtb()
+    # unpickled tree has no source blob, so it's serialized whole, the parsed one copies unmodified sub-trees
+    whole = pickle.loads(pickle.dumps(fdt_obj))
+    parsed = fdt.parse_dtb(blob)
+    return {
+        'parse_dtb': (lambda: blob, fdt.parse_dtb),
+        'parse_dts': (lambda: text, fdt.parse_dts),
+        'to_dtb': (lambda: whole, lambda obj: obj.to_dtb()),
+        'to_dtb_incremental': (lambda: parsed, lambda obj: obj.to_dtb()),
+        'to_dts': (lambda: fdt_obj, lambda obj: obj.to_dts()),
+        'patch_to_dtb': (lambda: fdt.parse_dtb(blob), patch),
+        'merge': (lambda: fdt.parse_dtb(blob), lambda obj: obj.merge(other)),
+        'merge_move': (lambda: (fdt.parse_dtb(blob), modified_tree(fdt_obj)),
+                       lambda objs: objs[0].merge(objs[1], move=True)),
+        'merge_fragments': (lambda: (fdt.parse_dtb(blob), fragments(fdt_obj)),
+                            lambda objs: [objs[0].merge(item, move=True) for item in objs[1]]),
+        # fresh trees, the node digests are computed by every run
+        'diff': (lambda: (fdt.parse_dtb(blob), fdt.parse_dtb(other_blob)), lambda objs: objs[0].diff(objs[1])),
+    }, len(blob)
+
+
+def patch(fdt_obj):
+    """Change single property of parsed FDT and serialize it"""
+    node = fdt_obj.rootnode
+    while node.nodes:
+        node = node.nodes[-1]
+    node.set_property(fdt.PropStrings('bootargs', ['console=ttyS1,115200']))
+    return fdt_obj.to_dtb()
+
+
+def measure(setup, run, repeat):
+    """Get best time of repeated runs and peak of allocated memory in bytes"""
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        start = perf_counter()
+        run(arg)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    arg = setup()
+    tracemalloc.start()
+    run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help='additional DTB files')
+    parser.add_argument('--depth', type=int, default=4, help='random tree depth (default: 4)')
+    parser.add_argument('--fanout', type=int, default=5, help='random tree sub-nodes per node (default: 5)')
+    parser.add_argument('--props', type=int, default=6, help='random tree properties per node (default: 6)')
+    parser.add_argument('--prop-size', type=int, default=8, help='random tree max words/bytes per value (default: 8)')
+    parser.add_argument('--soc-devices', type=int, default=1000, help='SoC tree device count (default: 1000)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='repetitions, the best is taken (default: 3)')
+    parser.add_argument('-k', '--only', action='append', help='run only given operation (repeatable)')
+    parser.add_argument('--save', help='save results into JSON file')
+    parser.add_argument('--compare', help='compare results with JSON file saved before')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='max allowed slow-down or memory growth ratio against baseline (default: 1.25)')
+    args = parser.parse_args()
+
+    fixtures = [
+        ('random', random_tree(args.depth, args.fanout, args.props, args.prop_size)),
+        ('soc', soc_tree(args.soc_devices)),
+    ]
+    for file in args.files:
+        with open(file, 'rb') as f:
+            fixtures.append((os.path.basename(file), fdt.parse_dtb(f.read())))
+
+    results = {}
+    print("{:<32} {:>10} {:>10} {:>12}".format('benchmark', 'time [ms]', 'MB/s', 'peak [KiB]'))
+    for fixture, fdt_obj in fixtures:
+        ops, size = operations(fdt_obj)
+        for name, (setup, run) in ops.items():
+            if args.only and name not in args.only:
+                continue
+            elapsed, peak = measure(setup, run, args.repeat)
+            key = '{}:{}'.format(fixture, name)
+            results[key] = {'time': elapsed, 'peak': peak, 'size': size}
+            print("{:<32} {:>10.2f} {:>10.2f} {:>12.1f}".format(key, elapsed * 1000, size / elapsed / 2**20,
+                                                               peak / 1024))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = []
+        for key, result in results.items():
+            base = baseline.get(key)
+            if base is None or base['size'] != result['size']:
+                continue
+            for item in ('time', 'peak'):
+                ratio = result[item] / base[item] if base[item] else 1.0
+                if ratio > args.threshold:
+                    regressions.append("{} {}: {:.2f}x".format(key, item, ratio))
+        for line in regressions:
+            print("REGRESSION: " + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
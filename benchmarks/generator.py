@@ -0,0 +1,121 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic device trees for benchmarks"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fdt
+
+
+def random_tree(depth=3, fanout=4, props=5, prop_size=8, seed=1):
+    """Create FDT with uniform tree of given depth and fan-out, with random mix of property types.
+
+    The prop_size is maximal count of words/bytes in one property value.
+    """
+    rnd = random.Random(seed)
+
+    def create_node(name, level):
+        node = fdt.Node(name)
+        for i in range(props):
+            kind = rnd.randrange(4)
+            if kind == 0:
+                node.append(fdt.PropStrings('str-{}'.format(i), ['okay', 'value{}'.format(rnd.randrange(1000))]))
+            elif kind == 1:
+                words = [rnd.randrange(2**32) for _ in range(rnd.randint(1, prop_size))]
+                node.append(fdt.PropWords('words-{}'.format(i), words))
+            elif kind == 2:
+                data = bytes(rnd.randrange(256) for _ in range(rnd.randint(1, prop_size)))
+                node.append(fdt.PropBytes('bytes-{}'.format(i), data))
+            else:
+                node.append(fdt.Property('flag-{}'.format(i)))
+        if level < depth:
+            for i in range(fanout):
+                node.append(create_node('node{}@{:x}'.format(i, i * 0x1000), level + 1))
+        return node
+
+    return create_fdt(create_node('/', 0))
+
+
+def soc_tree(count=500):
+    """Create FDT shaped like a SoC description (typical mix of strings, cells and byte values)"""
+    soc = fdt.Node('soc', props=[fdt.PropWords('#address-cells', [1]),
+                                 fdt.PropWords('#size-cells', [1]),
+                                 fdt.PropStrings('compatible', ['simple-bus']),
+                                 fdt.Property('ranges')])
+    for i in range(count):
+        node = fdt.Node('device@{:x}'.format(0x10000000 + i * 0x1000), props=[
+            fdt.PropStrings('compatible', ['vendor,soc-dev{}'.format(i % 7), 'vendor,soc-dev']),
+            fdt.PropWords('reg', [0x10000000 + i * 0x1000, 0x1000]),
+            fdt.PropWords('interrupts', [0, i % 256, 4]),
+            fdt.PropWords('clocks', [1, i % 64, 1, 3]),
+            fdt.PropStrings('clock-names', ['ipg', 'per']),
+            fdt.PropStrings('status', ['okay' if i % 3 else 'disabled'])])
+        if i % 10 == 0:
+            node.append(fdt.PropBytes('mac-address', [0x00, 0x04, 0x9F, i % 256, 0x00, 0x01]))
+        if i % 50 == 0:
+            node.append(fdt.PropBytes('firmware', bytes(range(256)) * 16 + b'\x01'))
+        soc.append(node)
+    root = fdt.Node('/', props=[fdt.PropStrings('compatible', ['vendor,board', 'vendor,soc']),
+                                fdt.PropStrings('model', ['Vendor Board']),
+                                fdt.PropWords('#address-cells', [1]),
+                                fdt.PropWords('#size-cells', [1])],
+                    nodes=[fdt.Node('chosen', props=[fdt.PropStrings('bootargs', ['console=ttyS0,115200'])]),
+                           fdt.Node('memory@80000000', props=[fdt.PropStrings('device_type', ['memory']),
+                                                              fdt.PropWords('reg', [0x80000000, 0x40000000])]),
+                           soc])
+    return create_fdt(root)
+
+
+def modified_tree(fdt_obj, ratio=0.1, seed=2):
+    """Create modified copy of FDT for diff and merge, the ratio of nodes gets new or changed properties"""
+    rnd = random.Random(seed)
+    new_fdt = fdt.parse_dtb(fdt_obj.to_dtb())
+    stack = [new_fdt.rootnode]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.nodes)
+        if rnd.random() < ratio:
+            node.set_property(fdt.PropWords('new-prop', [rnd.randrange(2**32)]))
+            if node.props:
+                node.set_property(fdt.PropStrings(node.props[0].name, ['changed']))
+    return new_fdt
+
+
+def fragments(fdt_obj, count=50, seed=3):
+    """Create small FDT fragments (like included *.dts files), each one sets a property of a random node"""
+    rnd = random.Random(seed)
+    paths = [path for path, obj in fdt_obj.walk() if isinstance(obj, fdt.Property)]
+    items = []
+    for i in range(count):
+        names = rnd.choice(paths).split('/')[1:-1]
+        node = fdt.Node(names[-1] if names else '/', props=[fdt.PropWords('fragment', [i])])
+        for name in reversed(names[:-1]):
+            node = fdt.Node(name, nodes=[node])
+        if names:
+            node = fdt.Node('/', nodes=[node])
+        items.append(create_fdt(node))
+    return items
+
+
+def create_fdt(rootnode, version=17):
+    fdt_obj = fdt.FDT()
+    fdt_obj.header.version = version
+    fdt_obj.entries = [{'address': 0x80000000, 'size': 0x100000}]
+    fdt_obj.rootnode = rootnode
+    return fdt_obj
@@ -12,29 +12,73 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
-
 from .node import Node
-from .prop import Property, PropBytes, PropWords, PropStrings
+from .prop import Property, PropBytes, PropWords, PropStrings, PROP_TYPES, get_prop_type
 from .head import Header, DTB_BEGIN_NODE, DTB_END_NODE, DTB_NOP, DTB_PROP, DTB_END
-from .misc import strip_comments, split_to_lines, get_version_info, extract_string
+from .misc import extract_string, StringTable
+
+# Attributes of submodules loaded on first access (keeps the start of pydtc fast), name -> submodule
+LAZY_ATTRS = {
+    'FDTView': 'view',
+    'NodeView': 'view',
+    'FDTBlob': 'blob',
+    'iter_dtb': 'stream',
+    'filter_nodes': 'stream',
+    'write_dtb': 'stream',
+    'DTBWriter': 'stream',
+    'PathIndex': 'index',
+    'PhandleIndex': 'index',
+    'Parser': 'parser',
+    'Cache': 'cache',
+    'MemoryCache': 'cache',
+    'DTBInfo': 'info',
+    'scan': 'info',
+}
 
 __author__  = "Martin Olejar"
 __contact__ = "martin.olejar@gmail.com"
 __version__ = "0.1.0"
 __license__ = "Apache 2.0"
 __status__  = "Development"
+
+
+def __getattr__(name):
+    """Load lazy attribute from its submodule (PEP 562)"""
+    module = LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
 __all__     = [
     # FDT Classes
     'FDT',
     'Node',
     'Header',
+    'FDTView',
+    'NodeView',
+    'FDTBlob',
+    'PathIndex',
+    'PhandleIndex',
+    'Cache',
+    'MemoryCache',
+    'DTBInfo',
+    'DTBWriter',
     'PropBytes',
     'PropWords',
     'PropStrings',
+    'PROP_TYPES',
     # core methods
     'parse_dts',
-    'parse_dtb'
+    'parse_dtb',
+    'get_prop_type',
+    'iter_dtb',
+    'filter_nodes',
+    'write_dtb',
+    'scan'
 ]
 
 
@@ -45,87 +89,140 @@ class FDT(object):
         self.header = Header()
         self.entries = []
         self.rootnode = None
+        self.index = None
+        self._node_map = {}
+        self._phandles = None
+        # (blob, strings block) of parsed DTB, the unmodified nodes are copied from it by to_dtb()
+        self._source = None
+
+    def __getstate__(self):
+        """Pickled without the source blob and the indexes (the unpickled FDT is exported to DTB whole)"""
+        state = self.__dict__.copy()
+        state['_source'] = None
+        state['_phandles'] = None
+        return state
+
+    @property
+    def phandles(self):
+        """Phandle and label index of the tree (PhandleIndex), built on first use and refreshed on lookup miss"""
+        if self._phandles is None or self._phandles._root is not self.rootnode:
+            from .index import PhandleIndex
+            self._phandles = PhandleIndex(self.rootnode)
+        return self._phandles
 
     def info(self):
         pass
 
+    @staticmethod
+    def open_view(data, index=None):
+        """Open read-only lazy view of DTB file path or bytes-like object"""
+        from .view import FDTView
+        return FDTView(data, index)
+
+    def _is_node_at(self, node, path):
+        """Check if node is still attached into the tree at given path"""
+        names = []
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return node is self.rootnode and '/' + '/'.join(names[::-1]) == path
+
+    def get_node(self, path):
+        """Get node obj by absolute path, nodes are looked up in path map collected by parse_dtb() first"""
+        if self.rootnode is None:
+            return None
+        path = '/' + path.strip('/')
+        node = self._node_map.get(path)
+        if node is not None and self._is_node_at(node, path):
+            return node
+        node = self.rootnode.get_subnode(path[1:])
+        if node is not None:
+            self._node_map[path] = node
+        return node
+
+    def get_property(self, path):
+        """Get property obj by absolute path"""
+        node_path, _, prop_name = path.rpartition('/')
+        node = self.get_node(node_path)
+        return None if node is None else node.get_property(prop_name)
+
+    def get_node_by_phandle(self, phandle):
+        """Get node obj by phandle value, None if not found"""
+        return self.phandles.get_node(phandle)
+
+    def get_node_by_label(self, label):
+        """Get node obj by label (DTS label or /__symbols__ entry), None if not found"""
+        return self.phandles.get_label(label)
+
+    def resolve(self, prop, cells=None):
+        """Resolve phandle-bearing property obj or its absolute path into list of (node, argument cells) pairs,
+           see PhandleIndex.resolve()
+        """
+        if isinstance(prop, str):
+            path, prop = prop, self.get_property(prop)
+            if prop is None:
+                raise Exception("Property \"{}\" doesn't exist".format(path))
+        return self.phandles.resolve(prop, cells)
+
     def diff(self, target_fdt):
-        # prepare local hash table
-        local_table = {}
-        for i in self.walk():
-            local_table[i[0]] = i[1]
-        # prepare target table
-        target_table = {}
-        for i in target_fdt.walk():
-            target_table[i[0]] = i[1]
-        # 1.st phase of creating diff table
-        # by comparing 'local_table' against 'target_table'.
-        # if key is present in both tables, drop it from 
-        # 'target_table' to simplify second phase, so it 
-        #  will eventualy evaluate only uncompared items. 
-        diff_table = {}
-        for local_key in local_table:
-            local_obj = local_table[local_key]
-            if local_key in target_table:
-                # objects are the same, drop from 'target_table'
-                target_obj = target_table[local_key]
-                if target_obj == local_obj:
-                    del target_table[local_key]
-                # objects are not equal, store both objects, drop from 'target_table'
-                else:
-                    del target_table[local_key]
-                    diff_table[local_key] = {
-                        'status':   'different',
-                        'local':    local_obj,
-                        'target':   target_obj
-                    }
-            else:
-                # 'local_key' is not present in 'target_table'
-                diff_table[local_key] = {
-                    'status':   'missing',
-                    'local':    local_obj
-                }
-        # 2.nd phase, iterate over items that exists only in 'target_table'
-        # if both fdt files are the same, this loop won't be executed
-        for target_key in target_table:
-            target_obj = target_table[target_key]
-            diff_table[target_key] = {
-                'status':   'added',
-                'target':    target_obj
-            }
-        return diff_table
+        """Compare with target FDT, returns {path: diff item} map, see iter_diff()"""
+        return dict(self.iter_diff(target_fdt))
+
+    def iter_diff(self, target_fdt):
+        """Walk both trees in lockstep and yield (path, diff item) of differences in tree order.
+
+        Property path is in '<node path>/.<name>' format. The item 'status' is 'missing' for objects present
+        only in this FDT ('local' obj), 'added' for objects present only in target FDT ('target' obj) and
+        'different' for properties with the same name and different value (both objects). Node present only
+        on one side is reported once as whole sub-tree, identical sub-trees are skipped by comparing digests.
+        """
+        todo_stack = [('/', self.rootnode, target_fdt.rootnode)]
+        while todo_stack:
+            path, local_node, target_node = todo_stack.pop()
+            if target_node is None:
+                if local_node is not None:
+                    yield (path, {'status': 'missing', 'local': local_node})
+                continue
+            if local_node is None:
+                yield (path, {'status': 'added', 'target': target_node})
+                continue
+            if local_node.digest == target_node.digest:
+                continue
+            basepath = '' if path == '/' else path
+            for name, local_prop in local_node._props.items():
+                target_prop = target_node._props.get(name)
+                if target_prop is None:
+                    yield (basepath + '/.' + name, {'status': 'missing', 'local': local_prop})
+                elif target_prop != local_prop:
+                    yield (basepath + '/.' + name, {'status': 'different', 'local': local_prop,
+                                                    'target': target_prop})
+            for name, target_prop in target_node._props.items():
+                if name not in local_node._props:
+                    yield (basepath + '/.' + name, {'status': 'added', 'target': target_prop})
+            sub_nodes = [(basepath + '/' + name, node, target_node._nodes.get(name))
+                         for name, node in local_node._nodes.items()]
+            sub_nodes += [(basepath + '/' + name, None, node)
+                          for name, node in target_node._nodes.items() if name not in local_node._nodes]
+            todo_stack.extend(reversed(sub_nodes))
 
     def walk(self):
-        todo_stack = []
-        condition = True
-        tmp_object = self.rootnode
-        tmp_object.basepath = ''
-        while True:
-            basepath = tmp_object.basepath
-            if isinstance(tmp_object, Node):
-                # push current childs on 'todo' stack
-                if tmp_object.nodes:
-                    for n in tmp_object.nodes:
-                        n.basepath = basepath + '/' + tmp_object.name
-                        todo_stack.append(n)
-                # push current properties on 'todo' stack
-                if tmp_object.props:
-                    for n in tmp_object.props:
-                        n.basepath = basepath + '/' + tmp_object.name
-                        todo_stack.append(n)
-                # yield if current object is an empty node
-                if not tmp_object.nodes and not tmp_object.props:
-                    yield (tmp_object.basepath + '/' + tmp_object.name, tmp_object)
-            # yield if current object is an property
-            if isinstance(tmp_object, Property):
-                yield (tmp_object.basepath + '/.' + tmp_object.name, tmp_object)
-            # terminate if 'todo' stack is empty
-            if not todo_stack:
-                break
-            # take another node from 'todo' stack
-            tmp_object = todo_stack.pop()
-
-    def merge(self, fdt):
+        """Walk the tree, yield (path, object) of properties and empty nodes. Property path is
+           in '<node path>/.<name>' format to distinguish it from sub-node with the same name.
+        """
+        todo_stack = [('', self.rootnode)]
+        while todo_stack:
+            basepath, node = todo_stack.pop()
+            for prop in node.props:
+                yield (basepath + '/.' + prop.name, prop)
+            if not node.props and not node.nodes:
+                yield (basepath if basepath else '/', node)
+            for sub_node in reversed(node.nodes):
+                todo_stack.append((basepath + '/' + sub_node.name, sub_node))
+
+    def merge(self, fdt, move=False):
+        """Merge given FDT into this one, with move=True the nodes and properties are moved out of given FDT
+           instead of copying (useful for fragments which are not used after merge)
+        """
         if not isinstance(fdt, FDT):
             raise Exception("Error")
         if self.header.version is None:
@@ -135,41 +232,69 @@ class FDT(object):
                fdt.header.version > self.header.version:
                 self.header.version = fdt.header.version
         if fdt.entries:
+            entries = {entry['address']: entry for entry in self.entries}
             for in_entry in fdt.entries:
-                exist = False
-                for index in range(len(self.entries)):
-                    if self.entries[index]['address'] == in_entry['address']:
-                        self.entries[index]['address'] = in_entry['size']
-                        exist = True
-                        break
-                if not exist:
-                    self.entries.append(in_entry)
-        self.rootnode.merge(fdt.rootnode)
+                entry = entries.get(in_entry['address'])
+                if entry is not None:
+                    entry['size'] = in_entry['size']
+                else:
+                    entry = entries[in_entry['address']] = dict(in_entry)
+                    self.entries.append(entry)
+        self.rootnode.merge(fdt.rootnode, move=move)
+
+    def apply_overlay(self, overlay):
+        """Apply overlay FDT (parsed *.dtbo or *.dts with /plugin/), see apply_overlays()"""
+        self.apply_overlays([overlay])
+
+    def apply_overlays(self, overlays):
+        """Apply overlay FDTs in one pass, the phandle and label index of this tree is built just once.
+
+        Fragment '__overlay__' nodes are merged into the nodes referenced by 'target' phandle or 'target-path',
+        phandles are resolved by '__fixups__' (symbols of this tree) and '__local_fixups__' (overlay nodes)
+        and labels of merged nodes are added into '__symbols__'. The overlays are not modified.
+        """
+        from .overlay import apply_overlays
+        apply_overlays(self.rootnode, [overlay.rootnode for overlay in overlays], self.phandles)
 
     def to_dts(self, tabsize=4):
         """Store FDT Object into string format (DTS)"""
-        result = "/dts-v1/;\n"
-        result += "// version: {}\n".format(self.header.version)
-        result += "// last_comp_version: {}\n".format(self.header.last_comp_version)
-        if self.header.version >= 2:
-            result += "// boot_cpuid_phys: 0x{:X}\n".format(self.header.boot_cpuid_phys)
-        result += '\n'
+        return ''.join(self.iter_dts(tabsize))
+
+    def iter_dts(self, tabsize=4):
+        """Get FDT Object in string format (DTS) as generator of text chunks"""
+        yield "/dts-v1/;\n"
+        if self.header.version is not None:
+            yield "// version: {}\n".format(self.header.version)
+            yield "// last_comp_version: {}\n".format(self.header.last_comp_version)
+            if self.header.version >= 2:
+                yield "// boot_cpuid_phys: 0x{:X}\n".format(self.header.boot_cpuid_phys)
+        yield '\n'
         if self.entries:
             for entry in self.entries:
-                result += "/memreserve/ "
+                result  = "/memreserve/ "
                 result += "{:#x} ".format(entry['address']) if entry['address'] else "0 "
                 result += "{:#x}".format(entry['size']) if entry['size'] else "0"
                 result += ";\n"
+                yield result
         if self.rootnode is not None:
-            result += self.rootnode.to_dts(tabsize)
-        return result
+            yield from self.rootnode.iter_dts(tabsize)
+
+    def write_dts(self, fp, tabsize=4):
+        """Write FDT Object in string format (DTS) into text file object"""
+        for chunk in self.iter_dts(tabsize):
+            fp.write(chunk)
 
     def to_dtb(self, version=None, last_comp_version=None, boot_cpuid_phys=None):
-        """Export FDT Object into Binary Blob format (DTB)"""
+        """Export FDT Object into Binary Blob format (DTB).
+
+        For FDT created by parse_dtb() (version >= 16) only the modified nodes are serialized, the unmodified
+        sub-trees are copied from the parsed blob and its strings block is extended with new names. Values
+        changed other way than by property methods or item assignment require Property.invalidate().
+        """
         if self.rootnode is None:
             return None
 
-        from struct import pack
+        from struct import pack_into
 
         if version is not None:
             self.header.version = version
@@ -180,119 +305,74 @@ class FDT(object):
         if self.header.version is None:
             raise Exception("DTB Version must be specified !")
 
-        blob_entries = bytes()
-        if self.entries:
-            for entry in self.entries:
-                blob_entries += pack('>QQ', entry['address'], entry['size'])
-        blob_entries += pack('>QQ', 0, 0)
-        blob_data_start = self.header.size + len(blob_entries)
-        (blob_data, blob_strings, data_pos) = self.rootnode.to_dtb('', blob_data_start, self.header.version)
-        blob_data += pack('>I', DTB_END)
-        self.header.size_dt_strings = len(blob_strings)
-        self.header.size_dt_struct = len(blob_data)
+        source = None
+        strings = StringTable()
+        if self._source is not None and self.header.version >= 16:
+            # the unmodified nodes refer into original strings block
+            source = self._source[0]
+            strings = StringTable(self._source[1])
+        # sizing pass: get layout of the blob and collect strings table
+        blob_data_start = self.header.size + 16 * (len(self.entries) + 1)
+        blob_data_end = self.rootnode.dtb_size(blob_data_start, strings, self.header.version, source) + 4
+        self.header.size_dt_strings = len(strings)
+        self.header.size_dt_struct = blob_data_end - blob_data_start
         self.header.off_mem_rsvmap = self.header.size
         self.header.off_dt_struct = blob_data_start
-        self.header.off_dt_strings = blob_data_start + len(blob_data)
-        self.header.total_size = blob_data_start + len(blob_data) + len(blob_strings)
-        blob_header = self.header.export()
-        return blob_header + blob_entries + blob_data + blob_strings.encode('ascii')
+        self.header.off_dt_strings = blob_data_end
+        self.header.total_size = blob_data_end + len(strings)
+        # write pass: fill preallocated blob
+        blob = bytearray(self.header.total_size)
+        blob[0: self.header.size] = self.header.export()
+        offset = self.header.size
+        for entry in self.entries:
+            pack_into('>QQ', blob, offset, entry['address'], entry['size'])
+            offset += 16
+        offset = self.rootnode.dtb_write(blob, blob_data_start, strings, self.header.version, source)
+        pack_into('>I', blob, offset, DTB_END)
+        blob[blob_data_end:] = strings.export()
+        return bytes(blob)
 
 
-def parse_dts(text, root_dir=''):
-    """Parse DTS text file and create FDT Object"""
-    ver = get_version_info(text)
-    text = strip_comments(text)
-    dts_lines = split_to_lines(text)
-    fdt_obj = FDT()
-    if 'version' in ver:
-        fdt_obj.header.version = ver['version']
-    if 'last_comp_version' in ver:
-        fdt_obj.header.last_comp_version = ver['last_comp_version']
-    if 'boot_cpuid_phys' in ver:
-        fdt_obj.header.boot_cpuid_phys = ver['boot_cpuid_phys']
-    # parse entries
-    fdt_obj.entries = []
-    for line in dts_lines:
-        if line.endswith('{'):
-            break
-        if line.startswith('/memreserve/'):
-            line = line.strip(';')
-            line = line.split()
-            if len(line) != 3 :
-                raise Exception()
-            fdt_obj.entries.append({'address': int(line[1], 0), 'size': int(line[2], 0)})
-    # parse nodes
-    curnode = None
-    fdt_obj.rootnode = None
-    for line in dts_lines:
-        if line.endswith('{'):
-            # start node
-            node_name = line.split()[0]
-            new_node = Node(node_name)
-            if fdt_obj.rootnode is None:
-                fdt_obj.rootnode = new_node
-            if curnode is not None:
-                curnode.append(new_node)
-                new_node.parent = curnode
-            curnode = new_node
-        elif line.endswith('}'):
-            # end node
-            if curnode is not None:
-                curnode = curnode.parent
-        else:
-            # properties
-            if line.find('=') == -1:
-                prop_name = line
-                prop_obj = Property(prop_name)
-            else:
-                line = line.split('=', maxsplit=1)
-                prop_name = line[0].rstrip(' ')
-                prop_value = line[1].lstrip(' ')
-                if prop_value.startswith('<'):
-                    prop_obj = PropWords(prop_name)
-                    prop_value = prop_value.replace('<', '').replace('>', '')
-                    for prop in prop_value.split():
-                        prop_obj.append(int(prop, 0))
-                elif prop_value.startswith('['):
-                    prop_obj = PropBytes(prop_name)
-                    prop_value = prop_value.replace('[', '').replace(']', '')
-                    for prop in prop_value.split():
-                        prop_obj.append(int(prop, 16))
-                elif prop_value.startswith('/incbin/'):
-                    prop_value = prop_value.replace('/incbin/("', '').replace('")', '')
-                    prop_value = prop_value.split(',')
-                    file_path  = os.path.join(root_dir, prop_value[0].strip())
-                    file_offset = int(prop_value.strip(), 0) if len(prop_value) > 1 else 0
-                    file_size = int(prop_value.strip(), 0) if len(prop_value) > 2 else 0
-                    if file_path is None or not os.path.exists(file_path):
-                        raise Exception("File path doesn't exist: {}".format(file_path))
-                    with open(file_path, "rb") as f:
-                        f.seek(file_offset)
-                        data = f.read(file_size) if file_size > 0 else f.read()
-                    prop_obj = PropBytes(prop_name, data)
-                elif prop_value.startswith('/plugin/'):
-                    raise NotImplementedError("Not implemented property value: /plugin/")
-                elif prop_value.startswith('/bits/'):
-                    raise NotImplementedError("Not implemented property value: /bits/")
-                else:
-                    prop_obj = PropStrings(prop_name)
-                    for prop in prop_value.split('",'):
-                        prop = prop.replace('"', "")
-                        prop = prop.strip()
-                        prop_obj.append(prop)
-            if curnode is not None:
-                curnode.append(prop_obj)
+def parse_dts(text, root_dir='', symbols=False):
+    """Parse DTS text file and create FDT Object, with symbols=True the labels are exported into /__symbols__
+       node (required for the base trees of overlays, always done for /plugin/)
+    """
+    from .parser import Parser
+    return create_fdt(Parser(root_dir, symbols).parse(text).finish())
+
 
+def create_fdt(parser):
+    """Create FDT Object from finished DTS parser"""
+    fdt_obj = FDT()
+    if 'version' in parser.version:
+        fdt_obj.header.version = parser.version['version']
+    if 'last_comp_version' in parser.version:
+        fdt_obj.header.last_comp_version = parser.version['last_comp_version']
+    if 'boot_cpuid_phys' in parser.version:
+        fdt_obj.header.boot_cpuid_phys = parser.version['boot_cpuid_phys']
+    fdt_obj.entries = parser.entries
+    fdt_obj.rootnode = parser.rootnode
     return fdt_obj
 
 
-def parse_dtb(data):
-    """ Parse FDT Binary Blob and create FDT Object """
+def parse_dtb(data, index=False, types=PROP_TYPES):
+    """ Parse FDT Binary Blob and create FDT Object.
+        Collect node path index (FDT.index) and path map for FDT.get_node() if index is True.
+        Values of properties listed in types map (see PROP_TYPES) are decoded directly as given type, the other
+        ones (all if types is None) are classified by their content.
+    """
     from struct import unpack_from
 
     fdt_obj = FDT()
     # parse header
     fdt_obj.header = Header.parse(data)
+    # spans of nodes are kept for to_dtb(), the blob must not change
+    spans = fdt_obj.header.version >= 16
+    if spans:
+        data = data if isinstance(data, bytes) else bytes(data)
+        off_dt_strings = fdt_obj.header.off_dt_strings
+        fdt_obj._source = (data, data[off_dt_strings: off_dt_strings + fdt_obj.header.size_dt_strings])
+        starts = []
     # parse entries
     offset = fdt_obj.header.off_mem_rsvmap
     aa = data[offset:]
@@ -304,6 +384,12 @@ def parse_dtb(data):
         fdt_obj.entries.append(entrie)
     # parse nodes
     curnode = None
+    curpath = []
+    # (name, value type) of properties by offset in strings block, every name is resolved once
+    prop_items = {}
+    if index:
+        from .index import PathIndex
+        fdt_obj.index = PathIndex(fdt_obj.header.total_size)
     offset = fdt_obj.header.off_dt_struct
     while True:
         if len(data) < (offset + 4):
@@ -313,9 +399,17 @@ def parse_dtb(data):
         offset += 4
         if tag == DTB_BEGIN_NODE:
             node_name = extract_string(data, offset)
+            if index:
+                curpath.append(node_name)
+                node_path = '/' + '/'.join(curpath[1:])
+                fdt_obj.index.add(node_path, offset - 4)
+            if spans:
+                starts.append(offset - 4)
             offset = ((offset + len(node_name) + 4) & ~3)
             if not node_name: node_name = '/'
             new_node = Node(node_name)
+            if index:
+                fdt_obj._node_map[node_path] = new_node
             if fdt_obj.rootnode is None:
                 fdt_obj.rootnode = new_node
             if curnode is not None:
@@ -324,18 +418,28 @@ def parse_dtb(data):
             curnode = new_node
         elif tag == DTB_END_NODE:
             if curnode is not None:
+                if spans:
+                    curnode._span = (data, starts.pop(), offset)
                 curnode = curnode.parent
+            if index:
+                curpath.pop()
         elif tag == DTB_PROP:
             prop_size, prop_string_pos, = unpack_from(">II", data, offset)
             prop_start = offset + 8
             if fdt_obj.header.version < 16 and prop_size >= 8:
                 prop_start = ((prop_start + 7) & ~0x7)
-            prop_name = extract_string(data, fdt_obj.header.off_dt_strings + prop_string_pos)
+            prop_item = prop_items.get(prop_string_pos)
+            if prop_item is None:
+                prop_name = extract_string(data, fdt_obj.header.off_dt_strings + prop_string_pos)
+                prop_item = (prop_name, None if types is None else get_prop_type(prop_name, types))
+                prop_items[prop_string_pos] = prop_item
             prop_raw_value = data[prop_start: prop_start + prop_size]
             offset = prop_start + prop_size
             offset = ((offset + 3) & ~0x3)
             if curnode is not None:
-                curnode.append(Property.create(prop_name, prop_raw_value))
+                curnode.append(Property.create(prop_item[0], prop_raw_value, prop_item[1]))
+        elif tag == DTB_NOP:
+            pass
         elif tag == DTB_END:
             break
         else:
@@ -0,0 +1,103 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asyncio API for bulk loading of DTB files.
+
+The files are read in the default executor of event loop (threads) and parsed in the given executor, so the file
+I/O of next files overlaps with parsing. Parsing is CPU bound, so with the default thread executor it doesn't run
+in parallel; ProcessPoolExecutor does, but parsed FDT objects are pickled back which costs about half of parsing.
+"""
+
+import os
+import asyncio
+
+from . import parse_dtb
+from .head import Header
+
+
+def read_dtb(path):
+    """Read DTB file, the header is checked before the whole file is read"""
+    with open(path, 'rb') as f:
+        data = f.read(Header.MAX_SIZE)
+        header = Header.parse(data)
+        header.check(os.fstat(f.fileno()).st_size)
+        return data + f.read(header.total_size - len(data))
+
+
+async def load_dtb(path, executor=None, index=False):
+    """Read and parse DTB file, returns FDT object"""
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, read_dtb, path)
+    return await loop.run_in_executor(executor, parse_dtb, data, index)
+
+
+async def _load_items(items, concurrency, executor, index):
+    """Load (key, path) items by concurrent workers, yields (key, path, FDT object or Exception)"""
+    queue = asyncio.Queue(concurrency)
+    items = iter(items)
+
+    async def worker():
+        # all workers share one iterator, so no more than concurrency files are loaded at once
+        for key, path in items:
+            try:
+                result = await load_dtb(path, executor, index)
+            except Exception as e:
+                result = e
+            await queue.put((key, path, result))
+        await queue.put(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        running = concurrency
+        while running:
+            item = await queue.get()
+            if item is None:
+                running -= 1
+            else:
+                yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def iter_load(paths, concurrency=8, executor=None, index=False, return_exceptions=False):
+    """Load DTB files, yields (path, FDT object) as they are completed. If return_exceptions is True, the exception
+       of failed file is yielded in place of FDT object, else it's raised. Use contextlib.aclosing() to stop
+       the loading when the iteration is left before the end.
+    """
+    results = _load_items(((path, path) for path in paths), concurrency, executor, index)
+    try:
+        async for _, path, result in results:
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            yield path, result
+    finally:
+        # stop the workers now, not when the generator is collected
+        await results.aclose()
+
+
+async def load_many(paths, concurrency=8, executor=None, index=False, return_exceptions=False):
+    """Load DTB files, returns list of FDT objects in order of paths (see iter_load())"""
+    paths = list(paths)
+    results = [None] * len(paths)
+    items = _load_items(enumerate(paths), concurrency, executor, index)
+    try:
+        async for i, _, result in items:
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            results[i] = result
+    finally:
+        await items.aclose()
+    return results
@@ -0,0 +1,229 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mmap import mmap, ACCESS_WRITE
+from struct import pack, pack_into, unpack_from
+
+from .head import Header, DTB_BEGIN_NODE, DTB_END_NODE, DTB_NOP, DTB_PROP, DTB_END
+
+
+def raw_value(value):
+    """Get raw DTB value of bytes-like, string, 32-bit word or list of words"""
+    if isinstance(value, str):
+        return value.encode('ascii') + b'\0'
+    if isinstance(value, int):
+        return pack('>I', value)
+    if isinstance(value, (list, tuple)):
+        return pack('>{}I'.format(len(value)), *value)
+    return bytes(value)
+
+
+def name_eq(node_name, name):
+    """Check node name, the unit address may be omitted in the name"""
+    return node_name == name or ('@' not in name and node_name.partition('@')[0] == name)
+
+
+class FDTBlob(object):
+    """In-place editor of DTB blob (like libfdt fdt_setprop_inplace(), fdt_nop_property() and fdt_nop_node()).
+
+    The blob is never resized, so values can be changed only to the ones of the same size and the removed
+    properties and nodes are overwritten with DTB_NOP tags. Nodes are addressed by path or by offset of their
+    DTB_BEGIN_NODE tag, which stays valid after all edits.
+    """
+
+    @property
+    def data(self):
+        return self._data
+
+    def __init__(self, data):
+        """Init with file path (memory mapped for writing) or writable bytes-like object (bytes are copied)"""
+        self._mmap = None
+        if isinstance(data, str):
+            with open(data, 'r+b') as f:
+                self._mmap = mmap(f.fileno(), 0, access=ACCESS_WRITE)
+            data = self._mmap
+        elif isinstance(data, bytes):
+            data = bytearray(data)
+        self._data = data
+        self.header = Header.parse(data)
+        self._old_version = self.header.version < 16
+        self._names = {}
+        self._offsets = {'/': self._root_offset()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Flush and close memory mapped file"""
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+    def _root_offset(self):
+        offset = self.header.off_dt_struct
+        while unpack_from(">I", self._data, offset)[0] == DTB_NOP:
+            offset += 4
+        if unpack_from(">I", self._data, offset)[0] != DTB_BEGIN_NODE:
+            raise Exception("Invalid structure block, root node expected at offset {}".format(offset))
+        return offset
+
+    def _get_string(self, offset):
+        """Get string from strings block (cached)"""
+        name = self._names.get(offset)
+        if name is None:
+            start = self.header.off_dt_strings + offset
+            name = bytes(self._data[start: self._data.find(b'\0', start)]).decode('ascii')
+            self._names[offset] = name
+        return name
+
+    def _next_tag(self, offset):
+        """Get (tag, offset of its content, offset of the next tag) for tag at given offset"""
+        data = self._data
+        tag = unpack_from(">I", data, offset)[0]
+        start = offset + 4
+        if tag == DTB_BEGIN_NODE:
+            return tag, start, (data.find(b'\0', start) + 4) & ~3
+        if tag == DTB_PROP:
+            prop_size = unpack_from(">I", data, start)[0]
+            prop_start = start + 8
+            if self._old_version and prop_size >= 8:
+                prop_start = (prop_start + 7) & ~0x7
+            return tag, start, (prop_start + prop_size + 3) & ~0x3
+        if tag in (DTB_END_NODE, DTB_NOP):
+            return tag, start, start
+        if tag == DTB_END:
+            raise Exception("Unexpected end of structure block")
+        raise Exception("Unknown Tag: {}".format(tag))
+
+    def _node_offset(self, node):
+        """Get node offset from path or offset"""
+        if isinstance(node, int):
+            if unpack_from(">I", self._data, node)[0] != DTB_BEGIN_NODE:
+                raise Exception("No node at offset {}".format(node))
+            return node
+        offset = self.find_node_offset(node)
+        if offset is None:
+            raise Exception("Node \"{}\" doesn't exist".format(node))
+        return offset
+
+    def _node_end(self, offset):
+        """Get offset behind DTB_END_NODE tag of node"""
+        depth = 0
+        while True:
+            tag, _, offset = self._next_tag(offset)
+            if tag == DTB_BEGIN_NODE:
+                depth += 1
+            elif tag == DTB_END_NODE:
+                depth -= 1
+                if depth == 0:
+                    return offset
+
+    def subnode_offset(self, offset, name):
+        """Get offset of direct sub-node by name, None if not found"""
+        tag, _, offset = self._next_tag(offset)
+        depth = 0
+        while True:
+            tag_offset = offset
+            tag, start, offset = self._next_tag(offset)
+            if tag == DTB_BEGIN_NODE:
+                if depth == 0:
+                    node_name = bytes(self._data[start: offset]).rstrip(b'\0').decode('ascii')
+                    if name_eq(node_name, name):
+                        return tag_offset
+                depth += 1
+            elif tag == DTB_END_NODE:
+                if depth == 0:
+                    return None
+                depth -= 1
+
+    def find_node_offset(self, path):
+        """Get offset of node DTB_BEGIN_NODE tag by absolute path, None if not found (the offsets are cached)"""
+        path = '/' + path.strip('/')
+        offset = self._offsets.get(path)
+        if offset is None:
+            parent_path, _, name = path.rpartition('/')
+            offset = self.find_node_offset(parent_path)
+            if offset is None:
+                return None
+            offset = self.subnode_offset(offset, name)
+            if offset is None:
+                return None
+            self._offsets[path] = offset
+        return offset
+
+    def find_property(self, node, name):
+        """Get (offset of DTB_PROP tag, value offset, value size) of node property, None if not found"""
+        offset = self._next_tag(self._node_offset(node))[2]
+        while True:
+            tag_offset = offset
+            tag, start, offset = self._next_tag(offset)
+            if tag == DTB_PROP:
+                prop_size, prop_string_pos = unpack_from(">II", self._data, start)
+                if self._get_string(prop_string_pos) == name:
+                    return tag_offset, offset - ((prop_size + 3) & ~0x3), prop_size
+            elif tag != DTB_NOP:
+                # properties precede sub-nodes
+                return None
+
+    def getprop(self, node, name):
+        """Get raw property value as memoryview into the blob, None if not found"""
+        item = self.find_property(node, name)
+        if item is None:
+            return None
+        return memoryview(self._data)[item[1]: item[1] + item[2]]
+
+    def setprop_inplace(self, node, name, value):
+        """Overwrite property value, the new value (bytes-like, string, 32-bit word or list of words) must have
+           the same size as the old one
+        """
+        item = self.find_property(node, name)
+        if item is None:
+            raise Exception("Property \"{}\" doesn't exist".format(name))
+        value = raw_value(value)
+        if len(value) != item[2]:
+            raise ValueError("Property \"{}\" size {} can't be changed to {} in place".format(name, item[2],
+                                                                                          len(value)))
+        self._data[item[1]: item[1] + item[2]] = value
+
+    def nop_property(self, node, name):
+        """Remove property by overwriting it with DTB_NOP tags"""
+        item = self.find_property(node, name)
+        if item is None:
+            raise Exception("Property \"{}\" doesn't exist".format(name))
+        end = item[1] + ((item[2] + 3) & ~0x3)
+        self._fill_nop(item[0], end)
+
+    def nop_node(self, node):
+        """Remove node with its sub-nodes by overwriting it with DTB_NOP tags"""
+        offset = self._node_offset(node)
+        if offset == self._offsets['/']:
+            raise Exception("Root node can't be removed")
+        end = self._node_end(offset)
+        self._fill_nop(offset, end)
+        self._offsets = {path: item for path, item in self._offsets.items() if not offset <= item < end}
+
+    def _fill_nop(self, start, end):
+        nop = pack('>I', DTB_NOP)
+        self._data[start: end] = nop * ((end - start) // 4)
+
+    def set_u32(self, node, name, value, index=0):
+        """Overwrite single 32-bit cell of property value"""
+        item = self.find_property(node, name)
+        if item is None or item[2] < (index + 1) * 4:
+            raise Exception("Property \"{}\" doesn't have cell {}".format(name, index))
+        pack_into('>I', self._data, item[1] + index * 4, value)
@@ -0,0 +1,254 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import tempfile
+from hashlib import blake2b
+
+from .prop import PROP_TYPES
+
+
+def file_digest(file_path):
+    """Get hex digest of file content"""
+    with open(file_path, 'rb') as f:
+        return blake2b(f.read(), digest_size=20).hexdigest()
+
+
+class Cache(object):
+    """Persistent on-disk cache of parsed FDT objects.
+
+    Entries are keyed by hash of the source content, parse options and library version, so a changed source
+    or upgraded library never hits a stale entry. Files included by /include/ and /incbin/ are validated by
+    content on load. The least recently used entries are evicted when the cache outgrows max_bytes.
+
+    The entries are loaded by pickle, so the directory must be trusted storage of the current user, it's
+    created with 0700 permissions and a directory of other user or writable by others is refused.
+    """
+
+    SUFFIX = '.fdtc'
+
+    @property
+    def size(self):
+        """Total size of cache entries in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        """Init cache in given directory, it's created if doesn't exist"""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # estimated total size of entries, counted once and then updated by put()
+        self._size = None
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if hasattr(os, 'getuid'):
+            stat = os.stat(path)
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                raise Exception("Cache directory \"{}\" must be owned by current user and not writable by "
+                                "others".format(path))
+
+    def __str__(self):
+        """String representation"""
+        return "CACHE: {}, {} hits, {} misses".format(self.path, self.hits, self.misses)
+
+    def _entries(self):
+        """Get list of (last use time, size, file path) of cache entries"""
+        items = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                items.append((stat.st_mtime, stat.st_size, entry.path))
+        return items
+
+    @staticmethod
+    def key(kind, data, *options):
+        """Get cache key of source data (str or bytes-like) parsed with given options"""
+        from . import __version__
+        digest = blake2b(digest_size=20)
+        digest.update('{}:{}:{!r}\0'.format(kind, __version__, options).encode())
+        digest.update(data.encode() if isinstance(data, str) else data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Get cached object by key, None if not cached or a dependency has changed"""
+        file_path = os.path.join(self.path, key + self.SUFFIX)
+        try:
+            with open(file_path, 'rb') as f:
+                deps, obj = pickle.load(f)
+            for dep_path, dep_digest in deps:
+                if file_digest(dep_path) != dep_digest:
+                    raise ValueError(dep_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # corrupted entry or changed dependency
+            self.discard(key)
+            self.misses += 1
+            return None
+        # the modification time is the LRU timestamp
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj, deps=()):
+        """Store object under key, the deps is list of file paths which the object was created from"""
+        deps = [(os.path.abspath(dep_path), file_digest(dep_path)) for dep_path in deps]
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((deps, obj), f, pickle.HIGHEST_PROTOCOL)
+                entry_size = f.tell()
+            # atomic, concurrent readers see the old or the new entry
+            os.replace(tmp_path, os.path.join(self.path, key + self.SUFFIX))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # the directory is scanned only when the estimated size exceeds the limit
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += entry_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def discard(self, key):
+        try:
+            os.unlink(os.path.join(self.path, key + self.SUFFIX))
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache size fits into max_bytes"""
+        items = self._entries()
+        total = sum(size for _, size, _ in items)
+        if total > self.max_bytes:
+            for _, size, file_path in sorted(items):
+                try:
+                    os.unlink(file_path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._size = total
+
+    def clear(self):
+        for _, _, file_path in self._entries():
+            os.unlink(file_path)
+        self._size = 0
+
+    def parse_dtb(self, data, index=False, types=PROP_TYPES):
+        """Cached fdt.parse_dtb()"""
+        from . import parse_dtb
+        key = self.key('dtb', data, index, types)
+        fdt_obj = self.get(key)
+        if fdt_obj is None:
+            fdt_obj = parse_dtb(data, index, types)
+            self.put(key, fdt_obj)
+        return fdt_obj
+
+    def parse_dts(self, text, root_dir='', symbols=False):
+        """Cached fdt.parse_dts(), the included files are validated on load"""
+        from . import create_fdt
+        from .parser import Parser
+        key = self.key('dts', text, os.path.abspath(root_dir), symbols)
+        fdt_obj = self.get(key)
+        if fdt_obj is None:
+            parser = Parser(root_dir, symbols).parse(text).finish()
+            fdt_obj = create_fdt(parser)
+            self.put(key, fdt_obj, parser.files)
+        return fdt_obj
+
+    def load(self, file_path):
+        """Load *.dts (by extension) or *.dtb file"""
+        if os.path.splitext(file_path)[1].lower() == '.dts':
+            with open(file_path, 'r') as f:
+                return self.parse_dts(f.read(), os.path.dirname(file_path))
+        with open(file_path, 'rb') as f:
+            return self.parse_dtb(f.read())
+
+
+class MemoryCache(Cache):
+    """In-memory cache of parsed FDT objects (for long running processes), thread safe.
+
+    The objects are stored pickled, so every load gets its own copy which can be modified.
+    """
+
+    @property
+    def size(self):
+        return self._size
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        from threading import Lock
+        from collections import OrderedDict
+        self.path = None
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def __str__(self):
+        """String representation"""
+        return "MEMORY-CACHE: {} entries, {} hits, {} misses".format(len(self._items), self.hits, self.misses)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+        if item is not None:
+            deps, obj = pickle.loads(item)
+            if all(file_digest(dep_path) == dep_digest for dep_path, dep_digest in deps):
+                self.hits += 1
+                return obj
+            self.discard(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, obj, deps=()):
+        deps = [(os.path.abspath(dep_path), file_digest(dep_path)) for dep_path in deps]
+        item = pickle.dumps((deps, obj), pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            old_item = self._items.pop(key, None)
+            if old_item is not None:
+                self._size -= len(old_item)
+            self._items[key] = item
+            self._size += len(item)
+        self.evict()
+
+    def discard(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._size -= len(item)
+
+    def evict(self):
+        with self._lock:
+            while self._size > self.max_bytes and self._items:
+                self._size -= len(self._items.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
@@ -0,0 +1,231 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import fdt
+import click
+from time import perf_counter
+
+from . import tool
+from .tool import ERROR_CODE, VERSION, DESCRIP
+
+
+# DTC: Base options
+@click.group(context_settings=dict(help_option_names=['-?', '--help']), help=DESCRIP)
+@click.version_option(VERSION, '-v', '--version')
+@click.option('-c', '--cache', type=click.Path(file_okay=False), default=None, envvar='PYDTC_CACHE',
+              help="Directory of parse cache (default: $PYDTC_CACHE)")
+def cli(cache):
+    if cache:
+        tool.CACHE = fdt.Cache(cache)
+    click.echo()
+
+
+# DTC: Convert DT in binary blob (*.dtb) to readable text file (*.dts)
+@cli.command(short_help="Convert *.dtb to *.dts")
+@click.argument('outfile', nargs=1, type=click.Path())
+@click.argument('infile', nargs=1, type=click.Path(exists=True))
+@click.option('-t', '--tabsize', type=click.INT, default=4, show_default=True, help="Tabulator Size")
+def todts(outfile, infile, tabsize):
+    """ Convert *.dtb to *.dts """
+    try:
+        tool.dtb_to_dts(outfile, infile, tabsize)
+
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    click.secho(" DTS saved as: %s" % outfile)
+
+
+# DTC: Convert DT in readable text file (*.dts) to binary blob (*.dtb)
+@cli.command(short_help="Convert *.dts to *.dtb")
+@click.argument('outfile', nargs=1, type=click.Path())
+@click.argument('infiles', nargs=-1, type=click.Path(exists=True))
+@click.option('-v', '--version', type=click.INT, default=None, help="DTB Version")
+@click.option('-l', '--lcversion', type=click.INT, default=None, help="DTB Last Compatible Version")
+@click.option('-c', '--cpuid', type=click.INT, default=None, help="Boot CPU ID")
+@click.option('-a', '--align', type=click.INT, default=None, help="Make the blob align to the <bytes>")
+@click.option('-p', '--padding', type=click.INT, default=None, help="Add padding to the blob of <bytes> long")
+@click.option('-s', '--size', type=click.INT, default=None, help="Make the blob at least <bytes> long")
+@click.option('-@', '--symbols', is_flag=True, default=False, help="Export labels into /__symbols__ node")
+def todtb(outfile, infiles, version, lcversion, cpuid, align, padding, size, symbols):
+    """ Convert *.dts to *.dtb """
+    try:
+        tool.dts_to_dtb(outfile, infiles, version, lcversion, cpuid, align, padding, size, symbols)
+
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    click.secho(" DTB saved as: %s" % outfile)
+
+
+# DTC: Apply overlays (*.dtbo) to DT in binary blob (*.dtb)
+@cli.command(short_help="Apply *.dtbo overlays to *.dtb")
+@click.argument('outfile', nargs=1, type=click.Path())
+@click.argument('infile', nargs=1, type=click.Path(exists=True))
+@click.argument('overlays', nargs=-1, type=click.Path(exists=True))
+def overlay(outfile, infile, overlays):
+    """ Apply *.dtbo overlays to *.dtb """
+    try:
+        tool.apply_overlays(outfile, infile, overlays)
+
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    click.secho(" DTB saved as: %s" % outfile)
+
+
+# DTC: Merge *.dtb and *.dts files
+@cli.command(short_help="Merge *.dtb/*.dts files")
+@click.argument('outfile', nargs=1, type=click.Path())
+@click.argument('infiles', nargs=-1, type=click.Path(exists=True))
+@click.option('-v', '--version', type=click.INT, default=17, show_default=True, help="DTB Version")
+def merge(outfile, infiles, version):
+    """ Merge *.dtb and *.dts files (by extension) into *.dts or *.dtb (by OUTFILE extension) """
+    try:
+        if not infiles:
+            raise Exception("No input files")
+        tool.merge_files(outfile, infiles, version)
+
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    click.secho(" {} saved as: {}".format('DTS' if outfile.lower().endswith('.dts') else 'DTB', outfile))
+
+
+# DTC: Run conversion server
+@cli.command(short_help="Run conversion server on Unix socket")
+@click.argument('socket_path', nargs=1, type=click.Path())
+@click.option('-m', '--cache-size', type=click.INT, default=256, show_default=True,
+              help="Size of memory cache of parsed files in MiB")
+def serve(socket_path, cache_size):
+    """ Run server, which converts files for clients connected to SOCKET_PATH. The todts, todtb, overlay and
+        merge commands are sent to the server if PYDTC_SERVER environment variable is set to SOCKET_PATH.
+    """
+    from .server import Server
+    try:
+        server = Server(socket_path, cache_size * 1024 * 1024)
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    click.echo(" Listening on: {}".format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    click.echo(" {}".format(server.cache))
+
+
+# DTC: Show header info of *.dtb files
+@cli.command(short_help="Show header info of *.dtb files")
+@click.argument('paths', nargs=-1, type=click.STRING)
+@click.option('-p', '--prop', 'props', multiple=True, default=('compatible', 'model'), show_default=True,
+              help="Root node property to show, can be used more times")
+@click.option('-n', '--no-props', is_flag=True, default=False, help="Read just the header and reservation map")
+def info(paths, props, no_props):
+    """ Show header and root node properties of *.dtb files without parsing them. PATHS are files, glob
+        patterns or directories (all files in sub-directories are scanned)
+    """
+    try:
+        files = tool.info_files(paths)
+        if not files:
+            raise Exception("No input files")
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    start = perf_counter()
+    invalid = 0
+    for item in fdt.scan(files, () if no_props else props):
+        if not item.valid:
+            invalid += 1
+            click.echo(" FAIL {}: {}".format(item.path, item.error))
+            continue
+        line = " OK   {} v{} {} bytes".format(item.path, item.header.version, item.header.total_size)
+        if item.entries:
+            line += ", {} reserved".format(len(item.entries))
+        for name in props:
+            prop = item.props.get(name)
+            if prop is not None:
+                line += "; " + prop.to_dts(0).strip().rstrip(";")
+        click.echo(line)
+
+    click.echo(" Scanned {} files ({} invalid) in {:.3f}s".format(len(files), invalid, perf_counter() - start))
+    if invalid:
+        sys.exit(ERROR_CODE)
+
+
+# DTC: Convert many files in parallel processes
+@cli.command(short_help="Convert many *.dtb/*.dts files in parallel")
+@click.argument('patterns', nargs=-1, type=click.STRING)
+@click.option('-m', '--manifest', type=click.Path(exists=True), default=None,
+              help="File with lines '<infile> [<outfile>]'")
+@click.option('-o', '--outdir', type=click.Path(file_okay=False), default=None,
+              help="Output directory (default: next to input files)")
+@click.option('-j', '--jobs', type=click.INT, default=None, help="Number of processes (default: all cores)")
+@click.option('-t', '--tabsize', type=click.INT, default=4, show_default=True, help="Tabulator Size")
+@click.option('-v', '--version', type=click.INT, default=17, show_default=True, help="DTB Version")
+def batch(patterns, manifest, outdir, jobs, tabsize, version):
+    """ Convert *.dtb to *.dts and *.dts to *.dtb (by file extension) in parallel, failed files don't stop
+        the batch
+    """
+    try:
+        items = tool.batch_jobs(patterns, manifest, outdir)
+        if not items:
+            raise Exception("No input files, use PATTERNS or -m/--manifest")
+        if version > fdt.Header.MAX_VERSION:
+            raise Exception("DTB Version must be lover or equal {} !".format(fdt.Header.MAX_VERSION))
+        for path in set(os.path.dirname(outfile) for _, outfile in items):
+            if path:
+                os.makedirs(path, exist_ok=True)
+    except Exception as e:
+        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        sys.exit(ERROR_CODE)
+
+    start = perf_counter()
+    infiles, outfiles = zip(*items)
+    args = (infiles, outfiles, [tabsize] * len(items), [version] * len(items))
+    executor = None
+    if jobs == 1 or len(items) == 1:
+        results = map(tool.convert_file, *args)
+    else:
+        # the process pool is imported just when used, every worker opens the cache once
+        from concurrent.futures import ProcessPoolExecutor
+        cache_dir = None if tool.CACHE is None else tool.CACHE.path
+        executor = ProcessPoolExecutor(jobs, initializer=tool.init_worker, initargs=(cache_dir,))
+        workers = jobs or os.cpu_count() or 1
+        # bigger chunks amortize the inter-process communication of many small files
+        results = executor.map(tool.convert_file, *args, chunksize=max(1, len(items) // (workers * 4)))
+
+    failed = 0
+    for infile, outfile, (elapsed, error) in zip(infiles, outfiles, results):
+        if error is None:
+            click.echo(" OK   {:8.3f}s {} -> {}".format(elapsed, infile, outfile))
+        else:
+            failed += 1
+            click.echo(" FAIL {:8.3f}s {}: {}".format(elapsed, infile, error))
+    if executor is not None:
+        executor.shutdown()
+
+    click.echo(" Converted {} of {} files in {:.3f}s".format(len(items) - failed, len(items), perf_counter() - start))
+    if failed:
+        sys.exit(ERROR_CODE)
@@ -0,0 +1,53 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import socket
+
+
+class Client(object):
+    """Client of conversion server, the connection is kept for repeated calls"""
+
+    def __init__(self, socket_path, timeout=None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(socket_path)
+        self._file = self._socket.makefile('rwb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def call(self, command, outfile, infiles, **options):
+        """Run job on server, returns its time in seconds, raises Exception with error message if the job fails.
+           The paths are made absolute, the server can run in other directory.
+        """
+        request = dict(options, command=command, outfile=os.path.abspath(outfile),
+                       infiles=[os.path.abspath(path) for path in infiles])
+        self._file.write(json.dumps(request).encode() + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Server closed connection")
+        response = json.loads(line.decode())
+        if response['error'] is not None:
+            raise Exception(response['error'])
+        return response['time']
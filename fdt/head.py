@@ -124,6 +124,23 @@ class Header(object):
 
         return header
 
+    def check(self, blob_size=None):
+        """Check total size against real size of blob and offsets of blocks, raises Exception if invalid"""
+        if blob_size is not None and self.total_size > blob_size:
+            raise Exception('Truncated blob, total size {} > {}'.format(self.total_size, blob_size))
+        if self.total_size < self._size:
+            raise Exception('Invalid total size {}'.format(self.total_size))
+        for name, value in (('memory reservation map', self.off_mem_rsvmap), ('structure block', self.off_dt_struct),
+                            ('strings block', self.off_dt_strings)):
+            if not self._size <= value <= self.total_size:
+                raise Exception('Invalid offset of {}: {}'.format(name, value))
+        if self.off_mem_rsvmap % 8 or self.off_dt_struct % 4:
+            raise Exception('Unaligned memory reservation map or structure block')
+        if self.size_dt_strings is not None and self.off_dt_strings + self.size_dt_strings > self.total_size:
+            raise Exception('Strings block out of blob: {} + {}'.format(self.off_dt_strings, self.size_dt_strings))
+        if self.size_dt_struct is not None and self.off_dt_struct + self.size_dt_struct > self.total_size:
+            raise Exception('Structure block out of blob: {} + {}'.format(self.off_dt_struct, self.size_dt_struct))
+
     def export(self):
         if self.version is None:
             raise Exception("Header Version must be specified !")
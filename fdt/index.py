@@ -0,0 +1,304 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from struct import pack, unpack_from
+
+from .head import Header, DTB_BEGIN_NODE, DTB_END_NODE, DTB_NOP, DTB_PROP, DTB_END
+from .node import Node
+from .prop import PropWords, PropStrings
+
+
+# phandle-bearing properties with argument cells: property name -> cell-count property of referenced node
+PHANDLE_CELLS = {
+    'clocks': '#clock-cells',
+    'assigned-clocks': '#clock-cells',
+    'assigned-clock-parents': '#clock-cells',
+    'interrupts-extended': '#interrupt-cells',
+    'gpios': '#gpio-cells',
+    'resets': '#reset-cells',
+    'dmas': '#dma-cells',
+    'pwms': '#pwm-cells',
+    'phys': '#phy-cells',
+    'power-domains': '#power-domain-cells',
+    'mboxes': '#mbox-cells',
+    'iommus': '#iommu-cells',
+    'io-channels': '#io-channel-cells',
+    'thermal-sensors': '#thermal-sensor-cells',
+    'sound-dai': '#sound-dai-cells',
+    'interconnects': '#interconnect-cells',
+    'hwlocks': '#hwlock-cells',
+}
+
+
+def get_phandle(node):
+    """Get phandle value of node ('phandle' or legacy 'linux,phandle' property), None if not defined"""
+    for name in ('phandle', 'linux,phandle'):
+        prop = node._props.get(name)
+        if isinstance(prop, PropWords) and len(prop) == 1 and prop.word_size == 32:
+            return prop[0]
+    return None
+
+
+class PathIndex(object):
+    """Node path to structure block offset index of DTB (offsets of DTB_BEGIN_NODE tags)"""
+
+    MAGIC = b'FDTI'
+    VERSION = 1
+
+    @property
+    def paths(self):
+        return list(self._offsets)
+
+    def __init__(self, total_size=0, offsets=None):
+        """Init with size of indexed blob and path->offset map"""
+        self.total_size = total_size
+        self._offsets = {} if offsets is None else offsets
+
+    def __str__(self):
+        """String representation"""
+        return "INDEX: {} nodes, blob size: {}".format(len(self), self.total_size)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, path):
+        return path in self._offsets
+
+    def __getitem__(self, path):
+        return self._offsets[path]
+
+    def __eq__(self, index):
+        if not isinstance(index, PathIndex):
+            return False
+        return self.total_size == index.total_size and self._offsets == index._offsets
+
+    def get(self, path, default=None):
+        return self._offsets.get(path, default)
+
+    def add(self, path, offset):
+        self._offsets[path] = offset
+
+    @classmethod
+    def build(cls, data):
+        """Build index by single pass over DTB structure block"""
+        header = Header.parse(data)
+        old_version = header.version < 16
+        index = cls(header.total_size)
+        path = []
+        offset = header.off_dt_struct
+        while True:
+            tag_offset = offset
+            tag = unpack_from(">I", data, offset)[0]
+            offset += 4
+            if tag == DTB_BEGIN_NODE:
+                name_end = data.find(b'\0', offset)
+                path.append(bytes(data[offset: name_end]).decode('ascii'))
+                index.add('/' + '/'.join(path[1:]), tag_offset)
+                offset = (name_end + 4) & ~3
+            elif tag == DTB_END_NODE:
+                path.pop()
+            elif tag == DTB_PROP:
+                prop_size = unpack_from(">I", data, offset)[0]
+                prop_start = offset + 8
+                if old_version and prop_size >= 8:
+                    prop_start = ((prop_start + 7) & ~0x7)
+                offset = (prop_start + prop_size + 3) & ~0x3
+            elif tag == DTB_NOP:
+                pass
+            elif tag == DTB_END:
+                break
+            else:
+                raise Exception("Unknown Tag: {}".format(tag))
+        return index
+
+    @classmethod
+    def parse(cls, data):
+        """Parse index exported by export()"""
+        if data[:4] != cls.MAGIC:
+            raise Exception('Invalid Index Magic')
+        version, total_size, count = unpack_from('>III', data, 4)
+        if version != cls.VERSION:
+            raise Exception('Invalid Index Version {}'.format(version))
+        index = cls(total_size)
+        offset = 16
+        for _ in range(count):
+            node_offset, path_size = unpack_from('>IH', data, offset)
+            offset += 6
+            index.add(bytes(data[offset: offset + path_size]).decode('ascii'), node_offset)
+            offset += path_size
+        return index
+
+    def export(self):
+        """Export index into binary form, which can be stored alongside the blob"""
+        items = [pack('>4sIII', self.MAGIC, self.VERSION, self.total_size, len(self._offsets))]
+        for path, offset in self._offsets.items():
+            path = path.encode('ascii')
+            items.append(pack('>IH', offset, len(path)))
+            items.append(path)
+        return b''.join(items)
+
+
+class PhandleIndex(object):
+    """Phandle -> node, node -> phandle and label -> node index of node tree, labels are taken from nodes
+       and /__symbols__. The index is built by single pass over the tree and the nodes are validated on
+       lookup, so a modified tree is re-indexed on the first lookup which misses. Unresolved keys are
+       remembered until a node is modified (labels added into node.labels aren't modifications, use add_label()).
+    """
+
+    def __init__(self, rootnode=None):
+        """Init and build the index by single pass over the tree"""
+        self.max_phandle = 0
+        self._root = rootnode
+        self._nodes = {}
+        self._labels = {}
+        self._missing = set()
+        # Node.changes when the missing keys weren't found
+        self._missing_changes = None
+        if rootnode is not None:
+            self.build()
+
+    def __str__(self):
+        """String representation"""
+        return "PHANDLE-INDEX: {} phandles, {} labels".format(len(self._nodes), len(self._labels))
+
+    def _is_attached(self, node):
+        """Check if node is still in the indexed tree"""
+        while node._parent is not None:
+            node = node._parent
+        return node is self._root
+
+    def build(self, rootnode=None):
+        """Index all nodes of the tree, the max_phandle never decreases (allocated phandles stay unique)"""
+        if rootnode is not None:
+            self._root = rootnode
+        self._nodes = {}
+        self._labels = {}
+        self._missing = set()
+        todo_stack = [self._root]
+        while todo_stack:
+            node = todo_stack.pop()
+            self.add(node)
+            todo_stack.extend(node._nodes.values())
+        symbols = self._root._nodes.get('__symbols__')
+        if symbols is not None:
+            for prop in symbols._props.values():
+                if isinstance(prop, PropStrings) and len(prop) == 1:
+                    node = self._root.get_subnode(prop[0].strip('/'))
+                    if node is not None:
+                        self._labels.setdefault(prop.name, node)
+
+    def add(self, node):
+        """Add phandle and labels of node"""
+        phandle = get_phandle(node)
+        if phandle is not None:
+            self._nodes[phandle] = node
+            self._missing.discard(phandle)
+            self.max_phandle = max(self.max_phandle, phandle)
+        for label in node.labels:
+            self._labels[label] = node
+            self._missing.discard(label)
+
+    def add_label(self, label, node):
+        self._labels[label] = node
+        self._missing.discard(label)
+
+    def _is_missing(self, key):
+        """Check if key wasn't found in the same tree before"""
+        return key in self._missing and self._missing_changes == Node.changes
+
+    def _set_missing(self, key):
+        # don't rebuild again for dangling references until a node is modified, the root digest would be
+        # computed over whole tree after every modification
+        if self._missing_changes != Node.changes:
+            self._missing = set()
+            self._missing_changes = Node.changes
+        self._missing.add(key)
+
+    def get_node(self, phandle):
+        """Get node by phandle value, None if not found"""
+        node = self._nodes.get(phandle)
+        if node is not None and get_phandle(node) == phandle and self._is_attached(node):
+            return node
+        if self._is_missing(phandle):
+            return None
+        self.build()
+        node = self._nodes.get(phandle)
+        if node is None:
+            self._set_missing(phandle)
+        return node
+
+    def get_label(self, label):
+        """Get node by label, None if not found"""
+        node = self._labels.get(label)
+        if node is not None and self._is_attached(node):
+            return node
+        if self._is_missing(label):
+            return None
+        self.build()
+        node = self._labels.get(label)
+        if node is None:
+            self._set_missing(label)
+        return node
+
+    @staticmethod
+    def get_phandle(node):
+        """Get phandle of node, None if not defined"""
+        return get_phandle(node)
+
+    def allocate(self, node):
+        """Get phandle of node, the new one is assigned if not defined"""
+        phandle = get_phandle(node)
+        if phandle is None:
+            phandle = self.max_phandle + 1
+            node.set_property(PropWords('phandle', [phandle]))
+            self.add(node)
+        return phandle
+
+    def resolve(self, prop, cells=None):
+        """Resolve phandle-bearing property, returns list of (node, argument cells) pairs.
+
+        The 'cells' is name of the cell-count property in referenced node (e.g. '#clock-cells'), by default
+        it's looked up in PHANDLE_CELLS by property name. Without it every cell is single phandle. Entries
+        with phandle 0 (placeholder) are returned as (None, []).
+        """
+        if not isinstance(prop, PropWords) or prop.word_size != 32:
+            raise TypeError("Property \"{}\" doesn't contain phandles".format(prop.name))
+        if cells is None:
+            cells = PHANDLE_CELLS.get(prop.name)
+            if cells is None and (prop.name.endswith('-gpios') or prop.name.endswith(',gpios')):
+                cells = '#gpio-cells'
+        data = prop.data
+        items = []
+        i = 0
+        while i < len(data):
+            phandle = data[i]
+            i += 1
+            if phandle == 0:
+                items.append((None, []))
+                continue
+            node = self.get_node(phandle)
+            if node is None:
+                raise Exception("Property \"{}\": phandle 0x{:X} not found".format(prop.name, phandle))
+            count = 0
+            if cells is not None:
+                cells_prop = node._props.get(cells)
+                if not isinstance(cells_prop, PropWords) or len(cells_prop) != 1:
+                    raise Exception("Property \"{}\": \"{}\" missing in referenced node \"{}\"".format(
+                                    prop.name, cells, node.name))
+                count = cells_prop[0]
+                if i + count > len(data):
+                    raise Exception("Property \"{}\": missing argument cells".format(prop.name))
+            items.append((node, list(data[i: i + count])))
+            i += count
+        return items
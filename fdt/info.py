@@ -0,0 +1,148 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from struct import unpack_from
+
+from .head import Header, DTB_BEGIN_NODE, DTB_NOP, DTB_PROP
+from .prop import Property, get_prop_type
+
+# Size of the first read of file, it covers header, memory reservation map and root properties of usual blobs
+READ_SIZE = 4096
+
+
+class DTBInfo(object):
+    """Information about DTB file collected without parsing it whole"""
+
+    @property
+    def valid(self):
+        return self.error is None
+
+    def __init__(self, path):
+        self.path = path
+        self.size = None
+        self.header = None
+        self.entries = []
+        self.props = {}
+        self.error = None
+
+    def __str__(self):
+        """String representation"""
+        if self.error is not None:
+            return "{}: {}".format(self.path, self.error)
+        return "{}: v{}, {} bytes".format(self.path, self.header.version, self.header.total_size)
+
+
+def _read(f, data, offset, size):
+    """Read from already loaded data if possible, else from the file"""
+    if offset + size <= len(data):
+        return data[offset: offset + size]
+    f.seek(offset)
+    return f.read(size)
+
+
+def _read_entries(f, data, header):
+    entries = []
+    offset = header.off_mem_rsvmap
+    while True:
+        raw = _read(f, data, offset, 16)
+        if len(raw) < 16 or offset + 16 > header.total_size:
+            raise Exception("Memory reservation map isn't terminated")
+        address, size = unpack_from(">QQ", raw)
+        if address == 0 and size == 0:
+            return entries
+        entries.append({'address': address, 'size': size})
+        offset += 16
+
+
+def _read_root_props(f, data, header, names, max_scan):
+    """Get raw values of root node properties found in the first max_scan bytes of structure block"""
+    struct_size = header.total_size - header.off_dt_struct
+    if header.size_dt_struct is not None:
+        struct_size = header.size_dt_struct
+    block = _read(f, data, header.off_dt_struct, min(max_scan, struct_size))
+    offset = 0
+    while offset + 4 <= len(block) and unpack_from(">I", block, offset)[0] == DTB_NOP:
+        offset += 4
+    if offset + 4 > len(block) or unpack_from(">I", block, offset)[0] != DTB_BEGIN_NODE:
+        raise Exception("Root node not found at the start of structure block")
+    name_end = block.find(b'\0', offset + 4)
+    if name_end < 0:
+        return {}
+    offset = (name_end + 4) & ~3
+    items = []
+    # the scan stops at first sub-node or at the end of block, properties precede sub-nodes
+    while offset + 4 <= len(block):
+        tag = unpack_from(">I", block, offset)[0]
+        offset += 4
+        if tag == DTB_NOP:
+            continue
+        if tag != DTB_PROP or offset + 8 > len(block):
+            break
+        prop_size, prop_string_pos = unpack_from(">II", block, offset)
+        prop_start = offset + 8
+        if header.version < 16 and prop_size >= 8:
+            # the alignment is absolute in blob
+            prop_start = ((header.off_dt_struct + prop_start + 7) & ~0x7) - header.off_dt_struct
+        if prop_start + prop_size > len(block):
+            break
+        items.append((prop_string_pos, block[prop_start: prop_start + prop_size]))
+        offset = (prop_start + prop_size + 3) & ~0x3
+    if not items:
+        return {}
+    strings_size = header.total_size - header.off_dt_strings
+    if header.size_dt_strings is not None:
+        strings_size = header.size_dt_strings
+    strings = _read(f, data, header.off_dt_strings, min(READ_SIZE, strings_size))
+    props = {}
+    for prop_string_pos, value in items:
+        end = strings.find(b'\0', prop_string_pos)
+        if end < 0:
+            # name out of the loaded part of strings block
+            raw = _read(f, data, header.off_dt_strings + prop_string_pos, 256)
+            name = raw[: raw.find(b'\0')]
+        else:
+            name = strings[prop_string_pos: end]
+        name = name.decode('ascii', 'replace')
+        if name in names:
+            props[name] = Property.create(name, value, get_prop_type(name))
+    return props
+
+
+def scan_file(path, props=('compatible', 'model'), max_scan=READ_SIZE):
+    """Get DTBInfo of file by reading just its header, memory reservation map and, if props are given, the
+       root node properties found in the first max_scan bytes of structure block. Errors are stored in
+       DTBInfo.error.
+    """
+    info = DTBInfo(path)
+    try:
+        with open(path, 'rb') as f:
+            info.size = os.fstat(f.fileno()).st_size
+            data = f.read(READ_SIZE)
+            if len(data) < Header.MIN_SIZE:
+                raise Exception("File too small")
+            info.header = Header.parse(data)
+            info.header.check(info.size)
+            info.entries = _read_entries(f, data, info.header)
+            if props:
+                info.props = _read_root_props(f, data, info.header, props, max_scan)
+    except Exception as e:
+        info.error = str(e) if str(e) else "Unknown!"
+    return info
+
+
+def scan(paths, props=('compatible', 'model'), max_scan=READ_SIZE):
+    """Scan DTB files without parsing them, yields DTBInfo for every path (see scan_file())"""
+    for path in paths:
+        yield scan_file(path, props, max_scan)
@@ -12,78 +12,86 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import re
-from string import printable
+# Same as string.printable, the string module isn't imported because it imports re (slow start of pydtc)
+printable = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ \t\n\r\x0b\x0c'
+
+# Bytes allowed inside of strings value (printable chars without new lines), NUL is the strings separator
+STRING_CHARS = bytes(sorted(set(printable.encode()) - set(b'\r\n')))
 
 
 def is_string(data):
     """ Check property string validity """
-    if not len(data):
+    if not len(data) or data[-1] != 0 or data[0] == 0:
         return None
-    if data[-1] != 0:
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    # after removing all valid chars only the separators must remain, and no one of the strings can be empty
+    rest = data.translate(None, STRING_CHARS)
+    if rest.count(0) != len(rest) or b'\0\0' in data:
         return None
-    pos = 0
-    while pos < len(data):
-        posi = pos
-        while pos < len(data) and \
-              data[pos] != 0 and \
-              data[pos] in printable.encode() and \
-              data[pos] not in (ord('\r'), ord('\n')):
-            pos += 1
-        if data[pos] != 0 or pos == posi:
-            return None
-        pos += 1
     return True
 
 
+def deepcopy_detached(obj, memo):
+    """ Deep copy of tree item with __slots__, its parent is not copied (the copy is detached) """
+    from copy import deepcopy
+    memo.setdefault(id(obj._parent), None)
+    dup = obj.__class__.__new__(obj.__class__)
+    memo[id(obj)] = dup
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            setattr(dup, name, deepcopy(getattr(obj, name), memo))
+    return dup
+
+
 def extract_string(data, offset=0):
     """ Extract string """
-    str_end = offset
-    while data[str_end] != 0:
-        str_end += 1
-    return data[offset:str_end].decode("ascii")
+    return data[offset: data.index(b'\0', offset)].decode("ascii")
 
 
-def line_offset(tabsize, offset, string):
-    offset = " " * (tabsize * offset)
-    return offset + string
+class StringTable(object):
+    """ DTB strings block builder with dictionary based deduplication """
 
+    def __init__(self, strings=''):
+        """Init with content of existing strings block"""
+        if isinstance(strings, str):
+            strings = strings.encode('ascii')
+        self.offsets = {}
+        self.size = 0
+        for name in bytes(strings).split(b'\0')[:-1]:
+            self.offsets.setdefault(name.decode('ascii'), self.size)
+            self.size += len(name) + 1
+        self.size = len(strings)
+        self._block = bytes(strings)
 
-def get_version_info(text):
-    ret = dict()
-    for line in text.split('\n'):
-        line = line.rstrip('\0')
-        if line and line.startswith('/ {'):
-            break
-        if line and line.startswith('//'):
-            line = line.replace('//', '').replace(':', '')
-            line = line.split()
-            if line[0] in ('version', 'last_comp_version', 'boot_cpuid_phys'):
-                ret[line[0]] = int(line[1], 0)
-    return ret
+    def __len__(self):
+        return self.size
 
+    def add(self, name):
+        """Add name if not present, returns its offset"""
+        offset = self.offsets.get(name)
+        if offset is None:
+            offset = self.offsets[name] = self.size
+            self.size += len(name) + 1
+        return offset
 
-def strip_comments(text):
-    text = re.sub('//.*?(\r\n?|\n)|/\*.*?\*/', '', text, flags=re.S)
-    return text
+    def export(self):
+        """Get strings block"""
+        new_names = [name for name, offset in self.offsets.items() if offset >= len(self._block)]
+        if not new_names:
+            return self._block
+        return self._block + '\0'.join(new_names).encode('ascii') + b'\0'
 
 
-def split_to_lines(text):
-    lines = []
-    mline = str()
-    for line in text.split('\n'):
-        line = line.replace('\t', ' ')
-        line = line.rstrip('\0')
-        line = line.rstrip(' ')
-        line = line.lstrip(' ')
-        if not line or line.startswith('/dts-'):
-            continue
-        if line.endswith('{') or line.endswith(';'):
-            line = line.replace(';', '')
-            lines.append(mline + line)
-            mline = str()
-        else:
-            mline += line
+def line_offset(tabsize, offset, string):
+    offset = " " * (tabsize * offset)
+    return offset + string
 
-    return lines
 
+def get_version_info(text):
+    import re
+    ret = dict()
+    head = text if text.find('{') < 0 else text[:text.find('{')]
+    for match in re.finditer(r'^//\s*(version|last_comp_version|boot_cpuid_phys):?\s+(\w+)', head, re.M):
+        ret[match.group(1)] = int(match.group(2), 0)
+    return ret
@@ -12,13 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from copy import deepcopy, copy
-from struct import pack
-from string import printable
+from struct import pack, pack_into
+from sys import intern
 
 from .head import DTB_BEGIN_NODE, DTB_END_NODE
-from .prop import Property
-from .misc import line_offset
+from .prop import Property, PRINTABLE, DIGEST_SIZE
+from .misc import line_offset, deepcopy_detached, StringTable
 
 
 def split_path(path):
@@ -29,6 +28,11 @@ def split_path(path):
 class Node(object):
     """Node representation"""
 
+    __slots__ = ('_name', '_props', '_nodes', '_parent', '_labels', '_digest', '_span', '_prop_pos', '_node_pos')
+
+    # Count of modifications of all node trees, cheap check if a tree could be modified since the count was taken
+    changes = 0
+
     @property
     def name(self):
         return self._name
@@ -37,17 +41,17 @@ class Node(object):
     def name(self, value):
         if not isinstance(value, str):
             raise ValueError("The value must be a string type !")
-        if not all(c in printable for c in value):
+        if not PRINTABLE.issuperset(value):
             raise ValueError("The value must contain only printable chars !")
-        self._name = value
-
-    @property
-    def basepath(self):
-        return self._basepath
-
-    @basepath.setter
-    def basepath(self, value):
-        self._basepath = value
+        if self._parent is not None and self._parent._nodes.get(self._name) is self and value != self._name:
+            if value in self._parent._nodes:
+                raise ValueError("Node \"{}\" already exists".format(value))
+            # keep the name map of parent node in sync, with the original order
+            self._parent._nodes = {(value if key == self._name else key): item
+                                   for key, item in self._parent._nodes.items()}
+            self._parent._node_pos = None
+        self._name = intern(value)
+        self.invalidate()
 
     @property
     def parent(self):
@@ -70,23 +74,63 @@ class Node(object):
             path.append(node.name)
         return '/'.join(path[::-1])
 
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def digest(self):
+        """Merkle digest of sub-tree content (name, properties and sub-nodes in order, labels are excluded),
+           cached until the sub-tree is modified
+        """
+        if self._digest is None:
+            from hashlib import blake2b
+            digest = blake2b(pack('>II', len(self._props), len(self._nodes)), digest_size=DIGEST_SIZE)
+            digest.update(self._name.encode() + b'\0')
+            for prop in self._props.values():
+                digest.update(prop.digest)
+            for node in self._nodes.values():
+                digest.update(node.digest)
+            self._digest = digest.digest()
+        return self._digest
+
     @property
     def props(self):
-        return self._props
+        """Properties in order (read-only tuple, use append(), set_property() and remove_property())"""
+        return tuple(self._props.values())
 
     @property
     def nodes(self):
-        return self._nodes
+        """Sub-nodes in order (read-only tuple, use append() and remove_subnode())"""
+        return tuple(self._nodes.values())
 
     def __init__(self, name=None, props=None, nodes=None):
         """Init node with name"""
         self._name = ""
-        self._props = [] if props is None else props
-        self._nodes = [] if nodes is None else nodes
+        self._props = {}
+        self._nodes = {}
         self._parent = None
-        self._basepath = None
+        self._labels = []
+        self._digest = None
+        # (blob, start, end) of unmodified sub-tree in structure block of parsed DTB, see dtb_write()
+        self._span = None
+        # name -> index maps of properties and sub-nodes, built on first index query, None when outdated
+        self._prop_pos = None
+        self._node_pos = None
         if name is not None:
             self.name = name
+        for item in (props or []) + (nodes or []):
+            self.append(item)
+
+    def __getstate__(self):
+        """Pickled without the span into source blob (see FDT.__getstate__())"""
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['_span'] = None
+        return None, state
+
+    def __deepcopy__(self, memo):
+        """Deep copy of sub-tree, the parent nodes are not copied"""
+        return deepcopy_detached(self, memo)
 
     def __str__(self):
         """String representation"""
@@ -102,14 +146,14 @@ class Node(object):
             raise ValueError("Invalid object type")
         if self.name != node.name:
             return False
-        if len(self.props) != len(node.props) or \
-           len(self.nodes) != len(node.nodes):
+        if len(self._props) != len(node._props) or \
+           len(self._nodes) != len(node._nodes):
             return False
-        for p in self.props:
-            if p not in node.props:
+        for name, p in self._props.items():
+            if name not in node._props or p != node._props[name]:
                 return False
-        for n in self.nodes:
-            if n not in node.nodes:
+        for name, n in self._nodes.items():
+            if name not in node._nodes or n != node._nodes[name]:
                 return False
         return True
 
@@ -119,10 +163,9 @@ class Node(object):
         node = self.get_subnode(node_path)
         if node is None:
             raise Exception("{}: Path \"{}\" doesn't exists".format(self, path))
-        for index, item in enumerate(node.props):
-            if item.name == prop_name:
-                return index
-        return None
+        if node._prop_pos is None:
+            node._prop_pos = {name: i for i, name in enumerate(node._props)}
+        return node._prop_pos.get(prop_name)
 
     def get_subnode_index(self, path):
         """Get index value of existing item by name"""
@@ -130,19 +173,26 @@ class Node(object):
         node = self.get_subnode(node_path)
         if node is None:
             raise Exception("{}: Path \"{}\" doesn't exists".format(self, path))
-        for index, item in enumerate(node.nodes):
-            if item.name == node_name:
-                return index
-        return None
+        if node._node_pos is None:
+            node._node_pos = {name: i for i, name in enumerate(node._nodes)}
+        return node._node_pos.get(node_name)
+
+    def invalidate(self):
+        """Drop cached digest and DTB span of the node and all its parents"""
+        Node.changes += 1
+        node = self
+        # parent digest/span can't be valid without the ones of its children, so the walk stops at the first cleared
+        while node is not None and (node._digest is not None or node._span is not None):
+            node._digest = None
+            node._span = None
+            node = node._parent
 
     def get_property(self, path):
         """Get property obj by path/name"""
         prop_name, node_path = split_path(path)
         node = self.get_subnode(node_path)
         if node is not None:
-            for item in node.props:
-                if item.name == prop_name:
-                    return item
+            return node._props.get(prop_name)
         return None
 
     def get_subnode(self, path):
@@ -150,13 +200,8 @@ class Node(object):
         node = self
         if path:
             for sub_name in path.split('/'):
-                found = False
-                for sub_node in node.nodes:
-                    if sub_node.name == sub_name:
-                        node = sub_node
-                        found = True
-                        break
-                if not found:
+                node = node._nodes.get(sub_name)
+                if node is None:
                     return None
         return node
 
@@ -166,10 +211,11 @@ class Node(object):
         node = self.get_subnode(node_path)
         if node is None:
             raise Exception("{}: Path \"{}\" doesn't exists".format(self, path))
-        item = node.get_property(prop_name)
-        if item is None:
+        if prop_name not in node._props:
             raise Exception("{}: \"{}\" property doesn't exists".format(self, prop_name))
-        node.props.remove(item)
+        node._props.pop(prop_name)._parent = None
+        node._prop_pos = None
+        node.invalidate()
 
     def remove_subnode(self, path):
         """Remove subnode obj by path/name. Raises ValueError if path/name not exist"""
@@ -177,86 +223,180 @@ class Node(object):
         node = self.get_subnode(node_path)
         if node is None:
             raise Exception("{}: Path \"{}\" doesn't exists".format(self, path))
-        item = node.get_subnode(node_name)
+        item = node._nodes.pop(node_name, None)
         if item is None:
             raise Exception("{}: \"{}\" subnode doesn't exists".format(self, node_name))
-        node.nodes.remove(item)
+        item.parent = None
+        node._node_pos = None
+        node.invalidate()
 
     def append(self, item, path=""):
-        """Append sub-node or property at specified path"""
+        """Append sub-node or property at specified path, an item which belongs to other node is copied"""
         node = self.get_subnode(path)
         if node is None:
             raise Exception("{}: Path \"{}\" doesn't exists".format(self, path))
+        if item is self:
+            raise Exception("{}: append the same node {}".format(self, item.name))
+        if isinstance(item, (Property, Node)) and item._parent is not None and item._parent is not node:
+            # the item can't be shared, its modification would invalidate only one of the parents
+            from copy import deepcopy
+            item = deepcopy(item)
 
         if isinstance(item, Property):
-            if node.get_property(item.name) is not None:
+            if item.name in node._props:
                 raise Exception("{}: \"{}\" property already exists".format(self, item.name))
-            node.props.append(item)
+            item._parent = node
+            node._props[item.name] = item
+            if node._prop_pos is not None:
+                node._prop_pos[item.name] = len(node._props) - 1
 
         elif isinstance(item, Node):
-            if node.get_subnode(item.name) is not None:
+            if item.name in node._nodes:
                 raise Exception("{}: \"{}\" node already exists".format(self, item.name))
-            if item is self:
-                raise Exception("{}: append the same node {}".format(self, item.name))
             item.parent = node
-            node.nodes.append(item)
+            node._nodes[item.name] = item
+            if node._node_pos is not None:
+                node._node_pos[item.name] = len(node._nodes) - 1
 
         else:
             raise TypeError("Invalid object type")
+        node.invalidate()
 
-    def merge(self, node, replace=True):
+    def set_property(self, prop, path=""):
+        """Set property at specified path, existing property with the same name is replaced. A property which
+           belongs to other node is copied.
+        """
+        node = self.get_subnode(path)
+        if node is None:
+            raise Exception("{}: Path \"{}\" doesn't exists".format(self, path))
+        if not isinstance(prop, Property):
+            raise TypeError("Invalid object type")
+        if prop._parent is not None and prop._parent is not node:
+            from copy import deepcopy
+            prop = deepcopy(prop)
+        old_prop = node._props.get(prop.name)
+        if old_prop is not None and old_prop is not prop:
+            old_prop._parent = None
+        prop._parent = node
+        node._props[prop.name] = prop
+        if old_prop is None and node._prop_pos is not None:
+            node._prop_pos[prop.name] = len(node._props) - 1
+        node.invalidate()
+
+    def merge(self, node, replace=True, move=False):
         """ Merge two nodes and subnodes.
             Replace current properties with the given properties if replace is True.
+            New properties and subnodes are copied, or moved out of the given node if move is True, so the cost
+            depends only on the size of the given node and the given node is left with the remaining items.
         """
         if not isinstance(node, Node):
             raise TypeError("Invalid object type")
+        from copy import deepcopy
 
-        for prop in node.props:
-            index = self.get_property_index(prop.name)
-            if index is None:
-                self._props.append(deepcopy(prop))
-            elif prop in self._props:
+        for label in node._labels:
+            if label not in self._labels:
+                self._labels.append(label)
+
+        moved = []
+        for name, prop in node._props.items():
+            own_prop = self._props.get(name)
+            if own_prop is None:
+                pass
+            elif own_prop == prop or not replace:
                 continue
-            elif replace:
-                self._props[index] = copy(prop)
             else:
-                pass
-
-        for sub_node in node.nodes:
-            index = self.get_subnode_index(sub_node.name)
-            if index is None:
-                dup_node = deepcopy(sub_node)
-                dup_node.parent = self
-                self._nodes.append(dup_node)
-            elif sub_node in self._nodes:
+                own_prop._parent = None
+            if move:
+                moved.append(name)
+            else:
+                prop = deepcopy(prop)
+            prop._parent = self
+            self._props[name] = prop
+            if own_prop is None and self._prop_pos is not None:
+                self._prop_pos[name] = len(self._props) - 1
+            self.invalidate()
+        for name in moved:
+            del node._props[name]
+        if moved:
+            node._prop_pos = None
+            node.invalidate()
+
+        moved = []
+        for name, sub_node in node._nodes.items():
+            own_node = self._nodes.get(name)
+            if own_node is not None:
+                own_node.merge(sub_node, replace, move)
                 continue
+            if move:
+                moved.append(name)
             else:
-                self._nodes[index].merge(sub_node, replace)
+                sub_node = deepcopy(sub_node)
+            sub_node.parent = self
+            self._nodes[name] = sub_node
+            if self._node_pos is not None:
+                self._node_pos[name] = len(self._nodes) - 1
+            self.invalidate()
+        for name in moved:
+            del node._nodes[name]
+        if moved:
+            node._node_pos = None
+            node.invalidate()
 
     def to_dts(self, tabsize=4, depth=0):
         """Get NODE in string representation"""
-        dts  = line_offset(tabsize, depth, self.name + ' {\n')
-        dts += ''.join([prop.to_dts(tabsize, depth + 1) for prop in self._props])
-        dts += ''.join([node.to_dts(tabsize, depth + 1) for node in self._nodes])
-        dts += line_offset(tabsize, depth, "};\n")
-        return dts
+        return ''.join(self.iter_dts(tabsize, depth))
+
+    def iter_dts(self, tabsize=4, depth=0):
+        """Get NODE in string representation as generator of text chunks"""
+        yield line_offset(tabsize, depth, ''.join(label + ': ' for label in self._labels) + self.name + ' {\n')
+        for prop in self._props.values():
+            yield from prop.iter_dts(tabsize, depth + 1)
+        for node in self._nodes.values():
+            yield from node.iter_dts(tabsize, depth + 1)
+        yield line_offset(tabsize, depth, "};\n")
 
     def to_dtb(self, strings, pos=0, version=17):
         """Get NODE in binary blob representation"""
-        if self.name == '/':
-            blob = pack('>II', DTB_BEGIN_NODE, 0)
-        else:
-            blob = pack('>I', DTB_BEGIN_NODE)
-            blob += self.name.encode('ascii') + b'\0'
-        if len(blob) % 4:
-            blob += pack('b', 0) * (4 - (len(blob) % 4))
-        pos += len(blob)
-        for prop in self._props:
-            (data, strings, pos) = prop.to_dtb(strings, pos, version)
-            blob += data
-        for node in self._nodes:
-            (data, strings, pos) = node.to_dtb(strings, pos, version)
-            blob += data
+        strings = StringTable(strings)
+        end = self.dtb_size(pos, strings, version)
+        blob = bytearray(end)
+        self.dtb_write(blob, pos, strings, version)
+        return bytes(blob[pos:]), strings.export().decode('ascii'), end
+
+    def dtb_size(self, pos, strings, version=17, source=None):
+        """Get position behind the DTB representation placed at given position, collect property names.
+           Unmodified sub-trees parsed from the source blob are taken as they are (see dtb_write()).
+        """
+        if self._span is not None and self._span[0] is source:
+            return pos + self._span[2] - self._span[1]
+        pos += 4 + ((len(self.name) + 4) & ~0x3 if self.name != '/' else 4)
+        for prop in self._props.values():
+            strings.add(prop.name)
+            pos = prop.dtb_size(pos, version)
+        for node in self._nodes.values():
+            pos = node.dtb_size(pos, strings, version, source)
+        return pos + 4
+
+    def dtb_write(self, blob, pos, strings, version=17, source=None):
+        """Write DTB representation into preallocated blob (bytearray), returns position behind it.
+
+        Unmodified sub-trees parsed from the source blob are copied from it, the strings table must start with
+        the strings block of the source blob and version must be >= 16 (no alignment on absolute position).
+        """
+        span = self._span
+        if span is not None and span[0] is source:
+            end = pos + span[2] - span[1]
+            blob[pos: end] = source[span[1]: span[2]]
+            return end
+        pack_into('>I', blob, pos, DTB_BEGIN_NODE)
         pos += 4
-        blob += pack('>I', DTB_END_NODE)
-        return blob, strings, pos
+        if self.name != '/':
+            blob[pos: pos + len(self.name)] = self.name.encode('ascii')
+            pos += len(self.name)
+        pos = (pos + 4) & ~0x3
+        for prop in self._props.values():
+            pos = prop.dtb_write(blob, pos, strings, version)
+        for node in self._nodes.values():
+            pos = node.dtb_write(blob, pos, strings, version, source)
+        pack_into('>I', blob, pos, DTB_END_NODE)
+        return pos + 4
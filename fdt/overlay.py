@@ -0,0 +1,165 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from copy import deepcopy
+from struct import pack_into, unpack_from
+
+from .node import Node
+from .prop import Property, PropWords, PropStrings, PropBytes
+from .index import PhandleIndex, get_phandle
+from .parser import node_path
+
+
+def iter_nodes(node):
+    """Walk sub-tree, yield (relative path, node) in tree order, the path of given node is ''"""
+    todo_stack = [('', node)]
+    while todo_stack:
+        path, node = todo_stack.pop()
+        yield path, node
+        todo_stack.extend((path + '/' + name, sub_node) for name, sub_node in reversed(node._nodes.items()))
+
+
+def update_cell(node, name, offset, value):
+    """Set 32-bit cell at byte offset of property value"""
+    prop = None if node is None else node._props.get(name)
+    if prop is None:
+        raise Exception("Overlay: property \"{}\" doesn't exist".format(name))
+    if isinstance(prop, PropWords) and prop.word_size == 32 and offset % 4 == 0 and offset < len(prop) * 4:
+        prop.data[offset // 4] = value
+        prop.invalidate()
+        return
+    raw_value = bytearray(prop.dtb_value_size())
+    prop.dtb_write_value(raw_value, 0)
+    if offset + 4 > len(raw_value):
+        raise Exception("Overlay: offset {} is out of property \"{}\"".format(offset, name))
+    pack_into('>I', raw_value, offset, value)
+    if isinstance(prop, PropBytes):
+        prop.data = raw_value
+    elif isinstance(prop, PropWords):
+        node.set_property(PropWords.parse(name, raw_value, prop.word_size))
+    else:
+        node.set_property(Property.create(name, bytes(raw_value)))
+
+
+def get_cell(node, name, offset):
+    """Get 32-bit cell at byte offset of property value"""
+    prop = node._props[name]
+    raw_value = bytearray(prop.dtb_value_size())
+    prop.dtb_write_value(raw_value, 0)
+    return unpack_from('>I', raw_value, offset)[0]
+
+
+def get_target(rootnode, fragment, index):
+    """Get base tree node referenced by fragment 'target' phandle or 'target-path'"""
+    node = None
+    prop = fragment._props.get('target')
+    if prop is not None:
+        if isinstance(prop, PropWords) and len(prop) == 1:
+            node = index.get_node(prop[0])
+    else:
+        prop = fragment._props.get('target-path')
+        if isinstance(prop, PropStrings) and len(prop) == 1:
+            path = prop[0]
+            if not path.startswith('/'):
+                # alias name
+                aliases = rootnode._nodes.get('aliases')
+                alias = None if aliases is None else aliases._props.get(path)
+                path = alias[0] if isinstance(alias, PropStrings) else ''
+            node = rootnode.get_subnode(path.strip('/')) if path.startswith('/') else None
+    if node is None:
+        raise Exception("Overlay: target of \"{}\" not found in base tree".format(fragment.name))
+    return node
+
+
+def apply_overlay(rootnode, overlay, index):
+    """Apply overlay (root node of *.dtbo tree) to the base tree, the phandle index of base tree is updated"""
+    overlay = deepcopy(overlay)
+
+    # move overlay phandles above the phandles of base tree
+    delta = index.max_phandle
+    for _, node in iter_nodes(overlay):
+        for name in ('phandle', 'linux,phandle'):
+            prop = node._props.get(name)
+            if isinstance(prop, PropWords) and len(prop) == 1 and prop.word_size == 32:
+                prop.data[0] += delta
+                prop.invalidate()
+                index.max_phandle = max(index.max_phandle, prop[0])
+
+    # update references to the overlay nodes
+    local_fixups = overlay._nodes.get('__local_fixups__')
+    if local_fixups is not None:
+        overlay.remove_subnode('__local_fixups__')
+        for path, fixup_node in iter_nodes(local_fixups):
+            node = overlay.get_subnode(path[1:])
+            for prop in fixup_node._props.values():
+                if not isinstance(prop, PropWords):
+                    raise Exception("Overlay: invalid local fixup \"{}{}\"".format(path, prop.name))
+                for offset in prop:
+                    update_cell(node, prop.name, offset, get_cell(node, prop.name, offset) + delta)
+
+    # resolve references to the base tree symbols
+    fixups = overlay._nodes.get('__fixups__')
+    if fixups is not None:
+        overlay.remove_subnode('__fixups__')
+        for prop in fixups._props.values():
+            target = index.get_label(prop.name)
+            if target is None:
+                raise Exception("Overlay: symbol \"{}\" not found in base tree".format(prop.name))
+            phandle = index.allocate(target)
+            for fixup in (prop if isinstance(prop, PropStrings) else []):
+                fields = fixup.split(':')
+                if len(fields) != 3 or not fields[2].isdigit():
+                    raise Exception("Overlay: invalid fixup \"{}\"".format(fixup))
+                update_cell(overlay.get_subnode(fields[0].strip('/')), fields[1], int(fields[2]), phandle)
+
+    # merge the fragments into target nodes
+    targets = {}
+    for name, fragment in overlay._nodes.items():
+        content = fragment._nodes.get('__overlay__')
+        if content is None:
+            continue
+        target = get_target(rootnode, fragment, index)
+        indexed = [path for path, node in iter_nodes(content) if node.labels or get_phandle(node) is not None]
+        target.merge(content, move=True)
+        for path in indexed:
+            index.add(target.get_subnode(path[1:]))
+        targets['/' + name] = node_path(target)
+
+    # add symbols of the merged nodes
+    symbols = overlay._nodes.get('__symbols__')
+    if symbols is not None and symbols._props:
+        base_symbols = rootnode._nodes.get('__symbols__')
+        if base_symbols is None:
+            base_symbols = Node('__symbols__')
+            rootnode.append(base_symbols)
+        for prop in symbols._props.values():
+            if not isinstance(prop, PropStrings) or len(prop) != 1:
+                continue
+            fragment_path, _, path = prop[0].partition('/__overlay__')
+            if fragment_path not in targets:
+                continue
+            path = targets[fragment_path].rstrip('/') + path if path else targets[fragment_path]
+            base_symbols.set_property(PropStrings(prop.name, [path]))
+            node = rootnode.get_subnode(path.strip('/'))
+            if node is not None:
+                index.add_label(prop.name, node)
+
+
+def apply_overlays(rootnode, overlays, index=None):
+    """Apply overlays to the base tree in one pass, the phandle index of base tree is built just once"""
+    if index is None:
+        index = PhandleIndex(rootnode)
+    for overlay in overlays:
+        apply_overlay(rootnode, overlay, index)
+    return index
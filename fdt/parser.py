@@ -0,0 +1,684 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+from struct import pack
+
+from .node import Node
+from .prop import Property, PropStrings, PropWords, PropBytes, WORD_FORMATS
+from .misc import get_version_info, is_string
+from .index import get_phandle
+
+# Whitespaces and comments between tokens
+SKIP = r'(?:\s|//[^\n]*|/\*.*?\*/)*'
+
+# Token patterns for the individual parsing contexts
+PATTERNS = {
+    # node and property definitions
+    'stmt': r'''
+        (?P<DIR>/[a-z][a-z0-9-]*/)
+      | (?P<LABEL>[A-Za-z_][A-Za-z0-9_]*):
+      | (?P<REF>&(?:[A-Za-z_][A-Za-z0-9_]*|\{[^}]*\}))
+      | (?P<NAME>[A-Za-z0-9,._+*\#?@-]+)
+      | (?P<OP>[{};=/])
+    ''',
+    # property value items
+    'value': r'''
+        (?P<DIR>/[a-z][a-z0-9-]*/)
+      | (?P<STR>"(?:[^"\\\n]|\\.)*")
+      | (?P<LABEL>[A-Za-z_][A-Za-z0-9_]*):
+      | (?P<REF>&(?:[A-Za-z_][A-Za-z0-9_]*|\{[^}]*\}))
+      | (?P<NUM>(?:0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*)
+      | (?P<OP>[<\[(),;])
+    ''',
+    # cells and integer expressions inside <...>
+    'cells': r'''
+        (?P<NUM>(?:0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*)
+      | (?P<CHAR>'(?:[^'\\]|\\(?:x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.))')
+      | (?P<LABEL>[A-Za-z_][A-Za-z0-9_]*):
+      | (?P<REF>&(?:[A-Za-z_][A-Za-z0-9_]*|\{[^}]*\}))
+      | (?P<OP><<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^~!<>()?:])
+    ''',
+    # bytes inside [...]
+    'bytes': r'''
+        (?P<LABEL>[A-Za-z_][A-Za-z0-9_]*):
+      | (?P<BYTE>[0-9a-fA-F]{2})
+      | (?P<OP>\])
+    ''',
+}
+SKIP_SPACES = re.compile(SKIP, re.S)
+PATTERNS = {mode: re.compile(SKIP + '(?:' + pattern + r'|(?P<EOF>\Z))', re.X | re.S)
+            for mode, pattern in PATTERNS.items()}
+
+# Fast paths for plain statements, cells, strings and bytes (without expressions, references or comments)
+PLAIN_STATEMENT = re.compile(SKIP + r'([A-Za-z0-9,._+*#?@-]+)\s*([=;{])', re.S)
+PLAIN_VALUE = re.compile(r'\s*(?:<([0-9a-fA-FxX\s]*)>|("(?:[^"\\\n]|\\.)*"(?:\s*,\s*"(?:[^"\\\n]|\\.)*")*)'
+                         r'|\[([0-9a-fA-F\s]*)\])\s*;')
+PLAIN_CELLS = re.compile(r'([0-9a-fA-FxX\s]*)>')
+PLAIN_BYTES = re.compile(r'([0-9a-fA-F\s]*)\]')
+PLAIN_NUMBER = re.compile(r'0[xX][0-9a-fA-F]+|[1-9][0-9]*|0')
+STRING = re.compile(r'"((?:[^"\\\n]|\\.)*)"')
+
+# Binary operators precedence
+BINARY_OPS = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7, '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10
+}
+
+OPERATORS = {
+    '||': lambda a, b: int(bool(a or b)), '&&': lambda a, b: int(bool(a and b)),
+    '|': lambda a, b: a | b, '^': lambda a, b: a ^ b, '&': lambda a, b: a & b,
+    '==': lambda a, b: int(a == b), '!=': lambda a, b: int(a != b),
+    '<': lambda a, b: int(a < b), '>': lambda a, b: int(a > b),
+    '<=': lambda a, b: int(a <= b), '>=': lambda a, b: int(a >= b),
+    '<<': lambda a, b: a << b, '>>': lambda a, b: a >> b,
+    '+': lambda a, b: a + b, '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b, '/': lambda a, b: a // b, '%': lambda a, b: a % b,
+}
+
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+ESCAPES = {'a': '\a', 'b': '\b', 't': '\t', 'n': '\n', 'v': '\v', 'f': '\f', 'r': '\r'}
+ESCAPE_SEQ = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)', re.S)
+
+
+def unescape(text):
+    """Replace C-like escape sequences in string or char literal"""
+    def replace(match):
+        seq = match.group(1)
+        if seq[0] == 'x':
+            return chr(int(seq[1:], 16))
+        if seq[0] in '01234567':
+            return chr(int(seq, 8) & 0xFF)
+        return ESCAPES.get(seq, seq)
+    return ESCAPE_SEQ.sub(replace, text) if '\\' in text else text
+
+
+def string_value(text):
+    """Get value of DTS string literal as str of raw byte values (encoded by latin-1 into property value), the
+       non-ASCII chars are stored as UTF-8 bytes like dtc does, the escape sequences as single bytes
+    """
+    if not text.isascii():
+        text = text.encode('utf-8').decode('latin-1')
+    return unescape(text)
+
+
+def parse_int(text):
+    """Parse C-like integer literal"""
+    text = text.rstrip('uUlL')
+    if len(text) > 1 and text[0] == '0' and text[1] not in 'xX':
+        return int(text, 8)
+    return int(text, 0)
+
+
+def node_path(node):
+    """Get absolute path of node"""
+    names = []
+    while node.parent is not None:
+        names.append(node.name)
+        node = node.parent
+    return '/' + '/'.join(names[::-1])
+
+
+class Lexer(object):
+    """DTS text tokenizer, the tokens are recognized depending on parsing context (mode)"""
+
+    def __init__(self, text, name='<string>'):
+        self.text = text
+        self.name = name
+        self.pos = 0
+        self._peeked = None
+
+    def error(self, msg, pos=None):
+        pos = self.pos if pos is None else pos
+        line = self.text.count('\n', 0, pos) + 1
+        raise Exception("{}:{}: {}".format(self.name, line, msg))
+
+    def peek(self, mode):
+        """Get next token (kind, value, position, end position) without consuming it"""
+        if self._peeked is None or self._peeked[0] != mode:
+            self._peeked = (mode, self._match(mode))
+        return self._peeked[1]
+
+    def next(self, mode):
+        """Get next token (kind, value, position, end position) and consume it"""
+        if self._peeked is not None and self._peeked[0] == mode:
+            token = self._peeked[1]
+            self._peeked = None
+        else:
+            token = self._match(mode)
+        self.pos = token[3]
+        return token
+
+    def _match(self, mode):
+        match = PATTERNS[mode].match(self.text, self.pos)
+        if match is None:
+            pos = SKIP_SPACES.match(self.text, self.pos).end()
+            self.error("Unexpected character: {!r}".format(self.text[pos]), pos)
+        kind = match.lastgroup
+        return kind, match.group(kind), match.start(kind), match.end()
+
+    def match(self, pattern):
+        """Consume text matching pattern, returns match object or None"""
+        if self._peeked is not None:
+            return None
+        match = pattern.match(self.text, self.pos)
+        if match is not None:
+            self.pos = match.end()
+        return match
+
+    def expect(self, mode, value):
+        token = self.next(mode)
+        if token[1] != value:
+            self.error("Expected '{}', got: {}".format(value, token[1] if token[1] else token[0]), token[2])
+        return token
+
+
+class Parser(object):
+    """Single pass recursive descent DTS parser, creates Node/Property tree directly"""
+
+    def __init__(self, root_dir='', symbols=False):
+        self.root_dir = root_dir
+        self.symbols = symbols
+        self.version = {}
+        self.entries = []
+        self.rootnode = None
+        self.labels = {}
+        self.plugin = False
+        # paths of files read by /include/ and /incbin/
+        self.files = []
+        self._fragments = 0
+        # properties with references, created after whole tree is parsed
+        self._pending = []
+        self._refs = False
+
+    def parse(self, text, name='<string>'):
+        """Parse DTS text, can be called repeatedly for included files"""
+        self.version.update(get_version_info(text))
+        lex = Lexer(text, name)
+        while True:
+            kind, value, pos, _ = lex.next('stmt')
+            if kind == 'EOF':
+                break
+            labels = []
+            while kind == 'LABEL':
+                labels.append((value, pos))
+                kind, value, pos, _ = lex.next('stmt')
+            if kind == 'DIR':
+                # labels of /memreserve/ entries aren't kept
+                self._parse_directive(lex, value, pos)
+            elif kind == 'OP' and value == '/':
+                lex.expect('stmt', '{')
+                if self.rootnode is None:
+                    self.rootnode = Node('/')
+                for label, label_pos in labels:
+                    self._add_label(lex, label, self.rootnode, label_pos)
+                self._parse_node_body(lex, self.rootnode)
+            elif kind == 'REF':
+                node = self._add_fragment(lex, value, pos) if self.plugin else self._get_target(lex, value, pos)
+                lex.expect('stmt', '{')
+                for label, label_pos in labels:
+                    self._add_label(lex, label, node, label_pos)
+                self._parse_node_body(lex, node)
+            else:
+                lex.error("Unexpected token: {}".format(value), pos)
+        return self
+
+    def finish(self):
+        """Resolve references and create pending properties, overlay fixup nodes are created for /plugin/"""
+        phandles = self._collect_phandles()
+        fixups = {}
+        local_fixups = []
+        for node, placeholder, name, items, lex in self._pending:
+            if node.get_property(name) is not placeholder:
+                continue
+            offset = 0
+            for item in items:
+                if item[0] == 'path':
+                    target = self._get_target(lex, item[1], item[2])
+                    item[:] = ['str', node_path(target)]
+                elif item[0] == 'cells':
+                    for index, cell in enumerate(item[2]):
+                        if not isinstance(cell, tuple):
+                            continue
+                        target = self._find_target(cell[0])
+                        cell_offset = offset + index * 4
+                        if target is not None:
+                            item[2][index] = self._get_phandle(target, phandles)
+                            if self.plugin:
+                                local_fixups.append((node, name, cell_offset))
+                        elif self.plugin and not cell[0].startswith('&{'):
+                            # reference to symbol of base tree, resolved when the overlay is applied
+                            fixups.setdefault(cell[0][1:], []).append('{}:{}:{}'.format(node_path(node), name,
+                                                                                        cell_offset))
+                            item[2][index] = 0xFFFFFFFF
+                        else:
+                            lex.error("Reference to non-existent node or label: {}".format(cell[0]), cell[1])
+                offset += self._item_size(item)
+            node.set_property(self._create_property(name, items))
+        self._pending = []
+        if self.plugin:
+            self._add_overlay_nodes(fixups, local_fixups)
+        if self.plugin or self.symbols:
+            self._add_symbols()
+        return self
+
+    def _parse_directive(self, lex, value, pos):
+        if value == '/dts-v1/':
+            lex.expect('stmt', ';')
+        elif value == '/plugin/':
+            lex.expect('stmt', ';')
+            self.plugin = True
+        elif value == '/memreserve/':
+            address = self._parse_unary(lex)
+            size = self._parse_unary(lex)
+            lex.expect('stmt', ';')
+            self.entries.append({'address': address, 'size': size})
+        elif value == '/include/':
+            kind, file_name, pos, _ = lex.next('value')
+            if kind != 'STR':
+                lex.error("Expected file name", pos)
+            file_path = os.path.join(self.root_dir, unescape(file_name[1:-1]))
+            if not os.path.exists(file_path):
+                lex.error("File path doesn't exist: {}".format(file_path), pos)
+            self.files.append(file_path)
+            with open(file_path, 'r') as f:
+                self.parse(f.read(), file_path)
+        elif value == '/delete-node/':
+            kind, ref, pos, _ = lex.next('stmt')
+            if kind != 'REF':
+                lex.error("Expected node reference", pos)
+            node = self._get_target(lex, ref, pos)
+            lex.expect('stmt', ';')
+            if node.parent is not None:
+                self._delete_node(node)
+        else:
+            lex.error("Unexpected directive: {}".format(value), pos)
+
+    def _parse_node_body(self, lex, node):
+        while True:
+            match = lex.match(PLAIN_STATEMENT)
+            if match is not None:
+                kind, value, pos = 'NAME', match.group(1), match.start(1)
+                lex.pos = match.start(2)
+            else:
+                kind, value, pos, _ = lex.next('stmt')
+            if kind == 'OP' and value == '}':
+                lex.expect('stmt', ';')
+                return
+            if kind == 'DIR':
+                if value == '/omit-if-no-ref/':
+                    continue
+                if value not in ('/delete-node/', '/delete-property/'):
+                    lex.error("Unexpected directive: {}".format(value), pos)
+                kind, name, pos, _ = lex.next('stmt')
+                if kind != 'NAME':
+                    lex.error("Expected name", pos)
+                lex.expect('stmt', ';')
+                if value == '/delete-node/' and node.get_subnode(name) is not None:
+                    self._delete_node(node.get_subnode(name))
+                if value == '/delete-property/' and node.get_property(name) is not None:
+                    node.remove_property(name)
+                continue
+            labels = []
+            while kind == 'LABEL':
+                labels.append(value)
+                kind, value, pos, _ = lex.next('stmt')
+            if kind != 'NAME':
+                lex.error("Expected node or property name, got: {}".format(value), pos)
+            name = value
+            kind, value, pos, _ = lex.next('stmt')
+            if value == '{':
+                sub_node = node.get_subnode(name)
+                if sub_node is None:
+                    sub_node = Node(name)
+                    node.append(sub_node)
+                for label in labels:
+                    self._add_label(lex, label, sub_node, pos)
+                self._parse_node_body(lex, sub_node)
+            elif value == '=':
+                items, refs = self._parse_value(lex)
+                if refs:
+                    placeholder = Property(name)
+                    node.set_property(placeholder)
+                    self._pending.append((node, placeholder, name, items, lex))
+                else:
+                    node.set_property(self._create_property(name, items))
+            elif value == ';':
+                node.set_property(Property(name))
+            else:
+                lex.error("Unexpected token: {}".format(value), pos)
+
+    def _parse_value(self, lex):
+        """Parse property value items, returns items and flag if they contain references"""
+        self._refs = False
+        match = lex.match(PLAIN_VALUE)
+        if match is not None:
+            if match.group(2) is not None:
+                return [['str', string_value(chars)] for chars in STRING.findall(match.group(2))], False
+            if match.group(3) is not None:
+                try:
+                    return [['bytes', bytes.fromhex(match.group(3))]], False
+                except ValueError:
+                    pass
+            else:
+                cells = self._plain_cells(lex, match.group(1), 32)
+                if cells is not None:
+                    return [['cells', 32, cells]], False
+            lex.pos = match.start()
+        items = []
+        while True:
+            kind, value, pos, _ = lex.next('value')
+            while kind == 'LABEL':
+                kind, value, pos, _ = lex.next('value')
+            if kind == 'STR':
+                items.append(['str', string_value(value[1:-1])])
+            elif kind == 'OP' and value == '<':
+                items.append(['cells', 32, self._parse_cells(lex, 32)])
+            elif kind == 'DIR' and value == '/bits/':
+                kind, bits, pos, _ = lex.next('value')
+                if kind != 'NUM' or parse_int(bits) not in (8, 16, 32, 64):
+                    lex.error("Invalid /bits/ size: {}".format(bits), pos)
+                lex.expect('value', '<')
+                items.append(['cells', parse_int(bits), self._parse_cells(lex, parse_int(bits))])
+            elif kind == 'OP' and value == '[':
+                items.append(['bytes', self._parse_bytes(lex)])
+            elif kind == 'REF':
+                items.append(['path', value, pos])
+                self._refs = True
+            elif kind == 'DIR' and value == '/incbin/':
+                items.append(['bytes', self._parse_incbin(lex)])
+            else:
+                lex.error("Unexpected property value: {}".format(value), pos)
+            kind, value, pos, _ = lex.next('value')
+            if value == ';':
+                return items, self._refs
+            if value != ',':
+                lex.error("Expected ',' or ';', got: {}".format(value), pos)
+
+    def _parse_cells(self, lex, bits):
+        mask = (1 << bits) - 1
+        match = lex.match(PLAIN_CELLS)
+        if match is not None:
+            cells = self._plain_cells(lex, match.group(1), bits)
+            if cells is not None:
+                return cells
+            lex.pos = match.start()
+        cells = []
+        while True:
+            kind, value, pos, _ = lex.peek('cells')
+            if kind == 'OP' and value == '>':
+                lex.next('cells')
+                return cells
+            if kind == 'LABEL':
+                lex.next('cells')
+            elif kind == 'REF':
+                lex.next('cells')
+                if bits != 32:
+                    lex.error("References are only allowed in 32-bit cells", pos)
+                cells.append((value, pos))
+                self._refs = True
+            else:
+                cell = self._parse_unary(lex)
+                if cell > mask and (cell | mask) != MASK_64:
+                    lex.error("Value out of range for {}-bit cell: {:#x}".format(bits, cell), pos)
+                cells.append(cell & mask)
+
+    @staticmethod
+    def _plain_cells(lex, text, bits):
+        """Convert plain cells list text, returns None if it isn't plain list of numbers"""
+        cells = text.split()
+        if not all(PLAIN_NUMBER.fullmatch(cell) for cell in cells):
+            return None
+        cells = [int(cell, 0) for cell in cells]
+        if cells and max(cells) >> bits:
+            lex.error("Value out of range for {}-bit cell: {:#x}".format(bits, max(cells)))
+        return cells
+
+    def _parse_bytes(self, lex):
+        match = lex.match(PLAIN_BYTES)
+        if match is not None:
+            try:
+                return bytes.fromhex(match.group(1))
+            except ValueError:
+                lex.pos = match.start()
+        data = bytearray()
+        while True:
+            kind, value, pos, _ = lex.next('bytes')
+            if kind == 'OP':
+                return bytes(data)
+            if kind == 'BYTE':
+                data.append(int(value, 16))
+
+    def _parse_incbin(self, lex):
+        lex.expect('value', '(')
+        kind, file_name, pos, _ = lex.next('value')
+        if kind != 'STR':
+            lex.error("Expected file name", pos)
+        args = []
+        while True:
+            kind, value, pos, _ = lex.next('value')
+            if value == ')':
+                break
+            if value != ',' or len(args) == 2:
+                lex.error("Unexpected token in /incbin/: {}".format(value), pos)
+            args.append(self._parse_unary(lex))
+        file_path = os.path.join(self.root_dir, unescape(file_name[1:-1]))
+        if not os.path.exists(file_path):
+            raise Exception("File path doesn't exist: {}".format(file_path))
+        self.files.append(file_path)
+        with open(file_path, "rb") as f:
+            f.seek(args[0] if args else 0)
+            return f.read(args[1]) if len(args) > 1 else f.read()
+
+    def _parse_expr(self, lex):
+        value = self._parse_binary(lex, 1)
+        if lex.peek('cells')[1] == '?':
+            lex.next('cells')
+            true_value = self._parse_expr(lex)
+            lex.expect('cells', ':')
+            false_value = self._parse_expr(lex)
+            value = true_value if value else false_value
+        return value
+
+    def _parse_binary(self, lex, min_prec):
+        left = self._parse_unary(lex)
+        while True:
+            kind, op, pos, _ = lex.peek('cells')
+            prec = BINARY_OPS.get(op) if kind == 'OP' else None
+            if prec is None or prec < min_prec:
+                return left
+            lex.next('cells')
+            right = self._parse_binary(lex, prec + 1)
+            if op in ('/', '%') and right == 0:
+                lex.error("Division by zero", pos)
+            left = OPERATORS[op](left, right) & MASK_64
+
+    def _parse_unary(self, lex):
+        kind, value, pos, _ = lex.next('cells')
+        if kind == 'NUM':
+            return parse_int(value)
+        if kind == 'CHAR':
+            char = unescape(value[1:-1])
+            if len(char) != 1:
+                lex.error("Invalid char literal: {}".format(value), pos)
+            return ord(char)
+        if kind == 'OP' and value == '(':
+            value = self._parse_expr(lex)
+            lex.expect('cells', ')')
+            return value
+        if kind == 'OP' and value == '-':
+            return -self._parse_unary(lex) & MASK_64
+        if kind == 'OP' and value == '~':
+            return ~self._parse_unary(lex) & MASK_64
+        if kind == 'OP' and value == '!':
+            return int(not self._parse_unary(lex))
+        lex.error("Unexpected token in expression: {}".format(value), pos)
+
+    def _add_label(self, lex, label, node, pos):
+        if label in self.labels and self.labels[label] is not node:
+            lex.error("Duplicate label: {}".format(label), pos)
+        self.labels[label] = node
+        if label not in node.labels:
+            node.labels.append(label)
+
+    def _delete_node(self, node):
+        """Remove node from its parent, the labels of removed sub-tree can't be referenced anymore"""
+        todo = [node]
+        while todo:
+            item = todo.pop()
+            for label in item.labels:
+                if self.labels.get(label) is item:
+                    del self.labels[label]
+            todo.extend(item.nodes)
+        node.parent.remove_subnode(node.name)
+
+    def _find_target(self, ref):
+        """Get node referenced by &label or &{/path}, None if doesn't exist"""
+        if ref.startswith('&{'):
+            path = ref[2:-1]
+            return None if self.rootnode is None else self.rootnode.get_subnode(path.strip('/'))
+        return self.labels.get(ref[1:])
+
+    def _get_target(self, lex, ref, pos):
+        """Get node referenced by &label or &{/path}"""
+        node = self._find_target(ref)
+        if node is None:
+            lex.error("Reference to non-existent node or label: {}".format(ref), pos)
+        return node
+
+    def _add_fragment(self, lex, ref, pos):
+        """Create overlay fragment targeting &label or &{/path}, returns its __overlay__ node"""
+        if self.rootnode is None:
+            self.rootnode = Node('/')
+        fragment = Node('fragment@{}'.format(self._fragments))
+        self._fragments += 1
+        self.rootnode.append(fragment)
+        if ref.startswith('&{'):
+            fragment.append(PropStrings('target-path', [ref[2:-1]]))
+        else:
+            placeholder = Property('target')
+            fragment.append(placeholder)
+            self._pending.append((fragment, placeholder, 'target', [['cells', 32, [(ref, pos)]]], lex))
+        content = Node('__overlay__')
+        fragment.append(content)
+        return content
+
+    def _add_overlay_nodes(self, fixups, local_fixups):
+        """Create __fixups__ and __local_fixups__ nodes of overlay"""
+        if self.rootnode is None:
+            return
+        if fixups:
+            fixups = [PropStrings(label, paths) for label, paths in fixups.items()]
+            self._add_overlay_node(Node('__fixups__', fixups))
+        if local_fixups:
+            root = Node('__local_fixups__')
+            for node, name, offset in local_fixups:
+                fixup_node = root
+                for sub_name in node_path(node).split('/')[1:]:
+                    sub_node = fixup_node.get_subnode(sub_name)
+                    if sub_node is None:
+                        sub_node = Node(sub_name)
+                        fixup_node.append(sub_node)
+                    fixup_node = sub_node
+                prop = fixup_node.get_property(name)
+                if prop is None:
+                    fixup_node.append(PropWords(name, [offset]))
+                else:
+                    prop.append(offset)
+            self._add_overlay_node(root)
+
+    def _add_symbols(self):
+        """Create __symbols__ node with paths of labeled nodes"""
+        if self.rootnode is None:
+            return
+        symbols = []
+        for label, node in self.labels.items():
+            path = node_path(node)
+            if self.rootnode.get_subnode(path[1:]) is node:
+                symbols.append(PropStrings(label, [path]))
+        if symbols:
+            self._add_overlay_node(Node('__symbols__', symbols))
+
+    def _collect_phandles(self):
+        phandles = {'used': set(), 'next': 1}
+        if self._pending and self.rootnode is not None:
+            todo = [self.rootnode]
+            while todo:
+                node = todo.pop()
+                for name in ('phandle', 'linux,phandle'):
+                    prop = node.get_property(name)
+                    if isinstance(prop, PropWords) and len(prop) == 1:
+                        phandles['used'].add(prop[0])
+                todo.extend(node.nodes)
+        return phandles
+
+    @staticmethod
+    def _get_phandle(node, phandles):
+        """Get phandle of node ('phandle' or legacy 'linux,phandle'), allocate new one if doesn't exist"""
+        phandle = get_phandle(node)
+        if phandle is not None:
+            return phandle
+        while phandles['next'] in phandles['used']:
+            phandles['next'] += 1
+        phandle = phandles['next']
+        phandles['used'].add(phandle)
+        node.set_property(PropWords('phandle', [phandle]))
+        return phandle
+
+    def _add_overlay_node(self, node):
+        """Append node into root node, merge it into existing node with the same name"""
+        own_node = self.rootnode.get_subnode(node.name)
+        if own_node is None:
+            self.rootnode.append(node)
+        else:
+            own_node.merge(node, move=True)
+
+    @staticmethod
+    def _item_size(item):
+        """Get size of value item in raw property value"""
+        if item[0] == 'str':
+            return len(item[1]) + 1
+        if item[0] == 'cells':
+            return len(item[2]) * item[1] // 8
+        return len(item[1])
+
+    @staticmethod
+    def _create_property(name, items):
+        """Create property obj of the best matching type from value items"""
+        if len(items) == 1 and items[0][0] == 'cells':
+            return PropWords(name, items[0][2], items[0][1])
+        if len(items) == 1 and items[0][0] == 'bytes':
+            return PropBytes(name, items[0][1])
+        kinds = set(item[0] for item in items)
+        if kinds == {'str'}:
+            data = [item[1] for item in items]
+            # empty strings are kept as strings (prop = "";), the rest must be printable
+            chars = ''.join(data)
+            if not chars or is_string(chars.encode('latin-1') + b'\0'):
+                return PropStrings(name, data)
+        if kinds == {'cells'} and len(set(item[1] for item in items)) == 1:
+            return PropWords(name, [cell for item in items for cell in item[2]], items[0][1])
+        if kinds == {'bytes'}:
+            return PropBytes(name, b''.join(item[1] for item in items))
+        raw_value = bytearray()
+        for item in items:
+            if item[0] == 'str':
+                raw_value += item[1].encode('latin-1') + b'\0'
+            elif item[0] == 'cells':
+                raw_value += pack('>{}{}'.format(len(item[2]), WORD_FORMATS[item[1]]), *item[2])
+            else:
+                raw_value += item[1]
+        return PropBytes(name, raw_value)
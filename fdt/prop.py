@@ -12,14 +12,113 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from struct import unpack, pack
-from string import printable
+import sys
+from sys import intern
+from array import array
+from struct import pack_into
 
 from .head import DTB_PROP
-from .misc import is_string, line_offset
+from .misc import is_string, line_offset, deepcopy_detached, StringTable, printable
+
+# Allowed chars of names and strings
+PRINTABLE = frozenset(printable)
+
+# Max count of value items formatted into one DTS text chunk
+DTS_CHUNK_SIZE = 4096
+
+# Escape sequences of special chars in DTS strings
+ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+# Size of content digests in bytes
+DIGEST_SIZE = 16
+
+# Struct formats of supported word sizes
+WORD_FORMATS = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}
+
+# Array typecodes of supported word sizes
+WORD_TYPECODES = {size: [code for code in 'BHILQ' if array(code).itemsize * 8 == size][0] for size in WORD_FORMATS}
+
+
+def escape(chars):
+    """Escape special chars in DTS string"""
+    return chars.translate(ESCAPES)
+
+
+def word_error(values, word_size):
+    """Get ValueError of the first word out of range in values (int or sequence)"""
+    if isinstance(values, int):
+        values = [values]
+    value = next(word for word in values if not 0 <= word < 2**word_size)
+    return ValueError("Invalid word value {}, requires <0x0 - 0x{:X}>".format(value, 2**word_size - 1))
+
+
+def tracked_type(base, methods, state, checked=(), **namespace):
+    """Create subclass of mutable container type, which invalidates its owner property when modified by methods.
+       The owner is set by the data getter of property, the copies are created without owner from constructor
+       arguments given by state(container). The OverflowError of checked methods is raised as ValueError.
+    """
+    def wrap(name):
+        method = getattr(base, name)
+
+        def wrapper(self, *args):
+            if name in checked:
+                if not isinstance(args[-1], (int, base)):
+                    # the values are needed in the error and extend() keeps the items added before the failure
+                    args = args[:-1] + (list(args[-1]),)
+                size = len(self)
+                try:
+                    if isinstance(args[0], slice) and isinstance(args[-1], list):
+                        args = (args[0], base(self.typecode, args[-1]))
+                    result = method(self, *args)
+                except OverflowError:
+                    if len(self) > size:
+                        base.__delitem__(self, slice(size, None))
+                    raise word_error(args[-1], self.itemsize * 8) from None
+            else:
+                result = method(self, *args)
+            owner = getattr(self, '_owner', None)
+            if owner is not None:
+                owner.invalidate()
+            return result
+
+        wrapper.__name__ = name
+        return wrapper
+
+    def reduce(self, protocol=None):
+        return cls, state(self)
+
+    def copy(self, memo=None):
+        # the items are immutable
+        return cls(*state(self))
+
+    namespace.update({name: wrap(name) for name in methods})
+    namespace.update(__slots__=('_owner',), __reduce_ex__=reduce, __reduce__=reduce, __copy__=copy,
+                     __deepcopy__=copy)
+    cls = type('Tracked' + base.__name__.capitalize(), (base,), namespace)
+    return cls
+
+
+MUTATORS = ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove',
+            'reverse', 'clear')
+
+# Containers of property values, modifications in place invalidate digest and DTB span of the property
+TrackedList = tracked_type(list, MUTATORS + ('sort',), lambda data: (list(data),))
+TrackedBytearray = tracked_type(bytearray, MUTATORS, lambda data: (bytes(data),))
+TrackedArray = tracked_type(array, tuple(name for name in MUTATORS if name != 'clear') +
+                            ('byteswap', 'frombytes', 'fromlist', 'fromfile'),
+                            lambda data: (data.typecode, data.tobytes()),
+                            checked=('__setitem__', 'append', 'extend', 'insert', 'fromlist'),
+                            # equal to list or tuple of the same words, as the list of words used before
+                            __eq__=lambda self, other: (list(self) == list(other) if isinstance(other, (list, tuple))
+                                                        else array.__eq__(self, other)),
+                            __ne__=lambda self, other: not self == other,
+                            __hash__=None)
 
 
 class Property(object):
+    """Property without value"""
+
+    __slots__ = ('_name', '_parent', '_digest')
 
     @property
     def name(self):
@@ -29,22 +128,44 @@ class Property(object):
     def name(self, value):
         if not isinstance(value, str):
             raise ValueError("The value must be a string type !")
-        if not all(c in printable for c in value):
+        if not PRINTABLE.issuperset(value):
             raise ValueError("The value must contain just printable chars !")
-        self._name = value
+        if self._parent is not None and self._parent._props.get(self._name) is self and value != self._name:
+            if value in self._parent._props:
+                raise ValueError("Property \"{}\" already exists".format(value))
+            # keep the name map of parent node in sync, with the original order
+            self._parent._props = {(value if key == self._name else key): item
+                                   for key, item in self._parent._props.items()}
+            self._parent._prop_pos = None
+        self._name = intern(value)
+        self.invalidate()
 
     @property
-    def basepath(self):
-        return self._basepath
+    def parent(self):
+        """Node which owns the property"""
+        return self._parent
 
-    @basepath.setter
-    def basepath(self, value):
-        self._basepath = value
+    @property
+    def digest(self):
+        """Content digest (type, name and value), cached until the property is modified"""
+        if self._digest is None:
+            from hashlib import blake2b
+            value = bytearray(self.dtb_value_size())
+            self.dtb_write_value(value, 0)
+            digest = blake2b(value, digest_size=DIGEST_SIZE)
+            digest.update('{}:{}:{}'.format(type(self).__name__, getattr(self, 'word_size', 0), self._name).encode())
+            self._digest = digest.digest()
+        return self._digest
 
     def __init__(self, name):
         """Init with name"""
+        self._parent = None
+        self._digest = None
         self.name = name
-        self._basepath = None
+
+    def __deepcopy__(self, memo):
+        """Deep copy of property, the node which owns it is not copied"""
+        return deepcopy_detached(self, memo)
 
     def __str__(self):
         """String representation"""
@@ -66,46 +187,106 @@ class Property(object):
             return False
         return True
 
+    def invalidate(self):
+        """Drop cached digest of the property and cached state of its nodes, required after direct changes of value
+           data (item assignment does it)
+        """
+        self._digest = None
+        if self._parent is not None:
+            self._parent.invalidate()
+
     def to_dts(self, tabsize=4, depth=0):
         """Get dts string representation"""
-        return line_offset(tabsize, depth, '{};\n'.format(self.name))
+        return ''.join(self.iter_dts(tabsize, depth))
+
+    def iter_dts(self, tabsize=4, depth=0):
+        """Get dts string representation as generator of text chunks"""
+        yield line_offset(tabsize, depth, '{};\n'.format(self.name))
 
     def to_dtb(self, strings, pos=0, version=17):
         """Get blob representation"""
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
+        strings = StringTable(strings)
+        strings.add(self.name)
+        end = self.dtb_size(pos, version)
+        blob = bytearray(end)
+        self.dtb_write(blob, pos, strings, version)
+        return bytes(blob[pos:]), strings.export().decode('ascii'), end
+
+    def dtb_value_size(self):
+        """Get size of raw value in DTB"""
+        return 0
+
+    def dtb_size(self, pos, version=17):
+        """Get position behind the DTB representation placed at given position"""
+        size = self.dtb_value_size()
+        pos += 12
+        if version < 16 and size >= 8:
+            pos = (pos + 7) & ~0x7
+        return (pos + size + 3) & ~0x3
+
+    def dtb_write(self, blob, pos, strings, version=17):
+        """Write DTB representation into preallocated blob (bytearray), returns position behind it"""
+        size = self.dtb_value_size()
+        pack_into('>III', blob, pos, DTB_PROP, size, strings.offsets[self.name])
         pos += 12
-        return pack('>III', DTB_PROP, 0, strpos), strings, pos
+        if version < 16 and size >= 8:
+            pos = (pos + 7) & ~0x7
+        self.dtb_write_value(blob, pos)
+        return (pos + size + 3) & ~0x3
+
+    def dtb_write_value(self, blob, pos):
+        """Write raw value into preallocated blob"""
+        pass
 
     @classmethod
-    def create(cls, name, raw_value):
-        """ Instantiate property with raw value type """
-        if is_string(raw_value):
+    def create(cls, name, raw_value, prop_type=None):
+        """ Instantiate property with raw value type, or with given type (see PROP_TYPES) if the value fits """
+        size = len(raw_value)
+        if not size:
+            return cls(name)
+
+        if prop_type is not None:
+            if prop_type is PropBytes:
+                return PropBytes(name, raw_value)
+            if prop_type is PropStrings:
+                if raw_value[-1] == 0 and is_string(raw_value):
+                    return PropStrings(name, bytes(raw_value[:-1]).decode('ascii').split('\0'))
+            else:
+                word_size = 32 if prop_type is PropWords else prop_type
+                if size % (word_size // 8) == 0:
+                    return PropWords.parse(name, raw_value, word_size)
+            # the value doesn't match the type, use heuristics
+
+        # only NUL terminated value can be strings, skip the classification of words and bytes early
+        if raw_value[-1] == 0 and is_string(raw_value):
             obj = PropStrings(name)
             # Extract strings from raw value
-            for st in raw_value.decode('ascii').split('\0'):
-                if len(st): obj.append(st)
+            obj.data = bytes(raw_value[:-1]).decode('ascii').split('\0')
             return obj
 
-        elif len(raw_value) and len(raw_value) % 4 == 0:
-            obj = PropWords(name)
-            # Extract words from raw value
-            for i in range(0, len(raw_value), 4):
-                obj.append(unpack(">I", raw_value[i:i + 4])[0])
-            return obj
-
-        elif len(raw_value) and len(raw_value):
-            return PropBytes(name, raw_value)
+        elif size % 4 == 0:
+            return PropWords.parse(name, raw_value)
 
         else:
-            return cls(name)
+            return PropBytes(name, raw_value)
 
 
 class PropStrings(Property):
     """Property with strings as value"""
 
+    __slots__ = ('_data',)
+
+    @property
+    def data(self):
+        """List of strings, modifications in place are tracked"""
+        self._data._owner = self
+        return self._data
+
+    @data.setter
+    def data(self, strings):
+        self._data = TrackedList(strings)
+        self.invalidate()
+
     def __init__(self, name, strings=None):
         """Init with strings"""
         super().__init__(name)
@@ -129,130 +310,169 @@ class PropStrings(Property):
             return False
         if self.name != prop.name:
             return False
-        if len(self) != len(prop):
-            return False
-        for index in range(len(self)):
-            if self.data[index] != prop[index]:
-                return False
-        return True
+        return list(self.data) == list(prop.data)
 
     def append(self, value):
         if not isinstance(value, str):
             raise TypeError("Invalid object type")
         if len(value) == 0:
             raise ValueError("Invalid strings value")
-        if not all(c in printable or c in ('\r', '\n') for c in value):
+        if not PRINTABLE.issuperset(value):
             raise ValueError("Invalid chars in strings value")
         self.data.append(value)
+        self.invalidate()
 
     def pop(self, index):
         assert 0 <= index < len(self.data)
+        self.invalidate()
         return self.data.pop(index)
 
     def clear(self):
         self.data.clear()
+        self.invalidate()
 
-    def to_dts(self, tabsize=4, depth=0):
-        """Get DTS representation"""
+    def iter_dts(self, tabsize=4, depth=0):
+        """Get DTS representation as generator of text chunks"""
         result  = line_offset(tabsize, depth, self.name)
         result += ' = "'
-        result += '", "'.join(self.data)
+        result += '", "'.join([escape(chars) for chars in self.data])
         result += '";\n'
-        return result
+        yield result
 
-    def to_dtb(self, strings, pos=0, version=17):
-        """Get DTB representation"""
-        blob = pack('')
+    def dtb_value_size(self):
+        """Get size of raw value in DTB"""
+        return sum(len(chars) + 1 for chars in self.data)
+
+    def dtb_write_value(self, blob, pos):
+        """Write raw value into preallocated blob"""
         for chars in self.data:
-            blob += chars.encode('ascii') + pack('b', 0)
-        blob_len = len(blob)
-        if version < 16 and (pos + 12) % 8 != 0:
-            blob = pack('b', 0) * (8 - ((pos + 12) % 8)) + blob
-        if blob_len % 4:
-            blob += pack('b', 0) * (4 - (blob_len % 4))
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        blob = pack('>III', DTB_PROP, blob_len, strpos) + blob
-        pos += len(blob)
-        return (blob, strings, pos)
+            blob[pos: pos + len(chars)] = chars.encode('ascii')
+            pos += len(chars) + 1
 
 
 class PropWords(Property):
     """Property with words as value"""
 
+    __slots__ = ('word_size', '_data')
+
     def __init__(self, name, words=None, word_size=32):
         """Init with words"""
         super().__init__(name)
-        self.data = [] if words is None else words
+        if word_size not in WORD_FORMATS:
+            raise ValueError("Invalid word size {}, requires 8, 16, 32 or 64".format(word_size))
         self.word_size = word_size
+        self.data = [] if words is None else words
+
+    @property
+    def data(self):
+        """Array of words, modifications in place are tracked"""
+        self._data._owner = self
+        return self._data
+
+    @data.setter
+    def data(self, words):
+        """Words are stored in compact array of native integers"""
+        if not isinstance(words, (list, tuple, array)):
+            words = list(words)
+        try:
+            self._data = TrackedArray(WORD_TYPECODES[self.word_size], words)
+        except OverflowError:
+            raise word_error(words, self.word_size) from None
+        self.invalidate()
 
     def __str__(self):
         """String representation"""
-        return "{} = Words: {}".format(self.name, self.data)
+        return "{} = Words: {}".format(self.name, list(self.data))
 
     def __getitem__(self, index):
         """Get words, returns a word integer"""
         return self.data[index]
 
+    def __setitem__(self, index, value):
+        """Set word at index"""
+        if not 0 <= value < 2**self.word_size:
+            raise ValueError("Invalid word value {}, requires <0x0 - 0x{:X}>".format(value, 2**self.word_size - 1))
+        self.data[index] = value
+        self.invalidate()
+
     def __len__(self):
         """Get words count"""
         return len(self.data)
 
+    @classmethod
+    def parse(cls, name, raw_value, word_size=32):
+        """Instantiate property from raw big-endian value, words are decoded in bulk"""
+        obj = cls(name, word_size=word_size)
+        obj.data.frombytes(raw_value)
+        if sys.byteorder == 'little' and word_size > 8:
+            obj.data.byteswap()
+        return obj
+
     def __eq__(self, prop):
         """Check properties are the same (same values)"""
         if not isinstance(prop, PropWords):
             return False
-        if self.name != prop.name:
-            return False
-        if len(self) != len(prop):
+        if self.name != prop.name or self.word_size != prop.word_size:
             return False
-        for index in range(len(self)):
-            if self.data[index] != prop[index]:
-                return False
-        return True
+        return self.data == prop.data
 
     def append(self, value):
         if not 0 <= value < 2**self.word_size:
             raise ValueError("Invalid word value {}, requires <0x0 - 0x{:X}>".format(value, 2**self.word_size - 1))
         self.data.append(value)
+        self.invalidate()
 
     def pop(self, index):
         assert 0 <= index < len(self.data)
+        self.invalidate()
         return self.data.pop(index)
 
     def clear(self):
-        self.data.clear()
-
-    def to_dts(self, tabsize=4, depth=0):
-        """Get DTS representation"""
-        result  = line_offset(tabsize, depth, self.name)
-        result += ' = <'
-        result += ' '.join(["0x{:X}".format(word) for word in self.data])
-        result += ">;\n"
-        return result
-
-    def to_dtb(self, strings, pos=0, version=17):
-        """Get DTB representation"""
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        blob  = pack('>III', DTB_PROP, len(self.data) * 4, strpos)
-        for word in self.data:
-            blob += pack('>I', word)
-        pos  += len(blob)
-        return (blob, strings, pos)
+        del self.data[:]
+        self.invalidate()
+
+    def iter_dts(self, tabsize=4, depth=0):
+        """Get DTS representation as generator of text chunks"""
+        bits = '' if self.word_size == 32 else '/bits/ {} '.format(self.word_size)
+        yield line_offset(tabsize, depth, self.name) + ' = ' + bits + '<'
+        for index in range(0, len(self.data), DTS_CHUNK_SIZE):
+            chunk = ' '.join(map("0x{:X}".format, self.data[index: index + DTS_CHUNK_SIZE]))
+            yield chunk if index == 0 else ' ' + chunk
+        yield ">;\n"
+
+    def dtb_value_size(self):
+        """Get size of raw value in DTB"""
+        return len(self.data) * (self.word_size // 8)
+
+    def dtb_write_value(self, blob, pos):
+        """Write raw value into preallocated blob"""
+        words = self.data
+        if sys.byteorder == 'little' and self.word_size > 8:
+            words = array(words.typecode, words)
+            words.byteswap()
+        blob[pos: pos + len(words) * words.itemsize] = words
 
 
 class PropBytes(Property):
     """Property with bytes as value"""
 
+    __slots__ = ('_data',)
+
+    @property
+    def data(self):
+        """Bytearray, modifications in place are tracked"""
+        self._data._owner = self
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = TrackedBytearray(value)
+        self.invalidate()
+
     def __init__(self, name, data=None):
         """Init with bytes"""
         super().__init__(name)
-        self.data = bytearray() if data is None else bytearray(data)
+        self.data = b"" if data is None else data
 
     def __str__(self):
         """String representation"""
@@ -262,6 +482,13 @@ class PropBytes(Property):
         """Get words, returns a word integer"""
         return self.data[index]
 
+    def __setitem__(self, index, value):
+        """Set byte at index"""
+        if not 0 <= value <= 0xFF:
+            raise ValueError("Invalid byte value {}, requires <0 - 255>".format(value))
+        self.data[index] = value
+        self.invalidate()
+
     def __len__(self):
         """Get words count"""
         return len(self.data)
@@ -272,43 +499,89 @@ class PropBytes(Property):
             return False
         if self.name != prop.name:
             return False
-        if len(self) != len(prop):
-            return False
-        for index in range(len(self)):
-            if self.data[index] != prop[index]:
-                return False
-        return True
+        return self.data == prop.data
 
     def append(self, value):
         if not 0 <= value <= 0xFF:
             raise ValueError("Invalid byte value {}, requires <0 - 255>".format(value))
         self.data.append(value)
+        self.invalidate()
 
     def pop(self, index):
         assert 0 <= index < len(self.data)
+        self.invalidate()
         return self.data.pop(index)
 
     def clear(self):
         self.data = bytearray()
 
-    def to_dts(self, tabsize=4, depth=0):
-        """Get DTS representation"""
-        result  = line_offset(tabsize, depth, self.name)
-        result += ' = ['
-        result += ' '.join(["{:02X}".format(byte) for byte in self.data])
-        result += '];\n'
-        return result
+    def iter_dts(self, tabsize=4, depth=0):
+        """Get DTS representation as generator of text chunks"""
+        yield line_offset(tabsize, depth, self.name) + ' = ['
+        for index in range(0, len(self.data), DTS_CHUNK_SIZE):
+            chunk = self.data[index: index + DTS_CHUNK_SIZE].hex(' ').upper()
+            yield chunk if index == 0 else ' ' + chunk
+        yield '];\n'
 
-    def to_dtb(self, strings, pos=0, version=17):
-        """Get DTB representation"""
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        blob  = pack('>III', DTB_PROP, len(self.data), strpos)
-        blob += bytes(self.data)
-        if len(blob) % 4:
-            blob += bytes([0] * (4 - (len(blob) % 4)))
-        pos += len(blob)
-        return (blob, strings, pos)
+    def dtb_value_size(self):
+        """Get size of raw value in DTB"""
+        return len(self.data)
 
+    def dtb_write_value(self, blob, pos):
+        """Write raw value into preallocated blob"""
+        blob[pos: pos + len(self.data)] = self.data
+
+
+# Value types of well-known properties for Property.create(), name -> PropStrings, PropBytes, PropWords or word
+# size of PropWords (8, 16, 32 or 64). The '*-suffix' keys match names ending with '-suffix'.
+PROP_TYPES = {
+    'compatible': PropStrings,
+    'model': PropStrings,
+    'status': PropStrings,
+    'device_type': PropStrings,
+    'label': PropStrings,
+    'bootargs': PropStrings,
+    'stdout-path': PropStrings,
+    'linux,stdout-path': PropStrings,
+    'enable-method': PropStrings,
+    'phy-mode': PropStrings,
+    'phy-connection-type': PropStrings,
+    'reg': PropWords,
+    'ranges': PropWords,
+    'dma-ranges': PropWords,
+    'interrupts': PropWords,
+    'interrupts-extended': PropWords,
+    'interrupt-parent': PropWords,
+    'interrupt-map': PropWords,
+    'interrupt-map-mask': PropWords,
+    'phandle': PropWords,
+    'linux,phandle': PropWords,
+    'clocks': PropWords,
+    'resets': PropWords,
+    'power-domains': PropWords,
+    'pinctrl-0': PropWords,
+    'dmas': PropWords,
+    'iommus': PropWords,
+    'phys': PropWords,
+    'cpu': PropWords,
+    'virtual-reg': PropWords,
+    'mac-address': PropBytes,
+    'local-mac-address': PropBytes,
+    '*-names': PropStrings,
+    '*-cells': PropWords,
+    '*-gpios': PropWords,
+    '*-supply': PropWords,
+    '*-frequency': PropWords,
+}
+
+
+def get_prop_type(name, types=PROP_TYPES):
+    """Get property value type from types map by name, the longest matching '*-suffix' key is used if the name
+       isn't in the map. Returns None for unknown properties.
+    """
+    prop_type = types.get(name)
+    pos = name.find('-')
+    while prop_type is None and pos >= 0:
+        prop_type = types.get('*' + name[pos:])
+        pos = name.find('-', pos + 1)
+    return prop_type
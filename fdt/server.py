@@ -0,0 +1,99 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import stat
+import socket
+from time import perf_counter
+from socketserver import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+
+from . import tool
+from .cache import MemoryCache
+
+
+def is_stale_socket(socket_path):
+    """Check if the path is Unix socket without listening server (left by killed server)"""
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        return True
+    finally:
+        probe.close()
+    return False
+
+
+def run_job(request, cache=None):
+    """Run conversion job, the request is {'command': name, 'outfile': path, 'infiles': [paths], options...}"""
+    command = request.get('command')
+    outfile = request.get('outfile')
+    infiles = request.get('infiles', [])
+    if not outfile or not infiles:
+        raise Exception("The outfile and infiles must be specified")
+    if command == 'todts':
+        tool.dtb_to_dts(outfile, infiles[0], request.get('tabsize', 4), cache)
+    elif command == 'todtb':
+        tool.dts_to_dtb(outfile, infiles, request.get('version'), request.get('lcversion'), request.get('cpuid'),
+                        request.get('align'), request.get('padding'), request.get('size'),
+                        request.get('symbols', False), cache)
+    elif command == 'overlay':
+        tool.apply_overlays(outfile, infiles[0], infiles[1:], cache)
+    elif command == 'merge':
+        tool.merge_files(outfile, infiles, request.get('version', 17), cache)
+    else:
+        raise Exception("Unknown command: {}".format(command))
+
+
+class RequestHandler(StreamRequestHandler):
+    """Handler of client connection, every request and response is one line of JSON"""
+
+    def handle(self):
+        for line in self.rfile:
+            start = perf_counter()
+            error = None
+            try:
+                run_job(json.loads(line.decode()), self.server.cache)
+            except Exception as e:
+                error = str(e) if str(e) else "Unknown!"
+            response = {'error': error, 'time': perf_counter() - start}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class Server(ThreadingMixIn, UnixStreamServer):
+    """Conversion server listening on Unix socket, every client connection is served in its own thread and the
+       parsed input files are kept in memory cache shared by all jobs
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, cache_size=256 * 1024 * 1024):
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise Exception("Path \"{}\" exists and isn't a socket".format(socket_path))
+            if not is_stale_socket(socket_path):
+                raise Exception("Server is already running on \"{}\"".format(socket_path))
+            # stale socket of killed server
+            os.unlink(socket_path)
+        super().__init__(socket_path, RequestHandler)
+        self.socket_path = socket_path
+        self.cache = MemoryCache(cache_size)
+
+    def server_close(self):
+        super().server_close()
+        # the path could be taken over by other server or replaced meanwhile
+        if os.path.lexists(self.socket_path) and is_stale_socket(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,220 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mmap import mmap, ACCESS_READ
+from struct import pack, pack_into, unpack_from
+
+from .head import Header, DTB_BEGIN_NODE, DTB_END_NODE, DTB_NOP, DTB_PROP, DTB_END
+from .misc import StringTable
+
+# Size of output buffer of DTBWriter
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def iter_dtb(data):
+    """Iterate over DTB structure block, yields events (tag, node path, name, value) without creating nodes.
+
+    The tag is DTB_BEGIN_NODE, DTB_PROP or DTB_END_NODE, the name is node or property name and the value is
+    raw property value as memoryview into the blob (None for node events). The data can be bytes-like object
+    or file path, the file is memory mapped and the values are copied into bytes, because the mapping is closed
+    when the iteration ends or the generator is closed. Use FDTView.iter_events() of opened file for values
+    without copying. Properties of a node always precede its sub-nodes.
+    """
+    mapped = None
+    if isinstance(data, str):
+        with open(data, 'rb') as f:
+            mapped = data = mmap(f.fileno(), 0, access=ACCESS_READ)
+    try:
+        yield from _iter_events(data, data if mapped is not None else memoryview(data))
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def _iter_events(data, values):
+    """Events of iter_dtb(), the property values are slices of values"""
+    header = Header.parse(data)
+    old_version = header.version < 16
+    names = {}
+    path = []
+    offset = header.off_dt_struct
+    while True:
+        tag = unpack_from(">I", data, offset)[0]
+        offset += 4
+        if tag == DTB_PROP:
+            prop_size, prop_string_pos = unpack_from(">II", data, offset)
+            prop_start = offset + 8
+            if old_version and prop_size >= 8:
+                prop_start = (prop_start + 7) & ~0x7
+            name = names.get(prop_string_pos)
+            if name is None:
+                start = header.off_dt_strings + prop_string_pos
+                name = names[prop_string_pos] = bytes(data[start: data.find(b'\0', start)]).decode('ascii')
+            offset = (prop_start + prop_size + 3) & ~0x3
+            yield DTB_PROP, path[-1], name, values[prop_start: prop_start + prop_size]
+        elif tag == DTB_BEGIN_NODE:
+            name_end = data.find(b'\0', offset)
+            name = bytes(data[offset: name_end]).decode('ascii')
+            offset = (name_end + 4) & ~3
+            if not path:
+                name = '/'
+                path.append('/')
+            else:
+                path.append(path[-1] + '/' + name if len(path) > 1 else '/' + name)
+            yield DTB_BEGIN_NODE, path[-1], name, None
+        elif tag == DTB_END_NODE:
+            node_path = path.pop()
+            yield DTB_END_NODE, node_path, node_path.rpartition('/')[2] or '/', None
+        elif tag == DTB_NOP:
+            pass
+        elif tag == DTB_END:
+            break
+        else:
+            raise Exception("Unknown Tag: {}".format(tag))
+
+
+def filter_nodes(events, predicate):
+    """Drop sub-trees from event stream, the predicate(path, props) is called for every node with its
+       {name: value} map and the node is dropped if it returns False. Only events of one node are buffered.
+    """
+    pending = None
+    skip_depth = 0
+    for event in events:
+        tag = event[0]
+        if skip_depth:
+            if tag == DTB_BEGIN_NODE:
+                skip_depth += 1
+            elif tag == DTB_END_NODE:
+                skip_depth -= 1
+            continue
+        if tag == DTB_PROP and pending is not None:
+            pending.append(event)
+            continue
+        if pending is not None:
+            # all properties of pending node are known
+            if predicate(pending[0][1], {item[2]: item[3] for item in pending[1:]}):
+                yield from pending
+                pending = None
+            else:
+                pending = None
+                if tag == DTB_BEGIN_NODE:
+                    # skip the sub-node and the rest of dropped node
+                    skip_depth = 2
+                continue
+        if tag == DTB_BEGIN_NODE:
+            pending = [event]
+        else:
+            yield event
+
+
+class DTBWriter(object):
+    """Streaming DTB writer, the structure block is written into file as the nodes come, the header is
+       written when closed (requires seekable file)
+    """
+
+    def __init__(self, fp, version=17, entries=None, boot_cpuid_phys=0):
+        """Init with binary file object, DTB version and memory reservation entries"""
+        self.header = Header()
+        self.header.version = version
+        self.header.boot_cpuid_phys = boot_cpuid_phys
+        self._fp = fp
+        self._start = fp.tell()
+        self._strings = StringTable()
+        self._depth = 0
+        entries = entries or []
+        self.header.off_mem_rsvmap = self.header.size
+        self.header.off_dt_struct = self.header.size + 16 * (len(entries) + 1)
+        self._buffer = bytearray(self.header.off_dt_struct)
+        offset = self.header.off_mem_rsvmap
+        for entry in entries:
+            pack_into('>QQ', self._buffer, offset, entry['address'], entry['size'])
+            offset += 16
+        # absolute position of buffer end, used for alignment of old versions
+        self._pos = len(self._buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def _write(self, data):
+        self._buffer += data
+        self._pos += len(data)
+        if len(self._buffer) >= WRITE_CHUNK_SIZE:
+            self._fp.write(self._buffer)
+            self._buffer = bytearray()
+
+    def begin_node(self, name):
+        name = b'' if self._depth == 0 else name.encode('ascii')
+        self._depth += 1
+        self._write(pack('>I', DTB_BEGIN_NODE) + name + bytes(4 - len(name) % 4))
+
+    def end_node(self):
+        if not self._depth:
+            raise Exception("No open node")
+        self._depth -= 1
+        self._write(pack('>I', DTB_END_NODE))
+
+    def property(self, name, value=b''):
+        """Write property with raw value (bytes-like)"""
+        if not self._depth:
+            raise Exception("Property \"{}\" outside of node".format(name))
+        size = len(value)
+        self._write(pack('>III', DTB_PROP, size, self._strings.add(name)))
+        if self.header.version < 16 and size >= 8 and self._pos % 8:
+            self._write(bytes(8 - self._pos % 8))
+        self._write(value)
+        if size % 4:
+            self._write(bytes(4 - size % 4))
+
+    def write(self, events):
+        """Write events of iter_dtb()"""
+        begin_node = self.begin_node
+        end_node = self.end_node
+        write_prop = self.property
+        for tag, _, name, value in events:
+            if tag == DTB_PROP:
+                write_prop(name, value)
+            elif tag == DTB_BEGIN_NODE:
+                begin_node(name)
+            elif tag == DTB_END_NODE:
+                end_node()
+
+    def close(self):
+        """Write strings block and header, returns total size of blob"""
+        if self._depth:
+            raise Exception("{} nodes are not closed".format(self._depth))
+        self._write(pack('>I', DTB_END))
+        self.header.off_dt_strings = self._pos
+        self.header.size_dt_struct = self._pos - self.header.off_dt_struct
+        strings = self._strings.export()
+        self.header.size_dt_strings = len(strings)
+        self._write(strings)
+        self.header.total_size = self._pos
+        self._fp.write(self._buffer)
+        self._buffer = bytearray()
+        end = self._fp.tell()
+        self._fp.seek(self._start)
+        self._fp.write(self.header.export())
+        self._fp.seek(end)
+        return self.header.total_size
+
+
+def write_dtb(fp, events, version=17, entries=None, boot_cpuid_phys=0):
+    """Write events of iter_dtb() into binary file as DTB, returns its size"""
+    writer = DTBWriter(fp, version, entries, boot_cpuid_phys)
+    writer.write(events)
+    return writer.close()
@@ -17,7 +17,6 @@
 import os
 import sys
 import fdt
-import click
 
 # Application error code
 ERROR_CODE = 1
@@ -30,97 +29,249 @@ DESCRIP = (
     "Device Tree Converter tool for converting FDT blob (*.dtb) to readable text file (*.dts) and reverse"
 )
 
+# Cache of parsed files, set by -c/--cache option or PYDTC_CACHE environment variable
+CACHE = None
 
-# DTC: Base options
-@click.group(context_settings=dict(help_option_names=['-?', '--help']), help=DESCRIP)
-@click.version_option(VERSION, '-v', '--version')
-def cli():
-    click.echo()
+# Commands run without click (its import takes longer than a small conversion), when called just with
+# file arguments, command -> required count of arguments (None means at least two)
+FAST_COMMANDS = {'todts': 2, 'todtb': None, 'overlay': None, 'merge': None}
 
 
-# DTC: Convert DT in binary blob (*.dtb) to readable text file (*.dts)
-@cli.command(short_help="Convert *.dtb to *.dts")
-@click.argument('outfile', nargs=1, type=click.Path())
-@click.argument('infile', nargs=1, type=click.Path(exists=True))
-@click.option('-t', '--tabsize', type=click.INT, default=4, show_default=True, help="Tabulator Size")
-def todts(outfile, infile, tabsize):
+def load_dtb(file_path, cache=None):
+    """Parse *.dtb file, the cache is used if enabled"""
+    cache = CACHE if cache is None else cache
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    return fdt.parse_dtb(data) if cache is None else cache.parse_dtb(data)
+
+
+def load_dts(file_path, symbols=False, cache=None):
+    """Parse *.dts file, the cache is used if enabled"""
+    cache = CACHE if cache is None else cache
+    with open(file_path, 'r') as f:
+        text = f.read()
+    if cache is None:
+        return fdt.parse_dts(text, os.path.dirname(file_path), symbols)
+    return cache.parse_dts(text, os.path.dirname(file_path), symbols)
+
+
+def dtb_to_dts(outfile, infile, tabsize=4, cache=None):
     """ Convert *.dtb to *.dts """
-    try:
-        with open(infile, 'rb') as f:
-            data = f.read()
+    dt = load_dtb(infile, cache)
 
-        dt = fdt.parse_dtb(data)
+    with open(outfile, 'w') as f:
+        dt.write_dts(f, tabsize)
 
-        with open(outfile, 'w') as f:
-            f.write(dt.to_dts(tabsize))
 
-    except Exception as e:
-        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
-        sys.exit(ERROR_CODE)
+def dts_to_dtb(outfile, infiles, version=None, lcversion=None, cpuid=None, align=None, padding=None, size=None,
+               symbols=False, cache=None):
+    """ Convert *.dts files to *.dtb, all input files are merged """
+    dt = None
 
-    click.secho(" DTS saved as: %s" % outfile)
-
-
-# DTC: Convert DT in readable text file (*.dts) to binary blob (*.dtb)
-@cli.command(short_help="Convert *.dts to *.dtb")
-@click.argument('outfile', nargs=1, type=click.Path())
-@click.argument('infiles', nargs=-1, type=click.Path(exists=True))
-@click.option('-v', '--version', type=click.INT, default=None, help="DTB Version")
-@click.option('-l', '--lcversion', type=click.INT, default=None, help="DTB Last Compatible Version")
-@click.option('-c', '--cpuid', type=click.INT, default=None, help="Boot CPU ID")
-@click.option('-a', '--align', type=click.INT, default=None, help="Make the blob align to the <bytes>")
-@click.option('-p', '--padding', type=click.INT, default=None, help="Add padding to the blob of <bytes> long")
-@click.option('-s', '--size', type=click.INT, default=None, help="Make the blob at least <bytes> long")
-def todtb(outfile, infiles, version, lcversion, cpuid, align, padding, size):
-    """ Convert *.dts to *.dtb """
-    try:
-        dt = None
+    if version is not None and version > fdt.Header.MAX_VERSION:
+        raise Exception("DTB Version must be lover or equal {} !".format(fdt.Header.MAX_VERSION))
 
-        if version is not None and version > fdt.Header.MAX_VERSION:
-            raise Exception("DTB Version must be lover or equal {} !".format(fdt.Header.MAX_VERSION))
+    if not isinstance(infiles, (list, tuple)):
+        infiles = [infiles]
+    for file in infiles:
+        data = load_dts(file, symbols, cache)
+        if dt is None:
+            dt = data
+        else:
+            dt.merge(data, move=True)
 
-        if not isinstance(infiles, (list, tuple)):
-            infiles = [infiles]
-        for file in infiles:
-            with open(file, 'r') as f:
-                data = fdt.parse_dts(f.read(), os.path.dirname(file))
-            if dt is None:
-                dt = data
-            else:
-                dt.merge(data)
+    raw_data = dt.to_dtb(version, lcversion, cpuid)
 
-        raw_data = dt.to_dtb(version, lcversion, cpuid)
+    if align is not None:
+        if size is not None:
+            raise Exception("The \"-a/--align\" option can't be used together with \"-s/--size\"")
+        if not align % 2:
+            raise Exception("The \"-a/--align\" option must be dividable with two !")
+        if len(raw_data) % align:
+            raw_data += bytes([0] * (len(raw_data) % align))
 
+    if padding is not None:
         if align is not None:
-            if size is not None:
-                raise Exception("The \"-a/--align\" option can't be used together with \"-s/--size\"")
-            if not align % 2:
-                raise Exception("The \"-a/--align\" option must be dividable with two !")
-            if len(raw_data) % align:
-                raw_data += bytes([0] * (len(raw_data) % align))
-
-        if padding is not None:
-            if align is not None:
-                raise Exception("The \"-p/--padding\" option can't be used together with \"-a/--align\"")
-            raw_data += bytes([0] * padding)
+            raise Exception("The \"-p/--padding\" option can't be used together with \"-a/--align\"")
+        raw_data += bytes([0] * padding)
 
-        if size is not None:
-            if size < len(raw_data):
-                raise Exception("The \"-s/--size\" option must be > {}".format(len(raw_data)))
-            raw_data += bytes([0] * (size - len(raw_data)))
+    if size is not None:
+        if size < len(raw_data):
+            raise Exception("The \"-s/--size\" option must be > {}".format(len(raw_data)))
+        raw_data += bytes([0] * (size - len(raw_data)))
+
+    with open(outfile, 'wb') as f:
+        f.write(raw_data)
+
+
+def apply_overlays(outfile, infile, overlays, cache=None):
+    """ Apply *.dtbo overlays to *.dtb """
+    dt = load_dtb(infile, cache)
+    items = [load_dtb(file, cache) for file in overlays]
+
+    dt.apply_overlays(items)
+
+    with open(outfile, 'wb') as f:
+        f.write(dt.to_dtb())
+
+
+def merge_files(outfile, infiles, version=17, cache=None):
+    """ Merge *.dtb and *.dts files (by extension) into *.dts or *.dtb (by output extension) """
+    dt = None
+    for file in infiles:
+        if os.path.splitext(file)[1].lower() == '.dts':
+            data = load_dts(file, cache=cache)
+        else:
+            data = load_dtb(file, cache)
+        if dt is None:
+            dt = data
+        else:
+            dt.merge(data, move=True)
 
+    if os.path.splitext(outfile)[1].lower() == '.dts':
+        with open(outfile, 'w') as f:
+            dt.write_dts(f)
+    else:
         with open(outfile, 'wb') as f:
-            f.write(raw_data)
+            f.write(dt.to_dtb(version))
+
+
+def call_server(socket_path, command, args):
+    """Run command on pydtc server, returns None if the server isn't running"""
+    from .client import Client
+    try:
+        client = Client(socket_path)
+    except OSError:
+        return None
+    with client:
+        client.call(command, args[0], args[1:])
+    return True
+
 
+def init_worker(cache_dir=None):
+    """Initializer of batch worker process, the cache is created once per process (see convert_file())"""
+    global CACHE
+    CACHE = None if cache_dir is None else fdt.Cache(cache_dir)
+
+
+def convert_file(infile, outfile, tabsize=4, version=17, cache=None):
+    """Convert *.dtb to *.dts or *.dts to *.dtb by input file extension, returns (elapsed time, error message).
+       The CACHE of process is used if cache isn't given.
+    """
+    from time import perf_counter
+    start = perf_counter()
+    try:
+        if os.path.splitext(infile)[1].lower() == '.dts':
+            dt = load_dts(infile, cache=cache)
+            with open(outfile, 'wb') as f:
+                f.write(dt.to_dtb(version))
+        else:
+            dt = load_dtb(infile, cache=cache)
+            with open(outfile, 'w') as f:
+                dt.write_dts(f, tabsize)
+    except Exception as e:
+        return perf_counter() - start, str(e) if str(e) else "Unknown!"
+    return perf_counter() - start, None
+
+
+def batch_jobs(patterns, manifest, outdir):
+    """Get list of (infile, outfile) from glob patterns and manifest lines '<infile> [<outfile>]'"""
+    import glob
+    items = []
+    for pattern in patterns:
+        files = sorted(glob.glob(pattern, recursive=True))
+        if not files:
+            raise Exception("No file matches \"{}\"".format(pattern))
+        items.extend((file, None) for file in files)
+    if manifest is not None:
+        base_dir = os.path.dirname(manifest)
+        with open(manifest, 'r') as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if not fields:
+                    continue
+                if len(fields) > 2:
+                    raise Exception("Invalid manifest line: {}".format(line.strip()))
+                files = [os.path.join(base_dir, file) for file in fields]
+                items.append((files[0], files[1] if len(files) > 1 else None))
+    jobs = []
+    targets = {}
+    for infile, outfile in items:
+        if outfile is None:
+            name, ext = os.path.splitext(infile)
+            outfile = name + ('.dtb' if ext.lower() == '.dts' else '.dts')
+            if outdir is not None:
+                outfile = os.path.join(outdir, os.path.basename(outfile))
+        # the outputs of jobs must be unique, else one would silently overwrite other
+        target = os.path.normcase(os.path.abspath(outfile))
+        if target in targets:
+            raise Exception("Files \"{}\" and \"{}\" have the same output: {}".format(targets[target], infile,
+                                                                                    outfile))
+        targets[target] = infile
+        jobs.append((infile, outfile))
+    return jobs
+
+
+def info_files(paths):
+    """Get list of files from paths, glob patterns and directories (all files in sub-directories)"""
+    import glob
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            items = sorted(glob.glob(path, recursive=True))
+            if not items:
+                raise Exception("No file matches \"{}\"".format(path))
+            files.extend(items)
+    return files
+
+
+def run_fast(argv):
+    """Run simple todts/todtb/overlay/merge command without click, returns False if the arguments require
+       click (options, help or errors reported by click). With PYDTC_SERVER environment variable the command
+       is sent to pydtc server at that socket, if it's running.
+    """
+    if not argv or argv[0] not in FAST_COMMANDS:
+        return False
+    command, args = argv[0], argv[1:]
+    count = FAST_COMMANDS[command]
+    if len(args) < 2 or (count is not None and len(args) != count):
+        return False
+    if any(arg.startswith('-') for arg in args) or not all(os.path.exists(path) for path in args[1:]):
+        return False
+
+    global CACHE
+    if os.environ.get('PYDTC_CACHE'):
+        CACHE = fdt.Cache(os.environ['PYDTC_CACHE'])
+    print()
+    try:
+        if os.environ.get('PYDTC_SERVER') and call_server(os.environ['PYDTC_SERVER'], command, args):
+            pass
+        elif command == 'todts':
+            dtb_to_dts(args[0], args[1])
+        elif command == 'todtb':
+            dts_to_dtb(args[0], args[1:])
+        elif command == 'merge':
+            merge_files(args[0], args[1:])
+        else:
+            apply_overlays(args[0], args[1], args[2:])
     except Exception as e:
-        click.echo(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
+        print(" ERROR: {}".format(str(e) if str(e) else "Unknown!"))
         sys.exit(ERROR_CODE)
 
-    click.secho(" DTB saved as: %s" % outfile)
+    print(" {} saved as: {}".format('DTS' if args[0].lower().endswith('.dts') else 'DTB', args[0]))
+    return True
 
 
 def main():
-    cli(obj={})
+    if not run_fast(sys.argv[1:]):
+        from .cli import cli
+        cli(obj={})
 
 
 if __name__ == '__main__':
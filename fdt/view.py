@@ -0,0 +1,303 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mmap import mmap, ACCESS_READ
+from struct import unpack_from
+
+from .head import Header, DTB_BEGIN_NODE, DTB_END_NODE, DTB_NOP, DTB_PROP, DTB_END
+from .node import Node
+from .index import PathIndex
+from .prop import Property, get_prop_type
+
+
+def join_path(path, name):
+    return '/' + name if path == '/' else path + '/' + name
+
+
+class NodeView(object):
+    """Read-only lazy view of a node inside DTB structure block"""
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def props(self):
+        """Materialized properties of this node"""
+        return [self.get_property(name) for name in self._get_props()]
+
+    @property
+    def nodes(self):
+        """Views of direct sub-nodes"""
+        return [self._get_view(name) for name in self._get_nodes()]
+
+    @property
+    def prop_names(self):
+        return list(self._get_props())
+
+    @property
+    def node_names(self):
+        return list(self._get_nodes())
+
+    def __init__(self, fdt_view, name, path, offset):
+        """Init with parent FDT view and offset of the first tag after node name"""
+        self._fdt_view = fdt_view
+        self._name = name
+        self._path = path
+        self._offset = offset
+        self._props = None
+        self._nodes = None
+        # name -> view of visited sub-nodes, so every node is scanned once
+        self._views = {}
+
+    def __str__(self):
+        """String representation"""
+        return "NODE-VIEW: {} ({} props, {} sub-nodes)".format(self.name, len(self._get_props()),
+                                                               len(self._get_nodes()))
+
+    def _get_props(self):
+        if self._props is None:
+            self._scan()
+        return self._props
+
+    def _get_nodes(self):
+        if self._nodes is None:
+            self._scan()
+        return self._nodes
+
+    def _get_view(self, name):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = NodeView(self._fdt_view, name, join_path(self._path, name), self._nodes[name])
+        return view
+
+    def _scan(self):
+        """Collect property values and sub-node offsets, skip over sub-node contents"""
+        self._props, self._nodes = self._fdt_view.scan_node(self._offset)
+
+    def get_value(self, name):
+        """Get raw property value as memoryview into the blob, without copying"""
+        item = self._get_props().get(name)
+        if item is None:
+            return None
+        return self._fdt_view.memview[item[0]: item[0] + item[1]]
+
+    def get_property(self, name):
+        """Get materialized property obj by name"""
+        item = self._get_props().get(name)
+        if item is None:
+            return None
+        return Property.create(name, bytes(self._fdt_view.memview[item[0]: item[0] + item[1]]), get_prop_type(name))
+
+    def get_subnode(self, path):
+        """Get sub-node view by relative path/name"""
+        node = self
+        if path:
+            for sub_name in path.split('/'):
+                if sub_name not in node._get_nodes():
+                    return None
+                node = node._get_view(sub_name)
+        return node
+
+    def to_node(self):
+        """Materialize the whole subtree as Node object"""
+        node = Node(self.name)
+        for prop in self.props:
+            node.append(prop)
+        for sub_node in self.nodes:
+            node.append(sub_node.to_node())
+        return node
+
+
+class FDTView(object):
+    """Read-only lazy view of Flattened Device Tree blob.
+
+    The blob is accessed through memoryview (memory mapped if opened from file path), nodes and properties
+    are materialized only on access.
+    """
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def memview(self):
+        return self._memview
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = []
+            offset = self.header.off_mem_rsvmap
+            while True:
+                entry = dict(zip(('address', 'size'), unpack_from(">QQ", self._data, offset)))
+                offset += 16
+                if entry['address'] == 0 and entry['size'] == 0:
+                    break
+                self._entries.append(entry)
+        return self._entries
+
+    @property
+    def rootnode(self):
+        if self._rootnode is None:
+            offset = self.header.off_dt_struct
+            while unpack_from(">I", self._data, offset)[0] == DTB_NOP:
+                offset += 4
+            self._rootnode = self._node_at(offset, '/')
+        return self._rootnode
+
+    @property
+    def index(self):
+        return self._index
+
+    def __init__(self, data, index=None):
+        """Init with file path or bytes-like object and optional path index (PathIndex or its exported form)"""
+        self._mmap = None
+        if isinstance(data, str):
+            with open(data, 'rb') as f:
+                self._mmap = mmap(f.fileno(), 0, access=ACCESS_READ)
+            data = self._mmap
+        elif not hasattr(data, 'find'):
+            data = bytes(data)
+        self._data = data
+        self._memview = memoryview(data)
+        self._names = {}
+        self._entries = None
+        self._rootnode = None
+        # path -> node view got by the index
+        self._views = {}
+        self.header = Header.parse(data)
+        if index is not None and not isinstance(index, PathIndex):
+            index = PathIndex.parse(index)
+        if index is not None and index.total_size != self.header.total_size:
+            raise Exception("Path index doesn't match the blob")
+        self._index = index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Release the blob, all returned memoryview values must be released before"""
+        self._memview.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def get_string(self, offset):
+        """Get string from strings block (cached)"""
+        name = self._names.get(offset)
+        if name is None:
+            start = self.header.off_dt_strings + offset
+            name = self._data[start: self._data.find(b'\0', start)].decode('ascii')
+            self._names[offset] = name
+        return name
+
+    def scan_node(self, offset):
+        """Scan node content, returns property (offset, size) and sub-node offset maps"""
+        data = self._data
+        old_version = self.header.version < 16
+        props = {}
+        nodes = {}
+        depth = 0
+        while True:
+            tag = unpack_from(">I", data, offset)[0]
+            offset += 4
+            if tag == DTB_BEGIN_NODE:
+                name_end = data.find(b'\0', offset)
+                if depth == 0:
+                    nodes[data[offset: name_end].decode('ascii')] = (name_end + 4) & ~3
+                offset = (name_end + 4) & ~3
+                depth += 1
+            elif tag == DTB_END_NODE:
+                if depth == 0:
+                    break
+                depth -= 1
+            elif tag == DTB_PROP:
+                prop_size, prop_string_pos = unpack_from(">II", data, offset)
+                prop_start = offset + 8
+                if old_version and prop_size >= 8:
+                    prop_start = ((prop_start + 7) & ~0x7)
+                if depth == 0:
+                    props[self.get_string(prop_string_pos)] = (prop_start, prop_size)
+                offset = (prop_start + prop_size + 3) & ~0x3
+            elif tag == DTB_NOP:
+                pass
+            elif tag == DTB_END:
+                raise Exception("Unexpected end of structure block")
+            else:
+                raise Exception("Unknown Tag: {}".format(tag))
+        return props, nodes
+
+    def _node_at(self, offset, path):
+        """Get node view from offset of DTB_BEGIN_NODE tag"""
+        if unpack_from(">I", self._data, offset)[0] != DTB_BEGIN_NODE:
+            raise Exception("Invalid structure block, node expected at offset {}".format(offset))
+        name_end = self._data.find(b'\0', offset + 4)
+        name = self._data[offset + 4: name_end].decode('ascii')
+        if path != '/' and name != path.rpartition('/')[2]:
+            raise Exception("Path index doesn't match the blob: {}".format(path))
+        return NodeView(self, name if name else '/', path, (name_end + 4) & ~3)
+
+    def build_index(self):
+        """Build path index by single pass over structure block, further lookups will use it"""
+        self._index = PathIndex.build(self._data)
+        return self._index
+
+    def get_node(self, path):
+        """Get node view by absolute path"""
+        if self._index is not None:
+            path = '/' + path.strip('/')
+            view = self._views.get(path)
+            if view is None:
+                offset = self._index.get(path)
+                if offset is None:
+                    return None
+                view = self._views[path] = self._node_at(offset, path)
+            return view
+        return self.rootnode.get_subnode(path.strip('/'))
+
+    def get_property(self, path):
+        """Get materialized property obj by absolute path"""
+        node_path, _, prop_name = path.rpartition('/')
+        node = self.get_node(node_path)
+        return None if node is None else node.get_property(prop_name)
+
+    def get_value(self, path):
+        """Get raw property value by absolute path as memoryview into the blob"""
+        node_path, _, prop_name = path.rpartition('/')
+        node = self.get_node(node_path)
+        return None if node is None else node.get_value(prop_name)
+
+    def iter_events(self):
+        """Iterate over structure block as iter_dtb(), the values are memoryviews into the blob without copying
+           (all of them must be released before close)
+        """
+        from .stream import iter_dtb
+        return iter_dtb(self._data)
+
+    def to_fdt(self):
+        """Materialize the whole tree as FDT object"""
+        from . import FDT
+        fdt_obj = FDT()
+        fdt_obj.header = self.header
+        fdt_obj.entries = list(self.entries)
+        fdt_obj.rootnode = self.rootnode.to_node()
+        return fdt_obj
@@ -1,10 +1,19 @@
 
+import io
+import os
 import fdt
 import copy
 import struct
+import tempfile
 import unittest
 
 
+def is_mapped(file_path):
+    """Check if the file is memory mapped by this process (Linux)"""
+    with open('/proc/self/maps') as f:
+        return any(line.rstrip('\n').endswith(' ' + os.path.realpath(file_path)) for line in f)
+
+
 class HeaderTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -34,6 +43,15 @@ class HeaderTestCase(unittest.TestCase):
         self.assertEqual(header.version, 1)
         self.assertEqual(header.size, 32)
 
+    def test_check(self):
+        header = fdt.Header.parse(fdt.parse_dts('/dts-v1/;\n/ { };\n').to_dtb(17))
+        header.check(header.total_size)
+        with self.assertRaises(Exception):
+            header.check(header.total_size - 1)
+        header.off_dt_strings = header.total_size + 4
+        with self.assertRaises(Exception):
+            header.check()
+
 
 class PropertyTestCase(unittest.TestCase):
 
@@ -67,6 +85,16 @@ class PropertyTestCase(unittest.TestCase):
         self.assertEqual(str_data, 'prop\0')
         self.assertEqual(pos, 12)
 
+    def test_create(self):
+        self.assertIsInstance(fdt.Property.create('prop', b''), fdt.Property)
+        prop = fdt.Property.create('prop', b'abc\0d e\0')
+        self.assertIsInstance(prop, fdt.PropStrings)
+        self.assertEqual(prop.data, ['abc', 'd e'])
+        for value in (b'abc\0\0', b'\0abc\0', b'ab\nc\0', b'ab\xffc\0', b'\0\0\0\0'):
+            self.assertIsNone(fdt.misc.is_string(value))
+        self.assertIsInstance(fdt.Property.create('prop', b'\0\0\0\0'), fdt.PropWords)
+        self.assertIsInstance(fdt.Property.create('prop', b'ab\nc\0'), fdt.PropBytes)
+
 
 class PropStringsTestCase(unittest.TestCase):
 
@@ -106,6 +134,30 @@ class PropStringsTestCase(unittest.TestCase):
 
 class PropWordsTestCase(unittest.TestCase):
 
+    def test_range(self):
+        for words in ([2**32], [-1], [0, 2**32]):
+            with self.assertRaises(ValueError):
+                fdt.PropWords('prop', words)
+        with self.assertRaises(ValueError):
+            fdt.PropWords('prop', [256], 8)
+        prop = fdt.PropWords('prop', [0x1, 0x2])
+        for change in (lambda data: data.__setitem__(0, 2**32), lambda data: data.append(-1),
+                       lambda data: data.extend(iter([0x3, 2**32])), lambda data: data.insert(0, -1),
+                       lambda data: data.__setitem__(slice(0, 1), [-1])):
+            with self.assertRaises(ValueError):
+                change(prop.data)
+        self.assertEqual(list(prop), [0x1, 0x2])
+
+    def test_data_compare(self):
+        prop = fdt.PropWords('prop', [0x1, 0x2])
+        self.assertEqual(prop.data, [0x1, 0x2])
+        self.assertEqual(prop.data, (0x1, 0x2))
+        self.assertNotEqual(prop.data, [0x1])
+        self.assertFalse(prop.data != [0x1, 0x2])
+        self.assertEqual(prop.data, fdt.PropWords('prop', [0x1, 0x2]).data)
+        prop.data[0:1] = [0x3, 0x4]
+        self.assertEqual(prop.data, [0x3, 0x4, 0x2])
+
     def setUp(self):
         self.prop_a = fdt.PropWords('prop', [0x11111111, 0x55555555])
         self.prop_b = fdt.PropWords('prop', [0x11111111, 0x55555555, 0x00])
@@ -135,6 +187,19 @@ class PropWordsTestCase(unittest.TestCase):
     def test_export(self):
         str_data = self.prop_a.to_dts()
         self.assertEqual(str_data, 'prop = <0x11111111 0x55555555>;\n')
+        blob_data, str_data, pos = self.prop_a.to_dtb('')
+        self.assertEqual(blob_data, struct.pack('>5I', 0x03, 8, 0, 0x11111111, 0x55555555))
+
+    def test_parse(self):
+        prop = fdt.PropWords.parse('prop', struct.pack('>3I', 0x11111111, 0x55555555, 0x1))
+        self.assertEqual(list(prop), [0x11111111, 0x55555555, 0x1])
+        self.assertEqual(prop, fdt.Property.create('prop', struct.pack('>3I', 0x11111111, 0x55555555, 0x1)))
+        prop = fdt.PropWords.parse('prop', struct.pack('>2Q', 0x1122334455667788, 0x1), 64)
+        self.assertEqual(prop, fdt.PropWords('prop', [0x1122334455667788, 0x1], 64))
+        self.assertEqual(prop.to_dtb('')[0][12:], struct.pack('>2Q', 0x1122334455667788, 0x1))
+        prop.data = [0x1, 0x2]
+        prop.clear()
+        self.assertEqual(len(prop), 0)
 
 
 class PropBytesTestCase(unittest.TestCase):
@@ -215,6 +280,27 @@ class NodeTestCase(unittest.TestCase):
         prop = root_node.get_property('sub_node/node_a/node_b/node_c/prop_c')
         self.assertIsNone(prop, fdt.Property)
 
+    def test_names(self):
+        root_node = copy.deepcopy(self.node_a)
+        root_node.append(fdt.Node('node_b'))
+        self.assertEqual(root_node.get_subnode_index('node_b'), 1)
+        self.assertEqual(root_node.get_property_index('prop_word'), 2)
+        root_node.get_subnode('sub_node').name = 'node_a'
+        self.assertEqual([n.name for n in root_node.nodes], ['node_a', 'node_b'])
+        self.assertIsInstance(root_node.get_subnode('node_a'), fdt.Node)
+        self.assertIsNone(root_node.get_subnode('sub_node'))
+        with self.assertRaises(ValueError):
+            root_node.get_subnode('node_a').name = 'node_b'
+        root_node.remove_subnode('node_a')
+        self.assertEqual(len(root_node.nodes), 1)
+        self.assertIsNone(root_node.get_subnode_index('node_a'))
+        self.assertEqual(root_node.get_subnode_index('node_b'), 0)
+        root_node.remove_property('prop_word')
+        root_node.append(fdt.Property('prop_new'))
+        self.assertEqual(root_node.get_property_index('prop_new'), len(root_node.props) - 1)
+        with self.assertRaises(AttributeError):
+            root_node.props.append(fdt.Property('x'))
+
     def test_merge(self):
         root_node = copy.deepcopy(self.node_a)
         root_node.append(fdt.Node('node_a', [fdt.Property('prop_a')]), 'sub_node')
@@ -225,6 +311,70 @@ class NodeTestCase(unittest.TestCase):
         root_node.merge(node)
         self.assertNotEqual(root_node, node)
 
+    def test_merge_move(self):
+        root_node = copy.deepcopy(self.node_a)
+        sub_node = copy.deepcopy(root_node.get_subnode('sub_node'))
+        self.assertIsNone(sub_node.parent)
+        node = fdt.Node('/', [fdt.PropWords('prop_word', [0x1]), fdt.Property('prop_new')],
+                        [fdt.Node('sub_node', [fdt.Property('prop_a')]), fdt.Node('node_b')])
+        prop_new = node.get_property('prop_new')
+        node_b = node.get_subnode('node_b')
+        root_node.merge(node, move=True)
+        self.assertIs(root_node.get_property('prop_new'), prop_new)
+        self.assertIs(prop_new.parent, root_node)
+        self.assertIs(root_node.get_subnode('node_b'), node_b)
+        self.assertIs(node_b.parent, root_node)
+        self.assertEqual(list(root_node.get_property('prop_word')), [0x1])
+        self.assertIsInstance(root_node.get_property('sub_node/prop_a'), fdt.Property)
+        self.assertEqual([n.name for n in node.nodes], ['sub_node'])
+        self.assertEqual(node.props, ())
+
+    def test_append_owned(self):
+        dt = fdt.FDT()
+        dt.rootnode = fdt.Node('/', nodes=[fdt.Node('a', [fdt.PropWords('x', [0x1])], [fdt.Node('c')]), fdt.Node('b')])
+        dt = fdt.parse_dtb(dt.to_dtb(version=17))
+        node_b = dt.get_node('/b')
+        node_b.append(dt.get_property('/a/x'))
+        node_b.append(dt.get_node('/a/c'))
+        node_b.set_property(dt.get_property('/a/x'), 'c')
+        self.assertIsNot(dt.get_property('/b/x'), dt.get_property('/a/x'))
+        self.assertIs(dt.get_property('/b/x').parent, node_b)
+        self.assertIs(dt.get_node('/b/c').parent, node_b)
+        self.assertIs(dt.get_node('/a/c').parent, dt.get_node('/a'))
+        dt.get_property('/b/x').data[0] = 0x5
+        dt.get_property('/b/c/x').data[0] = 0x6
+        blob = fdt.parse_dtb(dt.to_dtb())
+        self.assertEqual(blob.to_dts(), dt.to_dts())
+        self.assertEqual(list(blob.get_property('/a/x')), [0x1])
+        self.assertEqual(list(blob.get_property('/b/c/x')), [0x6])
+        with self.assertRaises(Exception):
+            node_b.append(node_b)
+
+    def test_digest(self):
+        root_node = copy.deepcopy(self.node_a)
+        root_node.append(fdt.Node('node_a', [fdt.PropWords('prop_a', [0x1])]), 'sub_node')
+        digest = root_node.digest
+        node = copy.deepcopy(root_node)
+        self.assertEqual(node.digest, digest)
+        prop = node.get_property('sub_node/node_a/prop_a')
+        self.assertIs(prop.parent, node.get_subnode('sub_node/node_a'))
+        prop.append(0x2)
+        self.assertNotEqual(node.digest, digest)
+        prop.pop(1)
+        self.assertEqual(node.digest, digest)
+        prop.name = 'prop_b'
+        self.assertIs(node.get_property('sub_node/node_a/prop_b'), prop)
+        self.assertNotEqual(node.digest, digest)
+        node.remove_property('sub_node/node_a/prop_b')
+        node.set_property(fdt.PropWords('prop_a', [0x1]), 'sub_node/node_a')
+        self.assertEqual(node.digest, digest)
+        node.append(fdt.Node('node_b'), 'sub_node')
+        self.assertNotEqual(node.digest, digest)
+        node.remove_subnode('sub_node/node_b')
+        self.assertEqual(node.digest, digest)
+        node.merge(fdt.Node('/', [fdt.PropBytes('prop_byte', [0x10, 0x51])]))
+        self.assertNotEqual(node.digest, digest)
+
     def test_export(self):
         str_data = self.node_a.to_dts()
         out  = "/ {\n"
@@ -238,5 +388,671 @@ class NodeTestCase(unittest.TestCase):
         self.assertEqual(str_data, out)
 
 
+class FDTTestCase(unittest.TestCase):
+
+    def setUp(self):
+        root = fdt.Node('/')
+        root.append(fdt.PropStrings('compatible', ['vendor,board']))
+        root.append(fdt.PropWords('reg', [0x11111111, 0x55555555, 0x1]))
+        root.append(fdt.Node('node_a', [fdt.PropBytes('prop_byte', [0x10, 0x50, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7])]))
+        root.append(fdt.Node('node_b', [fdt.PropWords('reg', [0x1, 0x2]), fdt.Property('prop')]))
+        self.fdt_a = fdt.FDT()
+        self.fdt_a.rootnode = root
+        self.fdt_a.entries = [{'address': 0x1000, 'size': 0x100}]
+
+    def tearDown(self):
+        pass
+
+    def test_export_dtb(self):
+        for version in (15, 16, 17):
+            blob = self.fdt_a.to_dtb(version=version)
+            header = fdt.Header.parse(blob)
+            self.assertEqual(header.total_size, len(blob))
+            self.assertEqual(header.off_dt_strings + header.size_dt_strings, len(blob))
+            self.assertEqual(blob[header.off_dt_strings:], b'compatible\0reg\0prop_byte\0prop\0')
+            fdt_b = fdt.parse_dtb(blob)
+            self.assertEqual(fdt_b.entries, self.fdt_a.entries)
+            self.assertEqual(fdt_b.rootnode, self.fdt_a.rootnode)
+
+    def test_walk(self):
+        self.fdt_a.rootnode.append(fdt.Node('node_c'))
+        paths = [path for path, _ in self.fdt_a.walk()]
+        self.assertEqual(paths, ['/.compatible', '/.reg', '/node_a/.prop_byte', '/node_b/.reg', '/node_b/.prop',
+                                 '/node_c'])
+        self.assertFalse(hasattr(self.fdt_a.rootnode, '__dict__'))
+        self.assertFalse(hasattr(self.fdt_a.rootnode.props[0], '__dict__'))
+
+    def test_diff(self):
+        fdt_b = fdt.parse_dtb(self.fdt_a.to_dtb(version=17))
+        self.assertEqual(self.fdt_a.diff(fdt_b), {})
+        fdt_b.rootnode.set_property(fdt.PropWords('reg', [0x1]), 'node_b')
+        fdt_b.rootnode.remove_property('node_b/prop')
+        fdt_b.rootnode.append(fdt.PropWords('new', [0x1]), 'node_a')
+        fdt_b.rootnode.remove_subnode('node_a')
+        fdt_b.rootnode.append(fdt.Node('node_c', [fdt.Property('prop')]))
+        diff = list(self.fdt_a.iter_diff(fdt_b))
+        self.assertEqual([(path, item['status']) for path, item in diff],
+                         [('/node_a', 'missing'), ('/node_b/.reg', 'different'), ('/node_b/.prop', 'missing'),
+                          ('/node_c', 'added')])
+        self.assertIs(diff[0][1]['local'], self.fdt_a.get_node('/node_a'))
+        self.assertEqual(list(diff[1][1]['target']), [0x1])
+
+    def test_export_dtb_incremental(self):
+        blob = self.fdt_a.to_dtb(version=17)
+        fdt_b = fdt.parse_dtb(blob)
+        self.assertEqual(fdt_b.to_dtb(), blob)
+        fdt_b.rootnode.set_property(fdt.PropStrings('bootargs', ['console=ttyS0']), 'node_b')
+        fdt_b.get_property('/node_a/prop_byte')[0] = 0x20
+        fdt_b.rootnode.append(fdt.Node('node_c', [fdt.PropWords('reg', [0x3])]))
+        blob = fdt_b.to_dtb()
+        self.assertEqual(blob[-len(b'bootargs\0'):], b'bootargs\0')
+        self.assertEqual(fdt.parse_dtb(blob).to_dts(), fdt_b.to_dts())
+
+    def test_data_inplace(self):
+        fdt_b = fdt.parse_dtb(self.fdt_a.to_dtb(version=17))
+        digest = fdt_b.rootnode.digest
+        fdt_b.get_property('/compatible').data.append('vendor,soc')
+        fdt_b.get_property('/reg').data[0] = 0x2
+        copy.deepcopy(fdt_b.get_property('/node_a/prop_byte')).data.clear()
+        fdt_b.get_property('/node_b/reg').data.extend([0x3])
+        self.assertNotEqual(fdt_b.rootnode.digest, digest)
+        fdt_c = fdt.parse_dtb(fdt_b.to_dtb())
+        self.assertEqual(list(fdt_c.get_property('/compatible')), ['vendor,board', 'vendor,soc'])
+        self.assertEqual(list(fdt_c.get_property('/reg')), [0x2, 0x55555555, 0x1])
+        self.assertEqual(len(fdt_c.get_property('/node_a/prop_byte')), 9)
+        self.assertEqual(list(fdt_c.get_property('/node_b/reg')), [0x1, 0x2, 0x3])
+        prop = copy.deepcopy(fdt_c.get_property('/reg'))
+        fdt_c.rootnode.set_property(prop)
+        prop.data.pop()
+        self.assertEqual(list(fdt.parse_dtb(fdt_c.to_dtb()).get_property('/reg')), [0x2, 0x55555555])
+
+    def test_parse_dtb_types(self):
+        dt = fdt.parse_dts('/dts-v1/;\n/ { reg = <0x61626300>; custom = <0x61626300>; clock-names = "a", "b";'
+                           ' big = /bits/ 64 <0x1>; id = "abc"; };\n')
+        blob = dt.to_dtb(17)
+        fdt_b = fdt.parse_dtb(blob)
+        self.assertIsInstance(fdt_b.get_property('/reg'), fdt.PropWords)
+        self.assertIsInstance(fdt_b.get_property('/custom'), fdt.PropStrings)
+        self.assertEqual(list(fdt_b.get_property('/clock-names')), ['a', 'b'])
+        self.assertIsInstance(fdt.parse_dtb(blob, types=None).get_property('/reg'), fdt.PropStrings)
+        # custom map, value of wrong size falls back to heuristics
+        fdt_b = fdt.parse_dtb(blob, types=dict(fdt.PROP_TYPES, big=64, id=64))
+        self.assertEqual(fdt_b.get_property('/big').word_size, 64)
+        self.assertIsInstance(fdt_b.get_property('/id'), fdt.PropStrings)
+        self.assertEqual(fdt_b.to_dtb(), blob)
+        self.assertIs(fdt.get_prop_type('#gpio-cells'), fdt.PropWords)
+
+    def test_export_dts(self):
+        self.fdt_a.header.version = 17
+        self.fdt_a.rootnode.append(fdt.PropBytes('large', bytes(range(256)) * 40))
+        text = io.StringIO()
+        self.fdt_a.write_dts(text)
+        self.assertEqual(text.getvalue(), self.fdt_a.to_dts())
+        self.assertIn('large = [00 01 02', text.getvalue())
+        self.assertEqual(fdt.parse_dts(text.getvalue()).to_dts(), self.fdt_a.to_dts())
+
+
+class FDTBlobTestCase(unittest.TestCase):
+
+    def setUp(self):
+        root = fdt.Node('/', nodes=[
+            fdt.Node('chosen', [fdt.PropStrings('bootargs', ['console=ttyS0'])]),
+            fdt.Node('eth@1000', [fdt.PropBytes('mac-address', [0, 1, 2, 3, 4, 5]), fdt.PropWords('reg', [0x1000, 0x100])],
+                     [fdt.Node('phy', [fdt.PropWords('reg', [0x1])])]),
+        ])
+        self.fdt_a = fdt.FDT()
+        self.fdt_a.rootnode = root
+        self.blob = self.fdt_a.to_dtb(version=17)
+
+    def tearDown(self):
+        pass
+
+    def test_patch(self):
+        blob = fdt.FDTBlob(self.blob)
+        offset = blob.find_node_offset('/eth')
+        self.assertEqual(offset, blob.find_node_offset('/eth@1000'))
+        self.assertIsNone(blob.find_node_offset('/eth@1000/none'))
+        self.assertEqual(bytes(blob.getprop('/eth@1000', 'mac-address')), bytes([0, 1, 2, 3, 4, 5]))
+        blob.setprop_inplace(offset, 'mac-address', bytes([6, 7, 8, 9, 10, 11]))
+        blob.set_u32(offset, 'reg', 0x2000)
+        with self.assertRaises(ValueError):
+            blob.setprop_inplace('/chosen', 'bootargs', 'console=ttyS10')
+        blob.nop_property('/chosen', 'bootargs')
+        blob.nop_node('/eth@1000/phy')
+        self.assertIsNone(blob.find_node_offset('/eth@1000/phy'))
+        self.assertEqual(len(blob.data), len(self.blob))
+        dt = fdt.parse_dtb(blob.data)
+        self.assertEqual(list(dt.get_property('/eth@1000/mac-address')), [6, 7, 8, 9, 10, 11])
+        self.assertEqual(list(dt.get_property('/eth@1000/reg')), [0x2000, 0x100])
+        self.assertIsNone(dt.get_property('/chosen/bootargs'))
+        self.assertIsNone(dt.get_node('/eth@1000/phy'))
+
+
+class StreamTestCase(unittest.TestCase):
+
+    def test_iter_write(self):
+        root = fdt.Node('/', [fdt.PropStrings('model', ['board'])], [
+            fdt.Node('uart@1000', [fdt.PropStrings('status', ['disabled'])], [fdt.Node('child')]),
+            fdt.Node('uart@2000', [fdt.PropStrings('status', ['okay']), fdt.PropWords('reg', [0x2000, 0x100])]),
+        ])
+        dt = fdt.FDT()
+        dt.rootnode = root
+        blob = dt.to_dtb(version=17)
+        events = list(fdt.iter_dtb(blob))
+        self.assertEqual(events[0][:3], (fdt.head.DTB_BEGIN_NODE, '/', '/'))
+        self.assertEqual(events[1][:3], (fdt.head.DTB_PROP, '/', 'model'))
+        self.assertEqual(bytes(events[1][3]), b'board\0')
+        self.assertEqual(events[-1][:3], (fdt.head.DTB_END_NODE, '/', '/'))
+        out = io.BytesIO()
+        self.assertEqual(fdt.write_dtb(out, events), len(blob))
+        self.assertEqual(out.getvalue(), blob)
+        out = io.BytesIO()
+        fdt.write_dtb(out, fdt.filter_nodes(fdt.iter_dtb(blob),
+                                            lambda path, props: bytes(props.get('status', b'')) != b'disabled\0'))
+        dt = fdt.parse_dtb(out.getvalue())
+        self.assertEqual([node.name for node in dt.rootnode.nodes], ['uart@2000'])
+        self.assertEqual(list(dt.get_property('/uart@2000/reg')), [0x2000, 0x100])
+
+    @unittest.skipUnless(os.path.exists('/proc/self/maps'), "requires /proc/self/maps")
+    def test_iter_file(self):
+        dt = fdt.FDT()
+        dt.rootnode = fdt.Node('/', [fdt.PropStrings('model', ['board'])], [fdt.Node('child')])
+        blob = dt.to_dtb(version=17)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'test.dtb')
+            with open(file_path, 'wb') as f:
+                f.write(blob)
+            events = list(fdt.iter_dtb(file_path))
+            self.assertEqual(events[1][3], b'board\0')
+            with fdt.FDT.open_view(file_path) as view:
+                events = list(view.iter_events())
+                self.assertIsInstance(events[1][3], memoryview)
+                self.assertEqual(events[1][3].tobytes(), b'board\0')
+                for event in events:
+                    if event[3] is not None:
+                        event[3].release()
+            # the mapping is closed when the generator is closed early or fails
+            events = fdt.iter_dtb(file_path)
+            next(events)
+            value = next(events)[3]
+            self.assertTrue(is_mapped(file_path))
+            events.close()
+            self.assertFalse(is_mapped(file_path))
+            self.assertEqual(value, b'board\0')
+            with open(file_path, 'r+b') as f:
+                # unknown tag after the root node begin
+                f.seek(fdt.Header.parse(blob).off_dt_struct + 8)
+                f.write(struct.pack('>I', 0x10))
+            events = fdt.iter_dtb(file_path)
+            next(events)
+            with self.assertRaises(Exception):
+                next(events)
+            self.assertFalse(is_mapped(file_path))
+
+
+class ParseDtsTestCase(unittest.TestCase):
+
+    DTS = """/dts-v1/;
+/memreserve/ 0x10000000 0x4000;
+/ {
+    model = "Board; with {braces}", "quoted \\"name\\"";
+    empty;
+    mixed = "ab", <0x1>, [de ad];
+    bits = /bits/ 16 <0x1234 'a'>;
+    expr = <(1 << 4) (0x10 | 0x1) ((2 + 3) * 4) (-1) (1 ? 7 : 8) 010>;
+    bytes = [0102 03];
+    intc: interrupt-controller@1000 {
+        reg = <0x1000 0x100>;
+    };
+    dev@2000 {
+        interrupt-parent = <&intc>; // comment
+        clocks = <&clk 3>, <&{/clk@0} 4>;
+        target = &clk;
+        /* comment */
+        remove;
+        /delete-property/ remove;
+    };
+    doomed { };
+    /delete-node/ doomed;
+};
+&intc {
+    extra = "yes";
+};
+/ {
+    clk: clk@0 {
+        phandle = <0x5>;
+    };
+};
+"""
+
+    def test_values(self):
+        dt = fdt.parse_dts(self.DTS)
+        self.assertEqual(dt.entries, [{'address': 0x10000000, 'size': 0x4000}])
+        self.assertEqual(dt.get_property('/model').data, ['Board; with {braces}', 'quoted "name"'])
+        self.assertEqual(type(dt.get_property('/empty')), fdt.Property)
+        self.assertEqual(dt.get_property('/mixed'), fdt.PropBytes('mixed', b'ab\0\0\0\0\x01\xde\xad'))
+        self.assertEqual(dt.get_property('/bits'), fdt.PropWords('bits', [0x1234, 0x61], 16))
+        self.assertEqual(list(dt.get_property('/expr')), [0x10, 0x11, 0x14, 0xFFFFFFFF, 0x7, 0x8])
+        self.assertEqual(dt.get_property('/bytes').data, b'\x01\x02\x03')
+        self.assertIsNone(dt.get_node('/doomed'))
+        self.assertIsNone(dt.get_property('/dev@2000/remove'))
+
+    def test_references(self):
+        dt = fdt.parse_dts(self.DTS)
+        self.assertEqual(dt.get_node('/interrupt-controller@1000').labels, ['intc'])
+        self.assertEqual(dt.get_property('/interrupt-controller@1000/extra')[0], 'yes')
+        self.assertEqual(list(dt.get_property('/interrupt-controller@1000/phandle')), [0x1])
+        self.assertEqual(list(dt.get_property('/dev@2000/interrupt-parent')), [0x1])
+        self.assertEqual(list(dt.get_property('/dev@2000/clocks')), [0x5, 0x3, 0x5, 0x4])
+        self.assertEqual(dt.get_property('/dev@2000/target').data, ['/clk@0'])
+
+    def test_export(self):
+        dt = fdt.parse_dts(self.DTS)
+        text = dt.to_dts()
+        self.assertIn('intc: interrupt-controller@1000 {', text)
+        self.assertEqual(fdt.parse_dts(text).to_dts(), text)
+        self.assertEqual(fdt.parse_dtb(dt.to_dtb(17)).to_dtb(17), dt.to_dtb(17))
+
+    def test_errors(self):
+        with self.assertRaisesRegex(Exception, '<string>:3: '):
+            fdt.parse_dts('/dts-v1/;\n/ {\n    prop = <1 2 $>;\n};\n')
+        with self.assertRaisesRegex(Exception, 'non-existent'):
+            fdt.parse_dts('/ { prop = <&missing>; };')
+        # label of deleted node can't be referenced
+        with self.assertRaisesRegex(Exception, 'non-existent'):
+            fdt.parse_dts('/ { a: n { }; p = <&a>; };\n/delete-node/ &a;\n')
+        with self.assertRaisesRegex(Exception, 'non-existent'):
+            fdt.parse_dts('/ { a: n { }; p = <&a>; /delete-node/ n; };\n')
+
+    def test_strings(self):
+        dt = fdt.parse_dts('/ { s = "\u20ac", "x\\xff"; };')
+        self.assertEqual(dt.get_property('/s').data, b'\xe2\x82\xac\0x\xff\0')
+        dt = fdt.parse_dts('/ { empty = ""; list = "", "a"; };')
+        self.assertEqual(dt.get_property('/empty'), fdt.PropStrings('empty', ['']))
+        self.assertEqual(list(dt.get_property('/list')), ['', 'a'])
+        self.assertIn('empty = "";', dt.to_dts())
+        self.assertEqual(fdt.parse_dts(dt.to_dts()).to_dts(), dt.to_dts())
+
+    def test_root_labels(self):
+        dt = fdt.parse_dts('/dts-v1/;\nroot: / { n: node { }; };\nextra: &n { };\n/ { p = &root; };\n')
+        self.assertEqual(dt.rootnode.labels, ['root'])
+        self.assertEqual(dt.get_node('/node').labels, ['n', 'extra'])
+        self.assertEqual(dt.get_property('/p')[0], '/')
+        self.assertTrue(dt.to_dts().startswith('/dts-v1/;\n\nroot: / {'))
+        with self.assertRaisesRegex(Exception, 'Duplicate label'):
+            fdt.parse_dts('/ { n: node { }; };\nn: / { };\n')
+
+    def test_legacy_phandle(self):
+        dt = fdt.parse_dts('/ { n { linux,phandle = <1>; }; m { }; p = <&{/n} &{/m}>; };')
+        self.assertEqual(list(dt.get_property('/p')), [0x1, 0x2])
+
+
+class PhandleIndexTestCase(unittest.TestCase):
+
+    DTS = """/dts-v1/;
+/ {
+    clk: clock-controller { #clock-cells = <1>; };
+    intc: interrupt-controller { };
+    dev { interrupt-parent = <&intc>; clocks = <&clk 5 &clk 7>; };
+};
+"""
+
+    def test_resolve(self):
+        dt = fdt.parse_dts(self.DTS)
+        clk = dt.get_node('/clock-controller')
+        self.assertIs(dt.get_node_by_label('clk'), clk)
+        self.assertIs(dt.get_node_by_phandle(dt.phandles.get_phandle(clk)), clk)
+        self.assertEqual(dt.resolve('/dev/clocks'), [(clk, [5]), (clk, [7])])
+        self.assertEqual(dt.resolve('/dev/interrupt-parent'), [(dt.get_node('/interrupt-controller'), [])])
+        # index is refreshed after modification
+        phandle = dt.phandles.get_phandle(clk)
+        dt.rootnode.remove_subnode('clock-controller')
+        self.assertIsNone(dt.get_node_by_phandle(phandle))
+        dt.rootnode.append(fdt.Node('new', props=[fdt.PropWords('phandle', [phandle])]))
+        self.assertIs(dt.get_node_by_phandle(phandle), dt.get_node('/new'))
+        # missing label is found after the tree modification
+        self.assertIsNone(dt.get_node_by_label('uart'))
+        uart = fdt.Node('uart')
+        uart.labels.append('uart')
+        dt.rootnode.append(uart)
+        self.assertIs(dt.get_node_by_label('uart'), uart)
+        # a modification below already modified nodes expires the missing keys too
+        dt.get_node('/dev').append(fdt.Property('a'))
+        self.assertIsNone(dt.get_node_by_label('spi'))
+        self.assertIsNone(dt.get_node_by_phandle(0x100))
+        spi = fdt.Node('spi', [fdt.PropWords('phandle', [0x100])])
+        spi.labels.append('spi')
+        dt.get_node('/dev').append(spi)
+        self.assertIs(dt.get_node_by_label('spi'), spi)
+        self.assertIs(dt.get_node_by_phandle(0x100), spi)
+        with self.assertRaises(Exception):
+            dt.resolve('/dev/clocks')
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache(self):
+        inc_path = os.path.join(self.tmp_dir.name, 'inc.dtsi')
+        with open(inc_path, 'w') as f:
+            f.write('/ { prop = "a"; };')
+        text = '/dts-v1/;\n/ { node { }; };\n/include/ "inc.dtsi"\n'
+        cache = fdt.Cache(os.path.join(self.tmp_dir.name, 'cache'))
+        dt = cache.parse_dts(text, self.tmp_dir.name)
+        self.assertEqual(dt.to_dts(), fdt.parse_dts(text, self.tmp_dir.name).to_dts())
+        self.assertEqual(cache.parse_dts(text, self.tmp_dir.name).to_dts(), dt.to_dts())
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # changed include file invalidates the entry
+        with open(inc_path, 'w') as f:
+            f.write('/ { prop = "b"; };')
+        self.assertEqual(cache.parse_dts(text, self.tmp_dir.name).get_property('/prop')[0], 'b')
+        self.assertEqual(cache.misses, 2)
+        blob = dt.to_dtb(17)
+        self.assertEqual(cache.parse_dtb(blob).to_dts(), cache.parse_dtb(blob).to_dts())
+        # LRU eviction
+        cache.max_bytes = 1
+        cache.evict()
+        self.assertEqual(cache.size, 0)
+
+    def test_storage(self):
+        import pickle
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        cache = fdt.Cache(cache_dir, max_bytes=1)
+        blob = fdt.parse_dts('/dts-v1/;\n/ { prop = "a"; };\n').to_dtb(17)
+        # the source blob isn't stored with parsed object
+        self.assertNotIn(blob, pickle.dumps(fdt.parse_dtb(blob)))
+        cache.parse_dtb(blob)
+        cache.parse_dtb(blob + b'\0')
+        self.assertLessEqual(cache.size, 1)
+        if hasattr(os, 'getuid'):
+            self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+            os.chmod(cache_dir, 0o777)
+            with self.assertRaises(Exception):
+                fdt.Cache(cache_dir)
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.blob = fdt.parse_dts('/dts-v1/;\n/ { prop = "a"; };\n').to_dtb(17)
+        for name in ('a/x.dtb', 'b/x.dtb', 'b/y.dtb', 'b/bad.dtb'):
+            path = os.path.join(self.tmp_dir.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(self.blob[:16] if 'bad' in name else self.blob)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_jobs(self):
+        from fdt import tool
+        tmp_dir = self.tmp_dir.name
+        jobs = tool.batch_jobs([os.path.join(tmp_dir, '**', '*.dtb')], None, None)
+        self.assertEqual(len(jobs), 4)
+        self.assertIn((os.path.join(tmp_dir, 'b', 'y.dtb'), os.path.join(tmp_dir, 'b', 'y.dts')), jobs)
+        # the same output file of a/x.dtb and b/x.dtb
+        with self.assertRaisesRegex(Exception, 'same output'):
+            tool.batch_jobs([os.path.join(tmp_dir, '**', 'x.dtb')], None, os.path.join(tmp_dir, 'out'))
+        with self.assertRaisesRegex(Exception, 'No file matches'):
+            tool.batch_jobs([os.path.join(tmp_dir, '*.none')], None, None)
+        manifest = os.path.join(tmp_dir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('# comment\na/x.dtb out/ax.dts\n\nb/y.dtb  # no output\n')
+        self.assertEqual(tool.batch_jobs([], manifest, os.path.join(tmp_dir, 'out')),
+                         [(os.path.join(tmp_dir, 'a/x.dtb'), os.path.join(tmp_dir, 'out/ax.dts')),
+                          (os.path.join(tmp_dir, 'b/y.dtb'), os.path.join(tmp_dir, 'out', 'y.dts'))])
+        with open(manifest, 'w') as f:
+            f.write('a/x.dtb out/1.dts out/2.dts\n')
+        with self.assertRaisesRegex(Exception, 'Invalid manifest line'):
+            tool.batch_jobs([], manifest, None)
+
+    def test_command(self):
+        from click.testing import CliRunner
+        from fdt.cli import cli
+        tmp_dir = self.tmp_dir.name
+        out_dir = os.path.join(tmp_dir, 'out')
+        result = CliRunner().invoke(cli, ['batch', '-j', '1', '-o', out_dir, os.path.join(tmp_dir, 'b', '*.dtb')])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('FAIL', result.output)
+        self.assertIn('Converted 2 of 3 files', result.output)
+        with open(os.path.join(out_dir, 'y.dts')) as f:
+            self.assertEqual(fdt.parse_dts(f.read()).get_property('/prop')[0], 'a')
+
+    def test_cache(self):
+        from click.testing import CliRunner
+        from fdt import tool
+        from fdt.cli import cli
+        tmp_dir = self.tmp_dir.name
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        try:
+            # one cache of process is used by all files
+            tool.init_worker(cache_dir)
+            cache = tool.CACHE
+            for name in ('x', 'y'):
+                self.assertEqual(tool.convert_file(os.path.join(tmp_dir, 'b', name + '.dtb'),
+                                                   os.path.join(tmp_dir, name + '.dts'))[1], None)
+            self.assertIs(tool.CACHE, cache)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            cache.clear()
+            result = CliRunner().invoke(cli, ['-c', cache_dir, 'batch', '-j', '2', '-o', os.path.join(tmp_dir, 'out'),
+                                              os.path.join(tmp_dir, 'b', '*.dtb')])
+            self.assertIn('Converted 2 of 3 files', result.output)
+            self.assertEqual(len([name for name in os.listdir(cache_dir) if name.endswith(fdt.Cache.SUFFIX)]), 1)
+        finally:
+            tool.CACHE = None
+
+
+class AsyncLoadTestCase(unittest.TestCase):
+
+    def test_load(self):
+        import asyncio
+        from fdt import aio
+        blob = fdt.parse_dts('/dts-v1/;\n/ { prop = "a"; node { val = <1>; }; };\n').to_dtb(17)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for i, data in enumerate((blob, blob, blob[:50])):
+                paths.append(os.path.join(tmp_dir, '{}.dtb'.format(i)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(data)
+
+            async def load():
+                items = [item async for item in aio.iter_load(paths, 2, return_exceptions=True)]
+                with self.assertRaises(Exception):
+                    await aio.load_many(paths)
+                return items, await aio.load_many(paths[:2], concurrency=1)
+
+            items, dts = asyncio.run(load())
+        self.assertEqual(sorted(path for path, _ in items), paths)
+        self.assertIsInstance(dict(items)[paths[2]], Exception)
+        self.assertEqual([dt.get_property('/node/val')[0] for dt in dts], [1, 1])
+
+
+class ScanTestCase(unittest.TestCase):
+
+    def test_scan(self):
+        dt = fdt.parse_dts('/dts-v1/;\n/memreserve/ 0x1000 0x100;\n'
+                           '/ { model = "board"; compatible = "a,b", "a"; node { model = "x"; }; };\n')
+        blob = dt.to_dtb(17)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, name) for name in ('ok.dtb', 'bad.dtb', 'none.dtb')]
+            with open(paths[0], 'wb') as f:
+                f.write(blob)
+            with open(paths[1], 'wb') as f:
+                f.write(blob[:-8])
+            items = list(fdt.scan(paths))
+        self.assertTrue(items[0].valid)
+        self.assertEqual(items[0].header.total_size, len(blob))
+        self.assertEqual(items[0].entries, [{'address': 0x1000, 'size': 0x100}])
+        self.assertEqual(items[0].props['model'][0], 'board')
+        self.assertEqual(list(items[0].props['compatible']), ['a,b', 'a'])
+        self.assertFalse(items[1].valid)
+        self.assertFalse(items[2].valid)
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def test_server(self):
+        import threading
+        from fdt.client import Client
+        from fdt import tool
+        from fdt.server import Server
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dts_path = os.path.join(tmp_dir, 'in.dts')
+            with open(dts_path, 'w') as f:
+                f.write('/dts-v1/;\n/ { prop = "a"; node { val = <1>; }; };\n')
+            # other file and socket of running server are never removed
+            with open(os.path.join(tmp_dir, 'data'), 'w') as f:
+                f.write('data')
+            with self.assertRaises(Exception):
+                Server(os.path.join(tmp_dir, 'data'))
+            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, 'data')))
+            server = Server(os.path.join(tmp_dir, 's.sock'))
+            with self.assertRaises(Exception):
+                Server(server.socket_path)
+            self.assertIsNone(tool.CACHE)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                with Client(server.socket_path) as client:
+                    for _ in range(2):
+                        client.call('todtb', os.path.join(tmp_dir, 'out.dtb'), [dts_path], version=17)
+                    with self.assertRaises(Exception):
+                        client.call('todts', os.path.join(tmp_dir, 'x.dts'), [os.path.join(tmp_dir, 'none.dtb')])
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+            self.assertFalse(os.path.exists(server.socket_path))
+            self.assertEqual(server.cache.misses, 1)
+            with open(os.path.join(tmp_dir, 'out.dtb'), 'rb') as f:
+                self.assertEqual(fdt.parse_dtb(f.read()).get_property('/node/val')[0], 1)
+
+
+class OverlayTestCase(unittest.TestCase):
+
+    BASE = """/dts-v1/;
+/ {
+    intc: interrupt-controller { phandle = <0x3>; };
+    soc {
+        uart0: serial@1000 { status = "disabled"; };
+    };
+};
+"""
+
+    OVERLAY = """/dts-v1/;
+/plugin/;
+&uart0 {
+    status = "okay";
+    interrupt-parent = <&intc>;
+    dev: device { clocks = <&dev 0x1>; };
+};
+&{/soc} {
+    extra = "yes";
+};
+"""
+
+    def test_parse(self):
+        ov = fdt.parse_dts(self.OVERLAY)
+        self.assertEqual(ov.get_property('/fragment@1/target-path')[0], '/soc')
+        self.assertEqual(list(ov.get_property('/fragment@0/target')), [0xFFFFFFFF])
+        self.assertEqual(ov.get_property('/__fixups__/uart0').data, ['/fragment@0:target:0'])
+        self.assertEqual(ov.get_property('/__fixups__/intc').data, ['/fragment@0/__overlay__:interrupt-parent:0'])
+        self.assertEqual(list(ov.get_property('/__local_fixups__/fragment@0/__overlay__/device/clocks')), [0])
+        self.assertEqual(ov.get_property('/__symbols__/dev').data, ['/fragment@0/__overlay__/device'])
+        dt = fdt.parse_dts(self.BASE, symbols=True)
+        self.assertEqual(dt.get_property('/__symbols__/uart0').data, ['/soc/serial@1000'])
+
+    def test_apply(self):
+        dt = fdt.parse_dts(self.BASE)
+        ov = fdt.parse_dtb(fdt.parse_dts(self.OVERLAY).to_dtb(version=17))
+        dt.apply_overlays([ov, ov])
+        self.assertEqual(dt.get_property('/soc/serial@1000/status')[0], 'okay')
+        self.assertEqual(list(dt.get_property('/soc/serial@1000/interrupt-parent')), [0x3])
+        self.assertEqual(dt.get_property('/soc/extra')[0], 'yes')
+        # local phandles are moved above the base ones, the second pass gets the next ones
+        self.assertEqual(list(dt.get_property('/soc/serial@1000/device/clocks')), [0x6, 0x1])
+        self.assertEqual(list(dt.get_property('/soc/serial@1000/device/phandle')), [0x6])
+        self.assertEqual(list(dt.get_property('/soc/serial@1000/phandle')), [0x5])
+        self.assertEqual(dt.get_property('/__symbols__/dev').data, ['/soc/serial@1000/device'])
+        self.assertEqual(len(fdt.parse_dts(self.OVERLAY).rootnode.nodes), 5)
+        with self.assertRaisesRegex(Exception, 'symbol "uart0" not found'):
+            fdt.parse_dts('/ { };').apply_overlay(ov)
+
+
+class FDTViewTestCase(unittest.TestCase):
+
+    def setUp(self):
+        root = fdt.Node('/')
+        root.append(fdt.PropStrings('model', ['test']))
+        root.append(fdt.Node('chosen', [fdt.PropStrings('bootargs', ['console=ttyS0'])]))
+        root.append(fdt.Node('soc', [fdt.PropWords('reg', [0x1, 0x2])]))
+        root.append(fdt.Node('i2c@30a20000', [fdt.PropBytes('data', [0x10, 0x50, 0x01])]), 'soc')
+        self.fdt_a = fdt.FDT()
+        self.fdt_a.rootnode = root
+        self.blob = self.fdt_a.to_dtb(version=17)
+
+    def tearDown(self):
+        pass
+
+    def test_lookup(self):
+        with fdt.FDT.open_view(self.blob) as view:
+            self.assertEqual(view.header.version, 17)
+            self.assertEqual(view.get_property('/chosen/bootargs'), fdt.PropStrings('bootargs', ['console=ttyS0']))
+            self.assertEqual(view.get_node('/soc').node_names, ['i2c@30a20000'])
+            self.assertEqual(view.get_value('/soc/reg').tobytes(), struct.pack('>II', 0x1, 0x2))
+            self.assertIsNone(view.get_node('/soc/i2c@0'))
+            self.assertIsNone(view.get_property('/chosen/stdout-path'))
+            # the visited nodes are kept, so they aren't scanned again
+            self.assertIs(view.get_node('/soc/i2c@30a20000'), view.get_node('/soc/i2c@30a20000'))
+            self.assertIs(view.rootnode.nodes[1], view.get_node('/soc'))
+
+    def test_materialize(self):
+        view = fdt.FDT.open_view(self.blob)
+        self.assertEqual(view.to_fdt().to_dts(), fdt.parse_dtb(self.blob).to_dts())
+        self.assertEqual(view.get_node('/soc/i2c@30a20000').to_node(), self.fdt_a.rootnode.get_subnode('soc/i2c@30a20000'))
+        view.close()
+
+
+class PathIndexTestCase(unittest.TestCase):
+
+    setUp = FDTViewTestCase.setUp
+
+    def test_parse_index(self):
+        fdt_b = fdt.parse_dtb(self.blob, index=True)
+        self.assertEqual(fdt_b.index, fdt.PathIndex.build(self.blob))
+        self.assertEqual(fdt_b.index.paths, ['/', '/chosen', '/soc', '/soc/i2c@30a20000'])
+        self.assertIs(fdt_b.get_node('/soc/i2c@30a20000'), fdt_b.rootnode.get_subnode('soc/i2c@30a20000'))
+        self.assertEqual(fdt_b.get_property('/chosen/bootargs')[0], 'console=ttyS0')
+        fdt_b.rootnode.remove_subnode('soc')
+        self.assertIsNone(fdt_b.get_node('/soc/i2c@30a20000'))
+
+    def test_export(self):
+        index = fdt.PathIndex.parse(fdt.PathIndex.build(self.blob).export())
+        self.assertEqual(index, fdt.PathIndex.build(self.blob))
+        with fdt.FDT.open_view(self.blob, index.export()) as view:
+            self.assertEqual(view.get_node('/soc/i2c@30a20000').prop_names, ['data'])
+            self.assertEqual(view.get_property('/chosen/bootargs')[0], 'console=ttyS0')
+            self.assertIsNone(view.get_node('/soc/i2c@0'))
+            self.assertIs(view.get_node('/soc/i2c@30a20000/'), view.get_node('soc/i2c@30a20000'))
+
+
+
+class ImportTestCase(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        import sys
+        import subprocess
+        code = "import sys, fdt; print(' '.join(sorted({'copy', 're', 'hashlib'} & set(sys.modules))))"
+        result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file